@@ -2,6 +2,8 @@
 import requests
 import json
 import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
 
 # --- Configuration ---
@@ -17,6 +19,11 @@ GEMINI_API_KEY = os.getenv("GOOGLE_API_KEY")
 # Default to Flash for speed, user can override to 'gemini-1.5-pro' etc.
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash") 
 
+# LLM calls block for up to 180s; they get their own small pool so they never
+# occupy the threads the API needs for anything else.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "2"))
+_llm_executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix="llm")
+
 # --- Helper Functions ---
 
 def clean_email_body(text: str) -> str:
@@ -182,3 +189,10 @@ def generate_thread_summary(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
         return generate_with_gemini(prompt)
     else:
         return generate_with_ollama(prompt)
+
+async def generate_thread_summary_async(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Awaitable generate_thread_summary for the API: runs on the LLM executor.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_llm_executor, generate_thread_summary, messages)
@@ -0,0 +1,159 @@
+"""
+Compressed store for message bodies (message_bodies table).
+
+Bodies live outside the hot messages table so list queries only touch small
+rows; messages keeps a short precomputed snippet. Bodies are compressed with
+zstd, using the newest dictionary trained on our own mail when there is one
+(scripts/migrate_bodies.py --train-dict), or zlib when the zstandard package
+isn't installed. The codec is recorded per row, so either can be read back.
+
+messages.content_body now only holds the 'Pending extraction' marker, or a
+body written by an older importer that hasn't been moved yet; readers fall
+back to it.
+"""
+import hashlib
+import threading
+import zlib
+
+from sqlalchemy import text
+
+from .pipeline import chunked
+
+try:
+    import zstandard
+except ImportError:  # optional: zlib is used instead
+    zstandard = None
+
+PENDING_BODY = "Pending extraction"
+SNIPPET_CHARS = 200
+ZSTD_LEVEL = 9
+ZLIB_LEVEL = 6
+DICT_SIZE = 112 * 1024
+
+# SQL predicate (messages aliased as m): the message has a non-empty body,
+# either in the store (non-empty snippet) or still inline
+HAS_BODY_SQL = f"(m.snippet != '' OR m.content_body NOT IN ('{PENDING_BODY}', ''))"
+
+_dict_lock = threading.Lock()
+_dict_cache = {}  # dict_id -> zstandard.ZstdCompressionDict
+
+
+def make_snippet(body, length=SNIPPET_CHARS):
+    if not body or body == PENDING_BODY:
+        return ""
+    return body[:length]
+
+
+def _load_dict(conn, dict_id):
+    with _dict_lock:
+        if dict_id in _dict_cache:
+            return _dict_cache[dict_id]
+    data = conn.execute(text("SELECT data FROM body_dicts WHERE id = :id"), {"id": dict_id}).scalar()
+    zdict = zstandard.ZstdCompressionDict(bytes(data))
+    with _dict_lock:
+        _dict_cache[dict_id] = zdict
+    return zdict
+
+
+def latest_dict_id(conn):
+    return conn.execute(text("SELECT MAX(id) FROM body_dicts")).scalar()
+
+
+class BodyCompressor:
+    """Compressor for one batch of writes (not thread-safe; make one per batch)."""
+
+    def __init__(self, conn):
+        self.dict_id = None
+        self._zstd = None
+        if zstandard is not None:
+            self.dict_id = latest_dict_id(conn)
+            zdict = _load_dict(conn, self.dict_id) if self.dict_id else None
+            self._zstd = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=zdict)
+
+    def compress(self, body):
+        raw = body.encode("utf-8")
+        if self._zstd is not None:
+            return "zstd", self.dict_id, self._zstd.compress(raw)
+        return "zlib", None, zlib.compress(raw, ZLIB_LEVEL)
+
+
+def decompress_body(conn, codec, dict_id, blob):
+    if blob is None:
+        return None
+    blob = bytes(blob)
+    if codec == "zlib":
+        return zlib.decompress(blob).decode("utf-8")
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("message body is zstd-compressed but the zstandard package is not installed")
+        zdict = _load_dict(conn, dict_id) if dict_id else None
+        return zstandard.ZstdDecompressor(dict_data=zdict).decompress(blob).decode("utf-8")
+    return blob.decode("utf-8")  # 'raw'
+
+
+def body_hash(body):
+    """Stored with each body: lets readers tell changed bodies apart without decompressing."""
+    return hashlib.sha1((body or "").encode("utf-8")).hexdigest()
+
+
+def store_bodies(conn, bodies):
+    """
+    Write {messages.id: body text} into the body store, refresh the snippets
+    and clear the inline copies. Runs in the caller's transaction.
+    """
+    compressor = BodyCompressor(conn)
+    items = list(bodies.items())
+    for chunk in chunked(items):
+        rows = []
+        for pk, body in chunk:
+            codec, dict_id, blob = compressor.compress(body or "")
+            rows.append({
+                "id": pk, "codec": codec, "dict_id": dict_id, "body": blob,
+                "hash": body_hash(body), "snippet": make_snippet(body),
+            })
+        ids_str = ",".join(str(r["id"]) for r in rows)
+        conn.execute(text(f"DELETE FROM message_bodies WHERE message_id IN ({ids_str})"))
+        conn.execute(text("""
+            INSERT INTO message_bodies (message_id, codec, dict_id, body, body_hash)
+            VALUES (:id, :codec, :dict_id, :body, :hash)
+        """), rows)
+        conn.execute(text("UPDATE messages SET snippet = :snippet, content_body = NULL WHERE id = :id"), rows)
+    return len(items)
+
+
+def store_bodies_by_message_id(conn, bodies):
+    """Same as store_bodies, keyed by Message-ID header values."""
+    pk_bodies = {}
+    mids = list(bodies)
+    for chunk in chunked(mids):
+        params = {f"m{i}": mid for i, mid in enumerate(chunk)}
+        placeholders = ",".join(f":m{i}" for i in range(len(chunk)))
+        for pk, mid in conn.execute(text(f"SELECT id, message_id FROM messages WHERE message_id IN ({placeholders})"), params):
+            pk_bodies[pk] = bodies[mid]
+    return store_bodies(conn, pk_bodies)
+
+
+def fetch_bodies(conn, message_ids):
+    """
+    {messages.id: body text} for the given messages (None when there is no body).
+    Accepts a Connection or Session; async callers go through AsyncSession.run_sync.
+    """
+    out = {}
+    for chunk in chunked(sorted(set(message_ids))):
+        ids_str = ",".join(str(int(i)) for i in chunk)
+        rows = conn.execute(text(f"""
+            SELECT m.id, m.content_body, b.codec, b.dict_id, b.body
+            FROM messages m
+            LEFT JOIN message_bodies b ON b.message_id = m.id
+            WHERE m.id IN ({ids_str})
+        """)).fetchall()
+        for pk, inline, codec, dict_id, blob in rows:
+            out[pk] = decompress_body(conn, codec, dict_id, blob) if blob is not None else inline
+    return out
+
+
+def train_dictionary(samples, size=DICT_SIZE):
+    """Train a zstd dictionary from sample bodies; returns its raw bytes."""
+    if zstandard is None:
+        raise RuntimeError("training a body dictionary needs the zstandard package")
+    return zstandard.train_dictionary(size, [s.encode("utf-8") for s in samples]).as_bytes()
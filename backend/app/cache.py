@@ -0,0 +1,166 @@
+"""
+In-process response cache for the read-heavy GET endpoints.
+
+Entries are keyed by path + query string + the global data version
+(data_version table), which pipeline stages and settings writes bump, so
+nothing is ever served across a data change. Every cached response carries a
+weak ETag (the compression middleware sends the same data gzip'd, br'd or
+as is: equivalent, not byte-identical) and Vary: Accept-Encoding; a
+matching If-None-Match is answered with 304 and no body.
+
+Responses marked Cache-Control: no-store (error fallbacks) aren't cached,
+nor is a response whose data version moved while it was being built.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import text
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import Response
+
+from .models import async_engine
+
+CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+# How long a read of data_version is trusted before re-checking the DB.
+# Pipeline scripts run in other processes, so their bumps show up within this window.
+VERSION_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_VERSION_TTL", "1.0"))
+
+CACHEABLE_PATHS = [
+    re.compile(r"^/stats$"),
+    re.compile(r"^/contacts$"),
+    re.compile(r"^/threads$"),
+    re.compile(r"^/messages$"),
+    re.compile(r"^/threads/\d+/messages$"),
+    re.compile(r"^/threads/\d+/bodies$"),
+]
+
+# Headers worth replaying from a cached response (content-length is recomputed)
+REPLAY_HEADERS = ("content-type", "x-next-cursor")
+
+
+class LRUCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+response_cache = LRUCache(CACHE_MAX_ENTRIES)
+
+_version_lock = threading.Lock()
+_version_state = {"value": None, "checked_at": 0.0}
+
+
+async def read_data_version():
+    try:
+        async with async_engine.connect() as conn:
+            return (await conn.execute(text("SELECT version FROM data_version WHERE id = 1"))).scalar() or 0
+    except Exception:
+        # Table not created yet (pipeline never ran on this DB) -> don't cache
+        return None
+
+
+async def current_data_version():
+    now = time.monotonic()
+    with _version_lock:
+        if _version_state["value"] is not None and now - _version_state["checked_at"] < VERSION_TTL_SECONDS:
+            return _version_state["value"]
+    version = await read_data_version()
+    note_data_version(version)
+    return version
+
+
+def note_data_version(version):
+    """Record a version seen or produced by this process; drops entries of older versions."""
+    with _version_lock:
+        if version != _version_state["value"]:
+            response_cache.clear()
+        _version_state["value"] = version
+        _version_state["checked_at"] = time.monotonic()
+
+
+def make_etag(version, body):
+    return f'W/"v{version}-{hashlib.sha1(body).hexdigest()[:16]}"'
+
+
+def _opaque_tag(tag):
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def etag_matches(if_none_match, etag):
+    # Weak comparison, as If-None-Match specifies
+    if not if_none_match:
+        return False
+    tags = {_opaque_tag(t.strip()) for t in if_none_match.split(",")}
+    return "*" in tags or _opaque_tag(etag) in tags
+
+
+class ResponseCacheMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        if request.method != "GET" or not any(p.match(request.url.path) for p in CACHEABLE_PATHS):
+            return await call_next(request)
+
+        version = await current_data_version()
+        if version is None:
+            return await call_next(request)
+
+        query = "&".join(sorted(request.url.query.split("&"))) if request.url.query else ""
+        key = (request.url.path, query, version)
+        if_none_match = request.headers.get("if-none-match")
+
+        entry = response_cache.get(key)
+        if entry is None:
+            response = await call_next(request)
+            if response.status_code != 200 or "no-store" in response.headers.get("cache-control", ""):
+                return response
+            body = b"".join([chunk async for chunk in response.body_iterator])
+            headers = {k: v for k, v in response.headers.items() if k in REPLAY_HEADERS}
+            entry = {"body": body, "headers": headers, "etag": make_etag(version, body)}
+            # A bump while the handler ran: the body may hold either version's data
+            latest = await read_data_version()
+            note_data_version(latest)
+            if latest == version:
+                response_cache.put(key, entry)
+            cache_status = "MISS"
+        else:
+            cache_status = "HIT"
+
+        headers = dict(entry["headers"])
+        headers["etag"] = entry["etag"]
+        headers["cache-control"] = "no-cache" # Always revalidate; 304 keeps it cheap
+        headers["vary"] = "Accept-Encoding"
+        headers["x-cache"] = cache_status
+
+        if etag_matches(if_none_match, entry["etag"]):
+            headers.pop("content-type", None)
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry["body"], status_code=200, headers=headers)
@@ -0,0 +1,110 @@
+"""
+Thread and contact centroid vectors, for "who did I talk to about X".
+
+A thread's vector is the recency-weighted mean of its message vectors; a
+contact's is the mean of its thread vectors weighted by recency and thread
+score. Both are exported as collections of the local vector index
+("threads", "contacts"), so relationship search is a single k-NN query
+over a few thousand vectors instead of a message search plus regrouping.
+
+Recency halves every CENTROID_HALF_LIFE_DAYS, counted back from the newest
+embedded message rather than from today, so an archive that stopped
+growing keeps the same weighting. Rebuilt from message_embeddings by
+scripts/generate_embeddings.py on every run (scores change without any
+text changing).
+"""
+import math
+
+import numpy as np
+from sqlalchemy import select, func
+
+from .models import Message, Thread, MessageEmbedding
+from .embeddings import from_blob
+from .vector_store import IndexWriter, VECTOR_DTYPE
+
+CENTROID_HALF_LIFE_DAYS = 365
+THREAD_PAGE = 500
+
+
+def recency_weights(timestamps, newest):
+    age_days = np.maximum(newest - timestamps, 0) / 86400.0
+    return np.power(0.5, age_days / CENTROID_HALF_LIFE_DAYS)
+
+
+def thread_weight(recency, score):
+    """How much a thread counts towards its contact's vector."""
+    return recency * (1.0 + math.log1p(max(score or 0.0, 0.0)))
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def export_centroids(conn, dtype=VECTOR_DTYPE, model=None, build_ann=None):
+    """Write new versions of the "threads" and "contacts" collections. Returns their metas."""
+    embedded = (
+        select(Message.thread_id)
+        .join(MessageEmbedding, MessageEmbedding.message_id == Message.id)
+    )
+    newest = conn.execute(
+        select(func.max(Message.sent_at)).join(MessageEmbedding, MessageEmbedding.message_id == Message.id)
+    ).scalar()
+    newest_ts = newest.timestamp() if newest else 0.0
+    thread_count = conn.execute(
+        select(func.count(func.distinct(Message.thread_id))).join(MessageEmbedding, MessageEmbedding.message_id == Message.id)
+    ).scalar()
+
+    thread_writer = None
+    contact_sums = {}
+    dim = 0
+    last_thread = 0
+    while True:
+        thread_ids = conn.execute(
+            embedded.where(Message.thread_id > last_thread)
+            .group_by(Message.thread_id).order_by(Message.thread_id).limit(THREAD_PAGE)
+        ).scalars().all()
+        if not thread_ids:
+            break
+        last_thread = thread_ids[-1]
+        rows = conn.execute(
+            select(Message.thread_id, Thread.contact_id, Thread.score, Message.sent_at, MessageEmbedding.vector)
+            .join(MessageEmbedding, MessageEmbedding.message_id == Message.id)
+            .join(Thread, Thread.id == Message.thread_id)
+            .where(Message.thread_id.between(thread_ids[0], thread_ids[-1]))
+            .order_by(Message.thread_id)
+        ).all()
+        vectors = np.stack([from_blob(r.vector) for r in rows]).astype(np.float32)
+        if thread_writer is None:
+            dim = vectors.shape[1]
+            thread_writer = IndexWriter("threads", thread_count, dim, dtype=dtype, model=model)
+
+        thread_of = np.array([r.thread_id for r in rows])
+        sent = np.array([r.sent_at.timestamp() if r.sent_at else newest_ts for r in rows])
+        starts = np.flatnonzero(np.r_[True, thread_of[1:] != thread_of[:-1]])
+        sums = np.add.reduceat(vectors * recency_weights(sent, newest_ts)[:, None], starts, axis=0)
+        centroids = _normalize(sums)
+        latest = np.maximum.reduceat(sent, starts)
+        thread_writer.add(thread_of[starts], centroids)
+
+        thread_recency = recency_weights(latest, newest_ts)
+        for i, start in enumerate(starts):
+            contact_id, score = rows[start].contact_id, rows[start].score
+            weighted = centroids[i] * thread_weight(thread_recency[i], score)
+            if contact_id in contact_sums:
+                contact_sums[contact_id] += weighted
+            else:
+                contact_sums[contact_id] = weighted
+
+    if thread_writer is None:
+        thread_writer = IndexWriter("threads", 0, 0, dtype=dtype, model=model)
+    metas = {"threads": thread_writer.commit(build_ann=build_ann)}
+
+    contact_ids = sorted(contact_sums)
+    contact_writer = IndexWriter("contacts", len(contact_ids), dim, dtype=dtype, model=model)
+    for start in range(0, len(contact_ids), THREAD_PAGE):
+        ids = contact_ids[start:start + THREAD_PAGE]
+        contact_writer.add(ids, _normalize(np.stack([contact_sums[c] for c in ids])))
+    metas["contacts"] = contact_writer.commit(build_ann=build_ann)
+    return metas
@@ -0,0 +1,115 @@
+"""
+Response compression for bodies above a size threshold: brotli when the
+client accepts it and the brotli package is installed, Starlette's
+GZipMiddleware otherwise.
+
+Both stream: a response is compressed chunk by chunk as the app sends it,
+never held in memory whole, and responses that aren't compressible (already
+encoded, other content types, a single chunk under the threshold) pass
+straight through.
+
+Sits outside the response cache, so cached entries stay uncompressed and
+304s pass through untouched.
+"""
+import os
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipMiddleware
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+
+def accepts_brotli(accept_encoding):
+    accepted = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+    return brotli is not None and "br" in accepted
+
+
+def merge_vary(headers):
+    """Drop repeated Vary values (the response cache already sends Accept-Encoding)."""
+    if "vary" in headers:
+        values = []
+        for value in headers["vary"].split(","):
+            if value.strip() and value.strip().lower() not in (v.lower() for v in values):
+                values.append(value.strip())
+        headers["vary"] = ", ".join(values)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size=COMPRESS_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=GZIP_LEVEL)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if accepts_brotli(Headers(scope=scope).get("accept-encoding", "")):
+            return await BrotliResponder(self.app, self.minimum_size)(scope, receive, send)
+
+        async def send_merged(message):
+            if message["type"] == "http.response.start":
+                merge_vary(MutableHeaders(raw=message["headers"]))
+            await send(message)
+
+        await self.gzip(scope, receive, send_merged)
+
+
+class BrotliResponder:
+    """One response, brotli-compressed as the app sends it."""
+
+    def __init__(self, app, minimum_size):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.send = None
+        self.start = None  # held until the first body chunk decides
+        self.compressor = None  # None: passing through
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body":
+            return await self.send(message)
+        body, more_body = message.get("body", b""), message.get("more_body", False)
+
+        if self.start is not None:
+            start, self.start = self.start, None
+            headers = MutableHeaders(raw=list(start["headers"]))
+            if (
+                "content-encoding" in headers
+                or not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+                or (not more_body and len(body) < self.minimum_size)
+            ):
+                await self.send(start)
+                return await self.send(message)
+            self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            headers["content-encoding"] = "br"
+            headers.add_vary_header("Accept-Encoding")
+            merge_vary(headers)
+            del headers["content-length"]
+            if not more_body:
+                # The whole response in one chunk: its compressed length is known
+                body = self.compressor.process(body) + self.compressor.finish()
+                headers["content-length"] = str(len(body))
+                await self.send({**start, "headers": headers.raw})
+                return await self.send({"type": "http.response.body", "body": body})
+            await self.send({**start, "headers": headers.raw})
+
+        if self.compressor is None:
+            return await self.send(message)
+        chunk = self.compressor.process(body)
+        if not more_body:
+            chunk += self.compressor.finish()
+        await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
@@ -0,0 +1,192 @@
+"""
+The sentence embedding model, shared by the pipeline
+(scripts/generate_embeddings.py) and /search. Vectors come back as
+L2-normalized float32, so a dot product is the cosine similarity.
+
+The model (and torch) are only imported on first use: keyword search and
+the rest of the API never pay for them.
+
+EMBEDDING_BACKEND=onnx runs the same model through ONNX Runtime with
+dynamic int8 quantization (pip install "sentence-transformers[onnx]"),
+several times faster on CPU. The quantized model is exported once into
+ONNX_MODEL_DIR. Its vectors have to stay close enough to the torch ones to
+share an index: scripts/check_embedding_parity.py measures how close and,
+when they pass, records the result next to the export. The backend refuses
+to load an export without that record.
+
+Long bodies are also split into overlapping passages, each with its own
+vector, so text past the model's 128-token window stays searchable.
+
+encode() sorts its inputs by length and sizes each batch to a character
+budget, so short mails go through in large batches and are never padded to
+the length of a long one.
+"""
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+
+import numpy as np
+
+from .utils import clean_quote
+
+MODEL_NAME = 'paraphrase-multilingual-mpnet-base-v2'
+EMBEDDING_DIM = 768
+ENCODE_BATCH_SIZE = 32
+# The model truncates at 128 tokens; longer text is tokenized for nothing
+# (split_passages() covers the rest)
+EMBED_MAX_CHARS = 2000
+# Per batch: len(batch) * longest text in it, in characters
+BATCH_CHAR_BUDGET = ENCODE_BATCH_SIZE * EMBED_MAX_CHARS
+MAX_BATCH_SIZE = 256
+PASSAGE_CHARS = 400
+PASSAGE_OVERLAP = 80
+MAX_PASSAGES = 16  # per message: bounds the text encoded for very long mail
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")  # 'torch' | 'onnx'
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", os.path.expanduser("~/.cache/pastlead/onnx"))
+# onnxruntime quantization config: 'avx2', 'avx512', 'avx512_vnni' or 'arm64'
+ONNX_QUANTIZATION = os.getenv("ONNX_QUANTIZATION", "avx2")
+# Inference threads of the ONNX Runtime session (default: one per core).
+# generate_embeddings.py --workers sets it for each worker.
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0")) or None
+# Written by scripts/check_embedding_parity.py into onnx_model_path() on a pass
+ONNX_PARITY_FILE = "parity.json"
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_device():
+    import torch
+    if torch.backends.mps.is_available():
+        return "mps"
+    elif torch.cuda.is_available():
+        return "cuda"
+    return "cpu"
+
+
+def onnx_model_path():
+    return os.path.join(ONNX_MODEL_DIR, MODEL_NAME)
+
+
+def onnx_parity_path():
+    return os.path.join(onnx_model_path(), f"{ONNX_QUANTIZATION}.{ONNX_PARITY_FILE}")
+
+
+def load_onnx_model(threads=EMBEDDING_THREADS):
+    import onnxruntime
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+    path = onnx_model_path()
+    file_name = f"onnx/model_qint8_{ONNX_QUANTIZATION}.onnx"
+    if not os.path.exists(os.path.join(path, file_name)):
+        print(f"🧠 Exporting {MODEL_NAME} to int8 ONNX ({ONNX_QUANTIZATION}) in {path}...")
+        exported = SentenceTransformer(MODEL_NAME, backend="onnx", device="cpu")
+        exported.save_pretrained(path)
+        export_dynamic_quantized_onnx_model(exported, ONNX_QUANTIZATION, path)
+    # ONNX Runtime sizes its own thread pool: OMP_NUM_THREADS & co. don't reach it
+    options = onnxruntime.SessionOptions()
+    if threads:
+        options.intra_op_num_threads = threads
+    return SentenceTransformer(
+        path, backend="onnx", device="cpu",
+        model_kwargs={"file_name": file_name, "session_options": options},
+    )
+
+
+def load_model(backend=EMBEDDING_BACKEND, device=None):
+    if backend == "onnx":
+        return load_onnx_model()
+    if backend != "torch":
+        raise ValueError(f"unknown EMBEDDING_BACKEND {backend!r}")
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(MODEL_NAME, device=device or get_device())
+
+
+def get_model(device=None):
+    global _model
+    with _model_lock:
+        if _model is None:
+            if EMBEDDING_BACKEND == "onnx" and not os.path.exists(onnx_parity_path()):
+                raise RuntimeError(
+                    f"EMBEDDING_BACKEND=onnx: no passing parity check recorded for {onnx_model_path()} "
+                    f"({ONNX_QUANTIZATION}); run scripts/check_embedding_parity.py first"
+                )
+            print(f"🧠 Loading embedding model {MODEL_NAME} ({EMBEDDING_BACKEND})...")
+            _model = load_model(device=device)
+        return _model
+
+
+def embedding_text(body):
+    """The text that gets embedded: quotes stripped, NFKC, whitespace collapsed."""
+    text = unicodedata.normalize("NFKC", clean_quote(body))
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def split_passages(text):
+    """
+    Overlapping windows over a long embedding_text(), cut at a space or 。
+    where possible. [] when the message vector already covers the text.
+    """
+    if len(text) <= PASSAGE_CHARS:
+        return []
+    passages = []
+    start = 0
+    while len(passages) < MAX_PASSAGES:
+        end = min(start + PASSAGE_CHARS, len(text))
+        if end < len(text):
+            cut = max(text.rfind(" ", start + PASSAGE_CHARS // 2, end), text.rfind("。", start + PASSAGE_CHARS // 2, end))
+            if cut > 0:
+                end = cut + 1
+        passages.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        start = end - PASSAGE_OVERLAP
+    return passages
+
+
+def content_hash(text):
+    """Stored next to each vector; an unchanged hash means no re-encode."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def length_batches(texts, char_budget=BATCH_CHAR_BUDGET, max_batch=MAX_BATCH_SIZE):
+    """Index lists of similar-length texts, longest first, each within the budget."""
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+    batch, longest = [], 0
+    for i in order:
+        longest = longest or max(len(texts[i]), 1)
+        if batch and ((len(batch) + 1) * longest > char_budget or len(batch) == max_batch):
+            yield batch
+            batch, longest = [], max(len(texts[i]), 1)
+        batch.append(i)
+    if batch:
+        yield batch
+
+
+def model_loaded():
+    return _model is not None
+
+
+def encode(texts, model=None):
+    """(len(texts), EMBEDDING_DIM) float32 array of unit vectors."""
+    texts = list(texts)
+    if model is None:
+        model = get_model()
+    vectors = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    for batch in length_batches(texts):
+        vectors[batch] = model.encode(
+            [texts[i] for i in batch], batch_size=len(batch), show_progress_bar=False,
+            convert_to_numpy=True, normalize_embeddings=True,
+        )
+    return vectors
+
+
+def to_blob(vector):
+    """Storage format of message_embeddings.vector: little-endian float16."""
+    return np.asarray(vector, dtype="<f2").tobytes()
+
+
+def from_blob(blob):
+    return np.frombuffer(blob, dtype="<f2")
@@ -0,0 +1,183 @@
+"""
+Keyword search index (SQLite FTS5) over messages.
+
+messages_fts holds, per message (rowid = messages.id), the decoded subject,
+the body and the sender's name + address, NFKC-normalized so full-width /
+half-width forms match. The trigram tokenizer needs no word segmentation,
+which suits Japanese: any substring of 3+ characters is an index lookup.
+
+Trigrams can't look up shorter terms (e.g. 見積, 契約), so messages_fts_bigrams
+indexes the same text as character bigrams: each whitespace-separated run
+becomes its overlapping 2-character pieces plus its last character alone
+(見積書 -> 見積 積書 書). A 2-character term is then one token lookup and a
+1-character term a prefix query. The table is contentless (text is kept once,
+in messages_fts); a deleted message's text waits in messages_fts_removed
+until the sync removes its bigrams.
+
+Bodies are compressed in the body store, so triggers can't index them
+directly. Triggers on messages, message_bodies, threads and contacts queue
+the affected message ids in messages_fts_pending (deletes are applied at
+once), and index_pending_messages() indexes the queue in batches
+(scripts/sync_search_index.py, run after each pipeline stage).
+
+The tables, the bm25 column weights (subject 5, body 1, sender 2) and the
+triggers are created by migrations 7 and 11 in app/migrations.py; changing
+them takes a new migration.
+"""
+import html
+import re
+import unicodedata
+
+from sqlalchemy import text
+
+from .body_store import fetch_bodies, PENDING_BODY
+from .utils import display_text
+
+FTS_BODY_CHARS = 20000  # index the head of very long bodies only
+SYNC_BATCH_SIZE = 1000
+SNIPPET_TOKENS = 24
+
+# Private-use markers around matches; swapped for <mark> after HTML-escaping
+MARK_OPEN, MARK_CLOSE = "\ue000", "\ue001"
+
+def search_text(value):
+    return unicodedata.normalize("NFKC", value or "").replace("\x00", "")
+
+
+def has_search_index(conn):
+    return conn.dialect.name == "sqlite" and conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")
+    ).first() is not None
+
+
+def bigram_text(value):
+    """Each whitespace-separated run as its character bigrams plus its last character."""
+    pieces = []
+    for run in value.split():
+        pieces.extend(run[i:i + 2] for i in range(len(run) - 1))
+        pieces.append(run[-1])
+    return " ".join(pieces)
+
+
+def _bigram_rows(rows):
+    return [{"id": pk, "bigrams": bigram_text(f"{subject}\n{body}\n{sender}")} for pk, subject, body, sender in rows]
+
+
+def _delete_bigrams(conn, rows):
+    # Contentless table: a row is deleted by supplying the text it was indexed with
+    if rows:
+        conn.execute(text(
+            "INSERT INTO messages_fts_bigrams (messages_fts_bigrams, rowid, bigrams) VALUES ('delete', :id, :bigrams)"
+        ), _bigram_rows(rows))
+
+
+def clear_search_index(conn):
+    """Empty both indexes (before re-queueing every message)."""
+    conn.execute(text("DELETE FROM messages_fts"))
+    conn.execute(text("INSERT INTO messages_fts_bigrams (messages_fts_bigrams) VALUES ('delete-all')"))
+    conn.execute(text("DELETE FROM messages_fts_removed"))
+
+
+def index_pending_messages(conn, batch_size=SYNC_BATCH_SIZE):
+    """
+    (Re)index one batch of queued messages, after dropping the bigrams of a
+    batch of deleted ones. Runs in the caller's transaction; returns how many
+    were processed (0 once both queues are empty).
+    """
+    removed = conn.execute(text(
+        "SELECT message_id, subject, body, sender FROM messages_fts_removed ORDER BY message_id LIMIT :n"
+    ), {"n": batch_size}).fetchall()
+    if removed:
+        _delete_bigrams(conn, removed)
+        conn.execute(text(f"DELETE FROM messages_fts_removed WHERE message_id IN ({','.join(str(r[0]) for r in removed)})"))
+    ids = [r[0] for r in conn.execute(text(
+        "SELECT message_id FROM messages_fts_pending ORDER BY message_id LIMIT :n"
+    ), {"n": batch_size})]
+    if not ids:
+        return len(removed)
+    ids_str = ",".join(str(i) for i in ids)
+    rows = conn.execute(text(f"""
+        SELECT m.id, m.subject, t.display_subject, c.display_name, c.email
+        FROM messages m
+        LEFT JOIN threads t ON t.id = m.thread_id
+        LEFT JOIN contacts c ON c.id = m.contact_id
+        WHERE m.id IN ({ids_str})
+    """)).fetchall()
+    bodies = fetch_bodies(conn, [r[0] for r in rows])
+    docs = []
+    for pk, subject, thread_subject, name, email in rows:
+        body = bodies.get(pk) or ""
+        if body == PENDING_BODY:
+            body = ""
+        docs.append({
+            "id": pk,
+            "subject": search_text(display_text(subject) or thread_subject),
+            "body": search_text(body[:FTS_BODY_CHARS]),
+            "sender": search_text(f"{name or ''} {email or ''}".strip()),
+        })
+    _delete_bigrams(conn, conn.execute(text(
+        f"SELECT rowid, subject, body, sender FROM messages_fts WHERE rowid IN ({ids_str})"
+    )).fetchall())
+    conn.execute(text(f"DELETE FROM messages_fts WHERE rowid IN ({ids_str})"))
+    if docs:
+        conn.execute(text("INSERT INTO messages_fts (rowid, subject, body, sender) VALUES (:id, :subject, :body, :sender)"), docs)
+        conn.execute(text("INSERT INTO messages_fts_bigrams (rowid, bigrams) VALUES (:id, :bigrams)"), _bigram_rows(
+            (d["id"], d["subject"], d["body"], d["sender"]) for d in docs
+        ))
+    conn.execute(text(f"DELETE FROM messages_fts_pending WHERE message_id IN ({ids_str})"))
+    return len(removed) + len(ids)
+
+
+def parse_query(q):
+    """
+    Split a user query into FTS5 terms (3+ characters, AND-ed, each quoted as
+    a phrase) and short terms, which the trigram index can't look up (see
+    bigram_query).
+    """
+    terms = [t for t in search_text(q).split() if t]
+    long_terms = [t for t in terms if len(t) >= 3]
+    short_terms = [t for t in terms if len(t) < 3]
+    match = " AND ".join('"' + t.replace('"', '""') + '"' for t in long_terms)
+    return match, short_terms
+
+
+def _bigram_indexed(term):
+    # Characters the bigram tokenizer keeps inside tokens (not separators / controls)
+    return all(unicodedata.category(ch)[0] in "LNMPS" or unicodedata.category(ch) == "Co" for ch in term)
+
+
+def bigram_query(short_terms):
+    """
+    (FTS5 query over messages_fts_bigrams, terms left for LIKE) for terms under
+    3 characters: a 2-character term is a bigram, a 1-character one the
+    prefix of one.
+    """
+    indexed = [t for t in short_terms if _bigram_indexed(t)]
+    match = " AND ".join('"' + t.replace('"', '""') + '"' + ("*" if len(t) == 1 else "") for t in indexed)
+    return match, [t for t in short_terms if t not in indexed]
+
+
+def like_pattern(term):
+    return "%" + re.sub(r"([\\%_])", r"\\\1", term) + "%"
+
+
+def mark_terms(fragment, terms):
+    """Add match markers around case-insensitive occurrences of terms."""
+    if not terms or not fragment:
+        return fragment
+    pattern = re.compile("|".join(re.escape(t) for t in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    return pattern.sub(lambda m: MARK_OPEN + m.group(0) + MARK_CLOSE, fragment)
+
+
+def window(value, terms, width=120):
+    """A fragment of value around the first occurrence of any term."""
+    lowered = value.lower()
+    hits = [i for i in (lowered.find(t.lower()) for t in terms) if i >= 0]
+    start = max(0, min(hits) - width // 3) if hits else 0
+    fragment = value[start:start + width]
+    return ("…" if start else "") + fragment + ("…" if start + width < len(value) else "")
+
+
+def to_html(fragment):
+    """HTML-escape a fragment and turn the match markers into <mark>."""
+    return html.escape(fragment or "").replace(MARK_OPEN, "<mark>").replace(MARK_CLOSE, "</mark>")
@@ -0,0 +1,145 @@
+"""
+Blue/green database generations (SQLite).
+
+DATABASE_URL keeps naming the database, e.g. ./pastlead.db. A rebuild
+(scripts/full_pipeline.py --rebuild) snapshots the live file into a new
+generation next to it (pastlead.20240101120000.db), runs the pipeline there
+with bulk-load settings, ANALYZEs it, and then points pastlead.db.current at
+it with an atomic rename. Every new connection opens the file the pointer
+names, and pooled connections to an older generation are dropped at
+checkout, so each request reads one consistent generation and the API
+switches over without a restart. Without a pointer file the URL's own file
+is used.
+
+Each generation has its own vector index directory (vector_index_dir), so
+a rebuild exports vectors next to its own file and the API switches vectors
+and database through the same pointer.
+"""
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import closing
+
+# Page size for rebuilt generations (and new files in the bulk profile)
+BULK_PAGE_SIZE = 16384
+KEEP_GENERATIONS = 2  # the live one + the one before it, for rollback
+
+# Parent of the per-generation vector index directories (default: beside the database)
+VECTOR_INDEX_ROOT = os.getenv("VECTOR_INDEX_DIR")
+
+_pointer_cache = {}  # db_path -> (pointer mtime_ns, active path)
+
+
+def pointer_path(db_path):
+    return db_path + ".current"
+
+
+def active_db_path(db_path):
+    """The generation file currently live for the database named db_path."""
+    pointer = pointer_path(db_path)
+    try:
+        mtime = os.stat(pointer).st_mtime_ns
+    except FileNotFoundError:
+        return db_path
+    cached = _pointer_cache.get(db_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(pointer) as f:
+        name = f.read().strip()
+    active = os.path.join(os.path.dirname(db_path), name) if name else db_path
+    _pointer_cache[db_path] = (mtime, active)
+    return active
+
+
+def vector_index_dir(path):
+    """Vector index directory of the database file path: <root>/<file stem>.vectors."""
+    root = VECTOR_INDEX_ROOT or os.path.dirname(path) or "."
+    return os.path.join(root, os.path.splitext(os.path.basename(path))[0] + ".vectors")
+
+
+def generation_paths(db_path):
+    """Timestamped generation files of db_path, oldest first."""
+    directory = os.path.dirname(db_path) or "."
+    base, ext = os.path.splitext(os.path.basename(db_path))
+    names = [
+        n for n in os.listdir(directory)
+        if n.startswith(base + ".") and n.endswith(ext) and n[len(base) + 1:len(n) - len(ext)].isdigit()
+    ]
+    return [os.path.join(os.path.dirname(db_path), n) for n in sorted(names)]
+
+
+def new_generation_path(db_path):
+    base, ext = os.path.splitext(db_path)
+    return f"{base}.{time.strftime('%Y%m%d%H%M%S')}{ext}"
+
+
+def snapshot(src, dest, page_size=BULK_PAGE_SIZE):
+    """
+    Consistent copy of the live file through SQLite's online backup (the API
+    keeps reading and writing meanwhile). The copy is VACUUMed into
+    page_size pages while it isn't in WAL mode yet -- the one point where the
+    page size of an existing database can still change.
+    """
+    with closing(sqlite3.connect(src, timeout=30)) as source, closing(sqlite3.connect(dest, isolation_level=None)) as copy:
+        source.backup(copy)
+        copy.execute("PRAGMA journal_mode=DELETE")
+        if copy.execute("PRAGMA page_size").fetchone()[0] != page_size:
+            copy.execute(f"PRAGMA page_size={page_size}")
+            copy.execute("VACUUM")
+        copy.execute("PRAGMA journal_mode=WAL")
+
+
+def finalize(path):
+    """Fresh planner statistics and an empty WAL before readers arrive."""
+    with closing(sqlite3.connect(path, isolation_level=None)) as conn:
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def carry_over_user_state(live, path):
+    """
+    Copy what the API changed on the live generation while the rebuild ran:
+    the ignore list, and a data_version past the live one so every cached
+    response and ETag is invalidated by the switch. The generation keeps its
+    own filter_version: it describes this file's threads and scores.
+    """
+    with closing(sqlite3.connect(path, isolation_level=None, timeout=30)) as conn:
+        conn.execute("ATTACH DATABASE ? AS live", (live,))
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM ignore_list")
+        conn.execute("INSERT INTO ignore_list SELECT * FROM live.ignore_list")
+        conn.execute("INSERT OR IGNORE INTO data_version (id, version, filter_version) VALUES (1, 0, 0)")
+        conn.execute("""
+            UPDATE data_version
+            SET version = (SELECT COALESCE(MAX(version), 0) + 1 FROM live.data_version), updated_at = CURRENT_TIMESTAMP
+            WHERE id = 1
+        """)
+        conn.execute("COMMIT")
+        conn.execute("DETACH DATABASE live")
+
+
+def activate(db_path, path):
+    """Atomically point db_path at the generation file path."""
+    pointer = pointer_path(db_path)
+    tmp = pointer + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(os.path.basename(path))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, pointer)
+
+
+def prune_generations(db_path, keep=KEEP_GENERATIONS):
+    """Delete generation files and their vector indexes beyond the newest `keep` (never the live one)."""
+    live = active_db_path(db_path)
+    removed = []
+    for path in generation_paths(db_path)[:-keep]:
+        if os.path.abspath(path) == os.path.abspath(live):
+            continue
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        shutil.rmtree(vector_index_dir(path), ignore_errors=True)
+        removed.append(path)
+    return removed
@@ -1,19 +1,35 @@
 from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func, desc
+from sqlalchemy.orm import joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
-from .models import SessionLocal, Contact, Message, Thread, get_db, IgnoreList
+from .responses import ORJSONResponse
+from .models import Contact, ContactStats, Message, Thread, StatCounter, get_async_db, IgnoreList, engine
+from .migrations import pending_versions
+from .body_store import fetch_bodies
+from .writer import write_queue
 
 
 from . import search # Import search module
-from .utils import decode_mime
+from .pagination import NEXT_CURSOR_HEADER, encode_cursor, decode_cursor, fetch_keyset_page, cursor_column
 
-app = FastAPI(title="PastLead API")
+# Large list/thread payloads return ORJSONResponse directly (no jsonable_encoder pass)
+app = FastAPI(title="PastLead API", default_response_class=ORJSONResponse)
 app.include_router(search.router) # Register Search Router
 from . import settings
 app.include_router(settings.router)
 
 
+# Versioned response cache + ETags for the read-heavy GET endpoints.
+# Registered before CORS so CORS stays outermost and also decorates 304s.
+from .cache import ResponseCacheMiddleware
+app.add_middleware(ResponseCacheMiddleware)
+
+# brotli/gzip above a size threshold; outside the cache so entries stay uncompressed
+from .compression import CompressionMiddleware
+app.add_middleware(CompressionMiddleware)
+
 # CORS setup for Frontend communication
 app.add_middleware(
     CORSMiddleware,
@@ -21,60 +37,112 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 
+@app.on_event("startup")
+def check_database_schema():
+    # Schema changes and backfills run offline (python -m app.migrations,
+    # scripts/backfill_display_columns.py), never on the API's read path
+    pending = pending_versions(engine)
+    if pending:
+        print(f"⚠️  {len(pending)} schema migration(s) pending: run python -m app.migrations")
+
+@app.on_event("startup")
+def warm_up_search():
+    # Load the embedding model in the background (GET /search/ready)
+    search.start_warm_up()
+
+@app.on_event("shutdown")
+async def stop_writer():
+    # Commit whatever settings writes are still queued (app/writer.py)
+    await write_queue.stop()
+
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Welcome to PastLead API"}
 
 @app.get("/stats")
-def get_stats(db: Session = Depends(get_db)):
-    contact_count = db.query(Contact).count()
-    message_count = db.query(Message).count()
+async def get_stats(db: AsyncSession = Depends(get_async_db)):
+    # Kept current by the pipeline (see adjust_stat_counters): one small table read
+    counters = dict((await db.execute(select(StatCounter.name, StatCounter.value))).all())
+    thread_status = {
+        name.split(":", 1)[1]: value
+        for name, value in counters.items() if name.startswith("threads:")
+    }
     return {
-        "contacts": contact_count,
-        "messages": message_count
+        "contacts": counters.get("contacts", 0),
+        "messages": counters.get("messages", 0),
+        "active_contacts": counters.get("contacts_active", 0),
+        "threads": counters.get("threads", 0),
+        "threads_by_status": thread_status,
     }
 
 
 
 @app.get("/messages")
-def get_messages(skip: int = 0, limit: int = 50, db: Session = Depends(get_db)):
+async def get_messages(skip: int = 0, limit: int = 50, cursor: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
     # Filter by Active threads only
-    messages = db.query(Message)\
-        .join(Message.thread)\
-        .filter(Thread.status == 'active')\
-        .order_by(Message.sent_at.desc())\
-        .offset(skip).limit(limit).all()
+    # (relationships are loaded up front: no lazy loads on an async session)
+    # EXISTS rather than a join so the planner walks messages in (sent_at, id)
+    # index order and stops at the limit, instead of collecting and sorting
+    # every message of every active thread
+    query = select(Message)\
+        .where(select(Thread.id).where(Thread.id == Message.thread_id, Thread.status == 'active').exists())\
+        .options(joinedload(Message.thread), joinedload(Message.contact))
+
+    # Keyset pagination on (sent_at, id); skip is kept for old clients
+    next_after = None
+    if skip and not cursor:
+        result = await db.execute(query.order_by(Message.sent_at.desc(), Message.id.desc()).offset(skip).limit(limit))
+        messages = result.scalars().all()
+    else:
+        after = decode_cursor(cursor, "sent_at") if cursor else None
+        messages, next_after = await fetch_keyset_page(db, query, Message.sent_at, Message.id, limit, after)
+
+    headers = {}
+    if next_after:
+        headers[NEXT_CURSOR_HEADER] = encode_cursor("sent_at", *next_after)
     
     # Simple serialization (avoiding excessive pydantic boilerplates for now)
-    return [
+    return ORJSONResponse([
         {
             "id": m.id,
-            "subject": decode_mime(m.thread.subject) if m.thread else "(No Subject)",
-            "from": decode_mime(m.contact.name) if m.contact and m.contact.name else m.contact.email if m.contact else "Unknown",
+            "subject": (m.thread.display_subject if m.thread else None) or "(No Subject)",
+            "from": (m.contact.display_name or m.contact.email) if m.contact else "Unknown",
             "date": m.sent_at,
-            "snippet": (m.content_body[:100] + "...") if m.content_body else ""
+            "snippet": (m.snippet[:100] + "...") if m.snippet else ""
         }
         for m in messages
-    ]
+    ], headers=headers)
 
 @app.get("/threads")
-def get_threads(skip: int = 0, limit: int = 50, sort: str = "score", db: Session = Depends(get_db)):
-    query = db.query(Thread).filter(Thread.status == 'active')
+async def get_threads(skip: int = 0, limit: int = 50, sort: str = "score", cursor: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    query = select(Thread).where(Thread.status == 'active').options(joinedload(Thread.contact))
     
     if sort == "date":
-        query = query.order_by(Thread.last_message_at.desc())
+        sort_key, sort_column = "last_message_at", Thread.last_message_at
     else: # default score
-        query = query.order_by(Thread.score.desc())
-        
-    threads = query.offset(skip).limit(limit).all()
+        sort_key, sort_column = "score", Thread.score
+
+    # Keyset pagination on (sort column, id); skip is kept for old clients
+    next_after = None
+    if skip and not cursor:
+        result = await db.execute(query.order_by(sort_column.desc(), Thread.id.desc()).offset(skip).limit(limit))
+        threads = result.scalars().all()
+    else:
+        after = decode_cursor(cursor, sort_key) if cursor else None
+        threads, next_after = await fetch_keyset_page(db, query, sort_column, Thread.id, limit, after)
+
+    headers = {}
+    if next_after:
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(sort_key, *next_after)
     
-    return [
+    return ORJSONResponse([
         {
             "id": t.id,
-            "subject": decode_mime(t.subject),
+            "subject": t.display_subject or "",
             "message_count": t.message_count,
             "last_message_at": t.last_message_at,
             "score": float(t.score) if t.score else 0.0, 
@@ -82,40 +150,94 @@ def get_threads(skip: int = 0, limit: int = 50, sort: str = "score", db: Session
             "contact_email": t.contact.email if t.contact else "Unknown"
         }
         for t in threads
-    ]
+    ], headers=headers)
 
 
+async def load_thread_messages(db, thread_id):
+    result = await db.execute(
+        select(Message)
+        .where(Message.thread_id == thread_id)
+        .options(joinedload(Message.contact))
+        .order_by(Message.sent_at.asc(), Message.id.asc())
+    )
+    return result.scalars().all()
+
+async def load_bodies(db, message_ids):
+    """{message id: body} from the compressed body store."""
+    return await db.run_sync(lambda session: fetch_bodies(session, message_ids))
+
 @app.get("/threads/{thread_id}/messages")
-def get_thread_messages(thread_id: int, db: Session = Depends(get_db)):
-    messages = db.query(Message)\
-        .filter(Message.thread_id == thread_id)\
-        .order_by(Message.sent_at.asc())\
-        .all()
+async def get_thread_messages(thread_id: int, body_limit: Optional[int] = None, db: AsyncSession = Depends(get_async_db)):
+    """
+    Every message of the thread (oldest first) with its snippet.
+    Full bodies: all of them by default, or only the first `body_limit`;
+    the rest come from /threads/{id}/bodies, starting at the X-Next-Cursor header
+    (or without a cursor when body_limit=0).
+    """
+    messages = await load_thread_messages(db, thread_id)
+    window = messages if body_limit is None else messages[:max(body_limit, 0)]
+    bodies = await load_bodies(db, [m.id for m in window])
+
+    headers = {}
+    if window and len(window) < len(messages):
+        last = window[-1]
+        stored = await db.scalar(select(cursor_column(Message.sent_at)).where(Message.id == last.id))
+        headers[NEXT_CURSOR_HEADER] = encode_cursor("sent_at", stored, last.id)
     
-    return [
+    return ORJSONResponse([
         {
             "id": m.id,
             "sender_type": m.sender_type,
-            "sender_name": decode_mime(m.contact.name) if m.contact and m.contact.name else m.contact.email if m.contact else "Unknown",
+            "sender_name": (m.contact.display_name or m.contact.email) if m.contact else "Unknown",
             "date": m.sent_at,
-            "body": m.content_body,
+            "snippet": m.snippet or "",
+            "body": (bodies.get(m.id) or "") if m.id in bodies else None, # None: not loaded yet
             "message_id": m.message_id
         }
         for m in messages
-    ]
+    ], headers=headers)
+
+@app.get("/threads/{thread_id}/bodies")
+async def get_thread_bodies(
+    thread_id: int,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    ids: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Full bodies of a thread's messages, oldest first: the next `limit` after
+    `cursor`, or the given comma-separated message `ids`.
+    """
+    query = select(Message.id, Message.sent_at).where(Message.thread_id == thread_id)
+    headers = {}
+    if ids:
+        try:
+            wanted = [int(i) for i in ids.split(",") if i.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="ids must be comma-separated integers")
+        rows = (await db.execute(
+            query.where(Message.id.in_(wanted)).order_by(Message.sent_at.asc(), Message.id.asc())
+        )).all()
+    else:
+        after = decode_cursor(cursor, "sent_at") if cursor else None
+        rows, next_after = await fetch_keyset_page(db, query, Message.sent_at, Message.id, limit, after, descending=False, scalars=False)
+        if next_after:
+            headers[NEXT_CURSOR_HEADER] = encode_cursor("sent_at", *next_after)
+
+    bodies = await load_bodies(db, [r.id for r in rows])
+    return ORJSONResponse([{"id": r.id, "body": bodies.get(r.id) or ""} for r in rows], headers=headers)
 
-from .ai_summary import generate_thread_summary
+from .ai_summary import generate_thread_summary_async
 
 @app.get("/threads/{thread_id}/summary")
-def get_thread_summary(thread_id: int, db: Session = Depends(get_db)):
+async def get_thread_summary(thread_id: int, db: AsyncSession = Depends(get_async_db)):
     # 1. Fetch messages
-    messages = db.query(Message)\
-        .filter(Message.thread_id == thread_id)\
-        .order_by(Message.sent_at.asc())\
-        .all()
+    messages = await load_thread_messages(db, thread_id)
     
     if not messages:
         return {"summary": "No messages found.", "status": "No Data"}
+    bodies = await load_bodies(db, [m.id for m in messages])
 
     # 2. Convert to format expected by AI
     # Strategy: Head(1) + Middle(Condensed) + Tail(3)
@@ -128,18 +250,18 @@ def get_thread_summary(thread_id: int, db: Session = Depends(get_db)):
         msg_subset = messages
         for m in msg_subset:
             selected_messages.append({
-                "sender_name": decode_mime(m.contact.name) if m.contact and m.contact.name else "Unknown",
+                "sender_name": (m.contact.display_name if m.contact else None) or "Unknown",
                 "date": m.sent_at.strftime("%Y-%m-%d %H:%M"),
-                "body": m.content_body or "",
+                "body": bodies.get(m.id) or "",
                 "type": "full"
             })
     else:
         # Head: First message (Full context)
         first_msg = messages[0]
         selected_messages.append({
-            "sender_name": decode_mime(first_msg.contact.name) if first_msg.contact and first_msg.contact.name else "Unknown",
+            "sender_name": (first_msg.contact.display_name if first_msg.contact else None) or "Unknown",
             "date": first_msg.sent_at.strftime("%Y-%m-%d %H:%M"),
-            "body": first_msg.content_body or "",
+            "body": bodies.get(first_msg.id) or "",
             "type": "full"
         })
         
@@ -148,9 +270,9 @@ def get_thread_summary(thread_id: int, db: Session = Depends(get_db)):
         middle_msgs = messages[1:-3]
         for m in middle_msgs:
             # Extract first line or first 100 chars as snippet
-            body_snippet = (m.content_body or "").strip().split('\n')[0][:100] + "..."
+            body_snippet = (m.snippet or "").strip().split('\n')[0][:100] + "..."
             selected_messages.append({
-                "sender_name": decode_mime(m.contact.name) if m.contact and m.contact.name else "Unknown",
+                "sender_name": (m.contact.display_name if m.contact else None) or "Unknown",
                 "date": m.sent_at.strftime("%Y-%m-%d %H:%M"),
                 "body": body_snippet,
                 "type": "summary" # Flag to helper to treat as summary
@@ -160,117 +282,162 @@ def get_thread_summary(thread_id: int, db: Session = Depends(get_db)):
         tail_msgs = messages[-3:]
         for m in tail_msgs:
             selected_messages.append({
-                "sender_name": decode_mime(m.contact.name) if m.contact and m.contact.name else "Unknown",
+                "sender_name": (m.contact.display_name if m.contact else None) or "Unknown",
                 "date": m.sent_at.strftime("%Y-%m-%d %H:%M"),
-                "body": m.content_body or "",
+                "body": bodies.get(m.id) or "",
                 "type": "full"
             })
 
     # Log info for debugging
     print(f"Generating summary for thread {thread_id}. Strategy used: Head(1)+Middle({len(messages)-4})+Tail(3) if >5.")
 
-    # 3. Generate summary using local LLM
+    # Release the DB connection before the (up to 180s) LLM wait
+    await db.close()
+
+    # 3. Generate summary using local LLM (on the dedicated LLM executor, not the event loop)
     try:
-        result = generate_thread_summary(selected_messages)
+        result = await generate_thread_summary_async(selected_messages)
         return result
     except Exception as e:
         print(f"Error generating summary: {e}")
         return {"summary": "Error during generation", "status": "Error"}
 
 
-from sqlalchemy import func, desc
+import re
+
+# Threads shown per contact card
+CONTACT_THREAD_PREVIEW = 5
+
+# Compile spam regexes once
+CONTACT_SPAM_REGEX = re.compile("|".join([
+    r"no-?reply", r"notification", r"donotreply", r"alert",
+    r"info@", r"support@", r"newsletter", r"magazine", 
+    r"news@", r"update@", r"press@", r"editor@", 
+    r"seminar", r"survey", r"auto-?confirm", r"account@", 
+    r"admin@", r"service@", r"bouce", r"mailer-daemon",
+    r"system@", r"mailmag", r"campaign", r"shop@", r"store@",
+    r"order@", r"billing@", r"invoice@", r"noreply", r"mag2",
+    r"eigyo", r"sales@", r"marketing@", r"pr@", r"hello@"
+]), re.IGNORECASE)
 
 @app.get("/contacts")
-def get_contacts(
+async def get_contacts(
     limit: int = 50,
     offset: int = 0,
-    db: Session = Depends(get_db)
+    sort: str = "score",
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Get contacts managed by person, sorted by importance (closeness_score).
-    OPTIMIZED: Uses pre-calculated/indexed columns only.
+    Get contacts managed by person, sorted by importance (max_score).
+    OPTIMIZED: Reads the materialized contact_stats table (maintained by
+    extract_features.py) through the index matching the sort order, then loads
+    the recent threads of the whole page in one windowed query.
+    sort: "score" (default) | "date" (most recent first) | "dormant" (longest silent first)
+    Pagination: pass the X-Next-Cursor response header back as ?cursor=
+    (offset still works but scans every skipped row).
     """
     try:
         # 1.5 Get Ignore List (to filter out spam in real-time)
-        ignore_items = db.query(IgnoreList).all()
+        ignore_items = (await db.execute(select(IgnoreList))).scalars().all()
         ignored_emails = [item.value for item in ignore_items if item.type == 'email']
         ignored_domains = [item.value for item in ignore_items if item.type == 'domain']
 
-        # 2. Simple Query on Contact Table
-        query = db.query(Contact).filter(Contact.closeness_score > 0)
+        # 2. Single scan over contact_stats (+ PK lookup into contacts)
+        query = select(ContactStats, Contact)\
+            .join(Contact, ContactStats.contact_id == Contact.id)\
+            .where(ContactStats.max_score > 0)
         
         # Apply filters
         if ignored_emails:
-            query = query.filter(Contact.email.notin_(ignored_emails))
+            query = query.where(Contact.email.notin_(ignored_emails))
             
         for domain in ignored_domains:
-            query = query.filter(Contact.email.notilike(f"%@{domain}"))
+            query = query.where(Contact.email.notilike(f"%@{domain}"))
 
-        # Sort by pre-calculated score
-        query = query.order_by(desc(Contact.closeness_score))
-        
-        # Pagination
-        contacts = query.limit(limit).offset(offset).all()
-
-        # Compile spam regexes once
-        import re
-        spam_patterns = [
-            r"no-?reply", r"notification", r"donotreply", r"alert",
-            r"info@", r"support@", r"newsletter", r"magazine", 
-            r"news@", r"update@", r"press@", r"editor@", 
-            r"seminar", r"survey", r"auto-?confirm", r"account@", 
-            r"admin@", r"service@", r"bouce", r"mailer-daemon",
-            r"system@", r"mailmag", r"campaign", r"shop@", r"store@",
-            r"order@", r"billing@", r"invoice@", r"noreply", r"mag2",
-            r"eigyo", r"sales@", r"marketing@", r"pr@", r"hello@"
-        ]
-        spam_regex = re.compile("|".join(spam_patterns), re.IGNORECASE)
+        # Sort by pre-calculated aggregates
+        if sort == "date":
+            sort_key, sort_column, descending = "last_contact_date", ContactStats.last_contact_date, True
+        elif sort == "dormant":
+            sort_key, sort_column, descending = "last_contact_date_asc", ContactStats.last_contact_date, False
+        else:
+            sort_key, sort_column, descending = "max_score", ContactStats.max_score, True
 
+        # Pagination
+        if offset and not cursor:
+            if descending:
+                query = query.order_by(sort_column.desc(), ContactStats.contact_id.desc())
+            else:
+                query = query.order_by(sort_column.asc(), ContactStats.contact_id.asc())
+            rows = (await db.execute(query.offset(offset).limit(limit))).all()
+            next_after = None
+        else:
+            after = decode_cursor(cursor, sort_key) if cursor else None
+            rows, next_after = await fetch_keyset_page(db, query, sort_column, ContactStats.contact_id, limit, after, descending, scalars=False)
+
+        # Cursor comes from the last row scanned, before the spam post-filter below
+        headers = {}
+        if next_after:
+            headers[NEXT_CURSOR_HEADER] = encode_cursor(sort_key, *next_after)
+
+        # 3. Immediate Spam Check (Safety Net)
+        rows = [(stats, contact) for stats, contact, *_ in rows
+                if not (contact.email and CONTACT_SPAM_REGEX.search(contact.email))]
+        contact_ids = [contact.id for _, contact in rows]
+
+        # 4. Recent threads for the whole page in one windowed query
+        # (instead of one query per contact)
+        threads_by_contact = {cid: [] for cid in contact_ids}
+        if contact_ids:
+            ranked = select(
+                Thread.id, Thread.contact_id, Thread.display_subject, Thread.score,
+                Thread.last_message_at, Thread.message_count,
+                func.row_number().over(
+                    partition_by=Thread.contact_id,
+                    order_by=(Thread.last_message_at.desc(), Thread.id.desc())
+                ).label("rn")
+            ).where(Thread.contact_id.in_(contact_ids), Thread.status == 'active')\
+             .subquery()
+
+            thread_rows = (await db.execute(
+                select(ranked)
+                .where(ranked.c.rn <= CONTACT_THREAD_PREVIEW)
+                .order_by(ranked.c.contact_id, ranked.c.rn)
+            )).all()
+            for t in thread_rows:
+                threads_by_contact[t.contact_id].append(t)
+
+        # 5. Assemble in memory
         contacts_data = [] # Initialize list
 
-        for contact in contacts:
-            # 1. Immediate Spam Check (Safety Net)
-            if contact.email and spam_regex.search(contact.email):
-                 continue
-
-            # Fetch threads for this contact (limit to recent 5 for performance)
-            threads = db.query(Thread)\
-                .filter(Thread.contact_id == contact.id)\
-                .filter(Thread.status == 'active')\
-                .order_by(Thread.last_message_at.desc())\
-                .limit(5)\
-                .all()
-                
+        for stats, contact in rows:
             thread_list = [{
                 "id": t.id,
-                "subject": decode_mime(t.subject) if t.subject else "(No Subject)",
+                "subject": t.display_subject or "(No Subject)",
                 "score": t.score or 0.0,
                 "last_message_at": t.last_message_at.strftime("%Y-%m-%d %H:%M") if t.last_message_at else "",
                 "message_count": t.message_count
-            } for t in threads]
-
-            top_thread = threads[0] if threads else None
-            top_title = decode_mime(top_thread.subject) if top_thread and top_thread.subject else "No Thread"
-            
-            # Count total threads (cheap count)
-            thread_count = db.query(Thread).filter(Thread.contact_id == contact.id, Thread.status == 'active').count()
+            } for t in threads_by_contact[contact.id]]
 
             contacts_data.append({
                 "id": contact.id,
-                "name": decode_mime(contact.name or "Unknown"),
+                "name": contact.display_name or "Unknown",
                 "email": contact.email,
-                "max_score": float(contact.closeness_score or 0.0),
-                "thread_count": thread_count,
-                "last_active": contact.last_contacted_at.strftime("%Y-%m-%d") if contact.last_contacted_at else None,
-                "first_active": None, # Expensive to calculate on fly, skip for now
-                "top_thread_title": top_title,
+                "max_score": float(stats.max_score or 0.0),
+                "thread_count": stats.thread_count,
+                "last_active": stats.last_contact_date.strftime("%Y-%m-%d") if stats.last_contact_date else None,
+                "first_active": stats.first_contact_date.strftime("%Y-%m-%d") if stats.first_contact_date else None,
+                "top_thread_title": stats.top_thread_title or "No Thread",
                 "threads": thread_list
             })
 
-        return contacts_data
+        return ORJSONResponse(contacts_data, headers=headers)
 
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
         print(f"Error in get_contacts: {e}")
-        return []
+        # Not kept by the response cache: the next request tries again
+        return ORJSONResponse([], headers={"cache-control": "no-store"})
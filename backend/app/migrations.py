@@ -0,0 +1,288 @@
+"""
+Versioned schema migrations.
+
+create_all() only creates missing tables. Anything that changes an existing
+table (added columns, new or dropped indexes) is a numbered step below,
+recorded in schema_migrations once applied. Steps are plain SQL accepted by
+both SQLite and Postgres (sqlite_only ones are skipped on Postgres), and
+idempotent: databases created before this module existed (or fresh ones,
+where create_all already built the current model) may have some of their
+effects already.
+
+To change the schema: update the model in models.py (so fresh databases get
+it from create_all) and append a step here (so existing ones catch up).
+A step's DDL is written out in it, never imported from live code: an
+applied step must keep meaning what it did when it ran.
+
+The API never migrates (it only warns at startup when steps are pending);
+run this before starting it, as run_pipeline.sh and full_pipeline.py do:
+
+    python -m app.migrations            # create tables + apply pending steps
+    python -m app.migrations --status   # list applied / pending steps
+"""
+import argparse
+
+from sqlalchemy import inspect, text
+
+
+def add_column(table, column, ddl):
+    def step(conn):
+        inspector = inspect(conn)
+        if not inspector.has_table(table):
+            return
+        if column not in {c["name"] for c in inspector.get_columns(table)}:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return step
+
+
+def create_index(name, table, *columns):
+    def step(conn):
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+    return step
+
+
+def drop_index(name):
+    def step(conn):
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    return step
+
+
+def sqlite_only(statements):
+    def step(conn):
+        if conn.dialect.name != "sqlite":
+            return
+        for statement in statements:
+            conn.exec_driver_sql(statement)
+    return step
+
+
+def if_empty(table, statements):
+    def step(conn):
+        if conn.execute(text(f"SELECT 1 FROM {table} LIMIT 1")).first() is None:
+            for statement in statements:
+                conn.execute(text(statement))
+    return step
+
+
+# Migration 7, as shipped: the FTS5 table with bm25 column weights subject 5,
+# body 1, sender 2, and the triggers queueing changed messages for indexing
+FTS_DDL_V7 = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(subject, body, sender, tokenize = 'trigram')",
+    "INSERT INTO messages_fts (messages_fts, rank) VALUES ('rank', 'bm25(5.0, 1.0, 2.0)')",
+    "CREATE TABLE IF NOT EXISTS messages_fts_pending (message_id INTEGER PRIMARY KEY)",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT OR IGNORE INTO messages_fts_pending (message_id) VALUES (new.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF subject, thread_id, contact_id, content_body ON messages BEGIN
+        INSERT OR IGNORE INTO messages_fts_pending (message_id) VALUES (new.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+        DELETE FROM messages_fts WHERE rowid = old.id;
+        DELETE FROM messages_fts_pending WHERE message_id = old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS message_bodies_fts_insert AFTER INSERT ON message_bodies BEGIN
+        INSERT OR IGNORE INTO messages_fts_pending (message_id) VALUES (new.message_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS message_bodies_fts_update AFTER UPDATE ON message_bodies BEGIN
+        INSERT OR IGNORE INTO messages_fts_pending (message_id) VALUES (new.message_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS threads_fts_update AFTER UPDATE OF display_subject ON threads BEGIN
+        INSERT OR IGNORE INTO messages_fts_pending (message_id) SELECT id FROM messages WHERE thread_id = new.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS contacts_fts_update AFTER UPDATE OF display_name, email ON contacts BEGIN
+        INSERT OR IGNORE INTO messages_fts_pending (message_id) SELECT id FROM messages WHERE contact_id = new.id;
+    END""",
+    # Everything already in the database
+    "INSERT OR IGNORE INTO messages_fts_pending (message_id) SELECT id FROM messages",
+]
+
+
+# Migration 11: a contentless bigram index for terms under 3 characters. Its
+# rows can only be deleted by re-supplying their text, so deleting a message
+# keeps its indexed text in messages_fts_removed until the sync drops it. The
+# existing index is emptied and everything re-queued, so both tables start
+# out in step.
+FTS_BIGRAM_DDL_V11 = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts_bigrams USING fts5(
+        bigrams, content = '', tokenize = "unicode61 remove_diacritics 0 categories 'L* N* M* P* S* Co'"
+    )""",
+    "CREATE TABLE IF NOT EXISTS messages_fts_removed (message_id INTEGER PRIMARY KEY, subject, body, sender)",
+    "DROP TRIGGER IF EXISTS messages_fts_delete",
+    """CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT OR REPLACE INTO messages_fts_removed (message_id, subject, body, sender)
+            SELECT rowid, subject, body, sender FROM messages_fts WHERE rowid = old.id;
+        DELETE FROM messages_fts WHERE rowid = old.id;
+        DELETE FROM messages_fts_pending WHERE message_id = old.id;
+    END""",
+    "DELETE FROM messages_fts",
+    "INSERT OR IGNORE INTO messages_fts_pending (message_id) SELECT id FROM messages",
+]
+
+
+# Migration 12: the update triggers skip messages already queued instead of
+# relying on OR IGNORE, which SQLite overrides with the outer statement's
+# conflict handling: an upsert (INSERT ... ON CONFLICT DO UPDATE, as the
+# importers do for contacts) failed on messages_fts_pending's primary key.
+FTS_QUEUE_DDL_V12 = [
+    "DROP TRIGGER IF EXISTS messages_fts_update",
+    """CREATE TRIGGER messages_fts_update AFTER UPDATE OF subject, thread_id, contact_id, content_body ON messages BEGIN
+        INSERT INTO messages_fts_pending (message_id) SELECT new.id
+        WHERE NOT EXISTS (SELECT 1 FROM messages_fts_pending WHERE message_id = new.id);
+    END""",
+    "DROP TRIGGER IF EXISTS message_bodies_fts_update",
+    """CREATE TRIGGER message_bodies_fts_update AFTER UPDATE OF codec, dict_id, body ON message_bodies BEGIN
+        INSERT INTO messages_fts_pending (message_id) SELECT new.message_id
+        WHERE NOT EXISTS (SELECT 1 FROM messages_fts_pending WHERE message_id = new.message_id);
+    END""",
+    "DROP TRIGGER IF EXISTS threads_fts_update",
+    """CREATE TRIGGER threads_fts_update AFTER UPDATE OF display_subject ON threads BEGIN
+        INSERT INTO messages_fts_pending (message_id) SELECT id FROM messages
+        WHERE thread_id = new.id
+          AND NOT EXISTS (SELECT 1 FROM messages_fts_pending WHERE message_id = messages.id);
+    END""",
+    "DROP TRIGGER IF EXISTS contacts_fts_update",
+    """CREATE TRIGGER contacts_fts_update AFTER UPDATE OF display_name, email ON contacts BEGIN
+        INSERT INTO messages_fts_pending (message_id) SELECT id FROM messages
+        WHERE contact_id = new.id
+          AND NOT EXISTS (SELECT 1 FROM messages_fts_pending WHERE message_id = messages.id);
+    END""",
+]
+
+
+# Migration 13: /stats counters for databases built before stat_counters
+# existed (the API used to seed them at startup). From here on the pipeline
+# keeps them current; a full recount is extract_features.py --full.
+STAT_COUNTERS_SEED_V13 = [
+    "INSERT INTO stat_counters (name, value, updated_at) SELECT 'contacts', COUNT(*), CURRENT_TIMESTAMP FROM contacts",
+    "INSERT INTO stat_counters (name, value, updated_at) SELECT 'messages', COUNT(*), CURRENT_TIMESTAMP FROM messages",
+    """INSERT INTO stat_counters (name, value, updated_at)
+        SELECT 'contacts_active', COUNT(*), CURRENT_TIMESTAMP FROM contact_stats WHERE max_score > 0""",
+    """INSERT INTO stat_counters (name, value, updated_at)
+        SELECT 'threads:' || COALESCE(status, 'unknown'), COUNT(*), CURRENT_TIMESTAMP FROM threads
+        GROUP BY COALESCE(status, 'unknown')""",
+    "INSERT INTO stat_counters (name, value, updated_at) SELECT 'threads', COUNT(*), CURRENT_TIMESTAMP FROM threads",
+]
+
+
+# (version, description, [steps]) -- append only, never renumber
+MIGRATIONS = [
+    (1, "threads.status and threads.features_dirty", [
+        add_column("threads", "status", "VARCHAR DEFAULT 'active'"),
+        add_column("threads", "features_dirty", "BOOLEAN NOT NULL DEFAULT TRUE"),
+        create_index("idx_threads_features_dirty", "threads", "features_dirty"),
+    ]),
+    (2, "contact_stats sort indexes", [
+        create_index("idx_contact_stats_score", "contact_stats", "max_score", "contact_id"),
+        create_index("idx_contact_stats_last_contact", "contact_stats", "last_contact_date", "contact_id"),
+    ]),
+    (3, "keyset pagination indexes", [
+        create_index("idx_threads_status_score_id", "threads", "status", "score", "id"),
+        create_index("idx_threads_status_last_message_id", "threads", "status", "last_message_at", "id"),
+        create_index("idx_messages_sent_at_id", "messages", "sent_at", "id"),
+    ]),
+    (4, "decoded display columns", [
+        add_column("threads", "display_subject", "VARCHAR"),
+        add_column("contacts", "display_name", "VARCHAR"),
+    ]),
+    (5, "messages.snippet for the body store", [
+        add_column("messages", "snippet", "VARCHAR"),
+    ]),
+    # threads(status, score) / threads(status, last_message_at) are covered by
+    # the (…, id) keyset indexes of step 3. The two new composites make the
+    # single-column thread_id / contact_id indexes redundant prefixes.
+    (6, "composite indexes for the hot API queries", [
+        create_index("idx_threads_contact_status_last", "threads", "contact_id", "status", "last_message_at"),
+        create_index("idx_messages_thread_sent_at", "messages", "thread_id", "sent_at"),
+        create_index("idx_contacts_closeness_score", "contacts", "closeness_score"),
+        drop_index("idx_threads_contact_id"),
+        drop_index("idx_messages_thread_id"),
+    ]),
+    (7, "messages_fts keyword search index (SQLite)", [
+        sqlite_only(FTS_DDL_V7),
+    ]),
+    (8, "message_embeddings.content_hash", [
+        add_column("message_embeddings", "content_hash", "VARCHAR"),
+    ]),
+    (9, "body hashes as embedding change markers", [
+        add_column("message_bodies", "body_hash", "VARCHAR"),
+        add_column("message_embeddings", "body_hash", "VARCHAR"),
+        create_index("idx_message_bodies_hash", "message_bodies", "message_id", "body_hash"),
+        # Filling in body_hash isn't a body change: don't queue the message for re-indexing
+        sqlite_only([
+            "DROP TRIGGER IF EXISTS message_bodies_fts_update",
+            """CREATE TRIGGER message_bodies_fts_update AFTER UPDATE OF codec, dict_id, body ON message_bodies BEGIN
+        INSERT OR IGNORE INTO messages_fts_pending (message_id) VALUES (new.message_id);
+    END""",
+        ]),
+    ]),
+    (10, "data_version.filter_version for the vector filter attributes", [
+        add_column("data_version", "filter_version", "INTEGER NOT NULL DEFAULT 0"),
+    ]),
+    (11, "messages_fts_bigrams for 1-2 character terms (SQLite)", [
+        sqlite_only(FTS_BIGRAM_DDL_V11),
+    ]),
+    (12, "search index queue triggers safe under upserts (SQLite)", [
+        sqlite_only(FTS_QUEUE_DDL_V12),
+    ]),
+    (13, "seed the /stats counters", [
+        if_empty("stat_counters", STAT_COUNTERS_SEED_V13),
+    ]),
+]
+
+
+def ensure_migrations_table(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+
+
+def applied_versions(engine):
+    with engine.begin() as conn:
+        ensure_migrations_table(conn)
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def pending_versions(engine):
+    """Versions not applied yet. Read-only: creates nothing, unlike applied_versions."""
+    with engine.connect() as conn:
+        done = set()
+        if inspect(conn).has_table("schema_migrations"):
+            done = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+    return [version for version, _, _ in MIGRATIONS if version not in done]
+
+
+def run_migrations(engine, verbose=False):
+    """Apply pending steps in order, each in its own transaction. Returns the versions applied."""
+    done = applied_versions(engine)
+    applied = []
+    for version, name, steps in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as conn:
+            for step in steps:
+                step(conn)
+            conn.execute(text("INSERT INTO schema_migrations (version, name) VALUES (:v, :n)"), {"v": version, "n": name})
+        applied.append(version)
+        if verbose:
+            print(f"   - Applied migration {version}: {name}")
+    return applied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply or list schema migrations")
+    parser.add_argument("--status", action="store_true", help="List migrations without applying them")
+    args = parser.parse_args()
+
+    from .models import engine, create_tables
+    if args.status:
+        done = applied_versions(engine)
+        for version, name, _ in MIGRATIONS:
+            print(f"{'applied' if version in done else 'pending'}  {version:3d}  {name}")
+    else:
+        print("🗄️  Migrating schema...")
+        applied = create_tables(verbose=True)
+        print(f"✅ Schema up to date ({len(applied)} migration(s) applied).")
@@ -1,7 +1,7 @@
-from sqlalchemy import create_engine, MetaData, Table, Column, String, Integer, DateTime, Boolean, Numeric, ForeignKey, Text, Index, BigInteger, Float, JSON, text
+from sqlalchemy import create_engine, MetaData, Table, Column, String, Integer, DateTime, Boolean, Numeric, ForeignKey, Text, Index, BigInteger, Float, JSON, LargeBinary, text
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
 from sqlalchemy.dialects.postgresql import UUID, JSONB
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, expression
 from pgvector.sqlalchemy import Vector
 import os
 from dotenv import load_dotenv
@@ -22,20 +22,81 @@ if "sqlite" in DATABASE_URL:
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
 
 from sqlalchemy import event
+from sqlalchemy.exc import DisconnectionError
+from .generations import BULK_PAGE_SIZE, active_db_path
 
-engine = create_engine(
-    DATABASE_URL, 
-    connect_args={"check_same_thread": False, "timeout": 30} if "sqlite" in DATABASE_URL else {}
-)
+IS_SQLITE = "sqlite" in DATABASE_URL
 
-# Enable WAL mode for SQLite
-if "sqlite" in DATABASE_URL:
-    @event.listens_for(engine, "connect")
-    def set_sqlite_pragma(dbapi_connection, connection_record):
+# Connection profiles, one per workload. SQLite PRAGMAs are per connection, so
+# every engine applies its own list on connect, in order (page_size only takes
+# effect on a still-empty file, i.e. before journal_mode=WAL is first set).
+#   default - sync engine: API startup, migrations, ad-hoc scripts
+#   bulk    - pipeline scripts (DB_PROFILE=bulk): no fsync per commit, large
+#             cache, 16 KiB pages for new files, secondary indexes rebuilt after
+#             loads (see pipeline.deferred_indexes)
+#   read    - the API's async engine: query_only, large page cache, mmap reads,
+#             in-memory temp b-trees
+#   write   - the API's one-connection engine for the few endpoints that write
+SQLITE_PRAGMAS = {
+    "default": [("journal_mode", "WAL"), ("synchronous", "NORMAL")],
+    "bulk": [
+        ("page_size", BULK_PAGE_SIZE), ("journal_mode", "WAL"), ("synchronous", "OFF"),
+        ("cache_size", -256 * 1024), ("temp_store", "MEMORY"),  # cache_size < 0 is KiB
+    ],
+    "read": [
+        ("journal_mode", "WAL"), ("synchronous", "NORMAL"), ("cache_size", -64 * 1024),
+        ("mmap_size", 256 * 1024 * 1024), ("temp_store", "MEMORY"), ("query_only", "ON"),
+    ],
+    "write": [("journal_mode", "WAL"), ("synchronous", "NORMAL"), ("temp_store", "MEMORY")],
+}
+# Postgres equivalents, passed as startup parameters
+POSTGRES_SETTINGS = {
+    "bulk": {"synchronous_commit": "off"},
+    "read": {"default_transaction_read_only": "on"},
+}
+
+DB_PROFILE = os.getenv("DB_PROFILE", "default")
+if DB_PROFILE not in ("default", "bulk"):
+    raise ValueError(f"DB_PROFILE must be 'default' or 'bulk', not {DB_PROFILE!r}")
+
+# Read pool for the API; SQLite WAL readers don't block each other
+API_DB_POOL_SIZE = int(os.getenv("API_DB_POOL_SIZE", "8"))
+
+def sqlite_pragma_listener(profile):
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
         cursor = dbapi_connection.cursor()
-        cursor.execute("PRAGMA journal_mode=WAL")
-        cursor.execute("PRAGMA synchronous=NORMAL")
+        for name, value in SQLITE_PRAGMAS[profile]:
+            cursor.execute(f"PRAGMA {name}={value}")
         cursor.close()
+    return set_sqlite_pragmas
+
+def follow_active_generation(target):
+    """
+    Open the generation the <db>.current pointer names (blue/green rebuilds,
+    see app/generations.py) and drop pooled connections to an older one.
+    """
+    @event.listens_for(target, "do_connect")
+    def connect_to_active_generation(dialect, connection_record, cargs, cparams):
+        path = active_db_path(db_path)
+        cargs[0] = path
+        connection_record.info["db_path"] = path
+
+    @event.listens_for(target, "checkout")
+    def drop_stale_generation(dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info.get("db_path") != active_db_path(db_path):
+            raise DisconnectionError("database generation switched")
+
+def sync_connect_args(profile):
+    if IS_SQLITE:
+        return {"check_same_thread": False, "timeout": 30}
+    settings = POSTGRES_SETTINGS.get(profile)
+    return {"options": " ".join(f"-c {k}={v}" for k, v in settings.items())} if settings else {}
+
+engine = create_engine(DATABASE_URL, connect_args=sync_connect_args(DB_PROFILE))
+
+if IS_SQLITE:
+    event.listen(engine, "connect", sqlite_pragma_listener(DB_PROFILE))
+    follow_active_generation(engine)
 
 # Session Factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -47,6 +108,50 @@ def get_db():
     finally:
         db.close()
 
+# Async path for the FastAPI app (aiosqlite / asyncpg).
+# Pipeline scripts keep using the sync engine above.
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+def to_async_url(url):
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql+psycopg2:"):
+        return url.replace("postgresql+psycopg2:", "postgresql+asyncpg:", 1)
+    if url.startswith("postgresql:") or url.startswith("postgres:"):
+        return "postgresql+asyncpg:" + url.split(":", 1)[1]
+    return url
+
+ASYNC_DATABASE_URL = to_async_url(DATABASE_URL)
+
+def async_connect_args(profile):
+    if IS_SQLITE:
+        return {"timeout": 30}
+    settings = POSTGRES_SETTINGS.get(profile)
+    return {"server_settings": settings} if settings else {}
+
+def create_api_engine(profile, pool_size, max_overflow):
+    api_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        connect_args=async_connect_args(profile),
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+    )
+    if IS_SQLITE:
+        event.listen(api_engine.sync_engine, "connect", sqlite_pragma_listener(profile))
+        follow_active_generation(api_engine.sync_engine)
+    return api_engine
+
+# Reads (every GET) go through the read-only pool; writes go through the
+# single-connection engine owned by app/writer.py (SQLite has one writer anyway)
+async_engine = create_api_engine("read", API_DB_POOL_SIZE, API_DB_POOL_SIZE)
+async_write_engine = create_api_engine("write", 1, 0)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 Base = declarative_base()
 
 class Contact(Base):
@@ -55,6 +160,8 @@ class Contact(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     email = Column(String, unique=True, index=True, nullable=False)
     name = Column(String, nullable=True)
+    # Decoded/NFC-normalized name, filled at ingest (see app.utils.display_text)
+    display_name = Column(String, nullable=True)
     company_name = Column(String, nullable=True)
     closeness_score = Column(Float, default=0)
     last_contacted_at = Column(DateTime(timezone=True), nullable=True)
@@ -63,6 +170,33 @@ class Contact(Base):
 
     threads = relationship("Thread", back_populates="contact")
     messages = relationship("Message", back_populates="contact")
+    stats = relationship("ContactStats", back_populates="contact", uselist=False)
+
+    __table_args__ = (
+        Index('idx_contacts_closeness_score', 'closeness_score'),
+    )
+
+class ContactStats(Base):
+    # Materialized per-contact aggregates for the contact view.
+    # Maintained by extract_features.py; one row per contact with active threads.
+    __tablename__ = "contact_stats"
+
+    contact_id = Column(Integer, ForeignKey("contacts.id", ondelete="CASCADE"), primary_key=True)
+    max_score = Column(Float, nullable=False, default=0)
+    thread_count = Column(Integer, nullable=False, default=0)
+    first_contact_date = Column(DateTime(timezone=True), nullable=True)
+    last_contact_date = Column(DateTime(timezone=True), nullable=True)
+    top_thread_id = Column(Integer, nullable=True)
+    top_thread_title = Column(String, nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    contact = relationship("Contact", back_populates="stats")
+
+    # One index per supported /contacts sort order
+    __table_args__ = (
+        Index('idx_contact_stats_score', 'max_score', 'contact_id'),
+        Index('idx_contact_stats_last_contact', 'last_contact_date', 'contact_id'),
+    )
 
 class Thread(Base):
     __tablename__ = "threads"
@@ -70,17 +204,27 @@ class Thread(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     contact_id = Column(Integer, ForeignKey("contacts.id", ondelete="CASCADE"), nullable=False)
     subject = Column(String, nullable=True)
+    # Decoded/NFC-normalized subject, filled at ingest (see app.utils.display_text)
+    display_subject = Column(String, nullable=True)
     message_count = Column(Integer, default=0)
     last_message_at = Column(DateTime(timezone=True))
     status = Column(String, default='active') # active, ignored, pending_body
     score = Column(Float, default=0)
     metadata_ = Column(JSON, default={})
+    # Set by import / rethreading / filtering, cleared by extract_features.py once rescored
+    features_dirty = Column(Boolean, nullable=False, default=True, server_default=expression.true())
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     contact = relationship("Contact", back_populates="threads")
     messages = relationship("Message", back_populates="thread", cascade="all, delete-orphan")
     
-    __table_args__ = (Index('idx_threads_contact_id', 'contact_id'),)
+    __table_args__ = (
+        Index('idx_threads_contact_status_last', 'contact_id', 'status', 'last_message_at'),
+        Index('idx_threads_features_dirty', 'features_dirty'),
+        # Keyset pagination for /threads (sort=score / sort=date)
+        Index('idx_threads_status_score_id', 'status', 'score', 'id'),
+        Index('idx_threads_status_last_message_id', 'status', 'last_message_at', 'id'),
+    )
 
 class Message(Base):
     __tablename__ = "messages"
@@ -90,9 +234,12 @@ class Message(Base):
     contact_id = Column(Integer, ForeignKey("contacts.id", ondelete="CASCADE"), nullable=False)
     message_id = Column(String, unique=True, nullable=False)
     sender_type = Column(String, nullable=False)
+    # Bodies live in message_bodies (app/body_store.py); this only holds the
+    # 'Pending extraction' marker or a not-yet-migrated legacy body.
     content_body = Column(Text, nullable=True)
+    snippet = Column(String, nullable=True) # First SNIPPET_CHARS of the body, for list views
     subject = Column(String, nullable=True) # Added for rigorous threading
-    # content_vector = Column(Vector(768)) # Gemini Standard - Removed for SQLite compatibility
+    # content_vector = Column(Vector(768)) # Gemini Standard - Removed for SQLite compatibility (see MessageEmbedding)
     sent_at = Column(DateTime(timezone=True), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
@@ -102,8 +249,63 @@ class Message(Base):
     metadata_ = Column(JSON, default={})
     
     __table_args__ = (
-        Index('idx_messages_thread_id', 'thread_id'),
+        Index('idx_messages_thread_sent_at', 'thread_id', 'sent_at'),
         Index('idx_messages_contact_id', 'contact_id'),
+        # Keyset pagination for /messages
+        Index('idx_messages_sent_at_id', 'sent_at', 'id'),
+    )
+
+class MessageBody(Base):
+    # Compressed message bodies, kept out of the hot messages table.
+    # codec: 'zstd' (dict_id -> body_dicts) | 'zlib' | 'raw'
+    __tablename__ = "message_bodies"
+
+    message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"), primary_key=True)
+    codec = Column(String, nullable=False)
+    dict_id = Column(Integer, nullable=True)
+    body = Column(LargeBinary, nullable=False)
+    body_hash = Column(String, nullable=True) # sha1 of the body text, set by store_bodies
+
+    __table_args__ = (
+        # Covering: change checks read the hashes without touching the bodies
+        Index('idx_message_bodies_hash', 'message_id', 'body_hash'),
+    )
+
+class BodyDict(Base):
+    # zstd dictionaries trained on our own mail (scripts/migrate_bodies.py --train-dict)
+    __tablename__ = "body_dicts"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class MessageEmbedding(Base):
+    # Source of truth for message vectors (float16 bytes, L2-normalized),
+    # written by scripts/generate_embeddings.py. Search reads the memory-mapped
+    # export in app/vector_store.py, not this table.
+    __tablename__ = "message_embeddings"
+
+    message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"), primary_key=True)
+    model = Column(String, nullable=False)
+    content_hash = Column(String, nullable=True) # sha1 of the embedded text (app/embeddings.py)
+    body_hash = Column(String, nullable=True) # message_bodies.body_hash it was checked against
+    vector = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class PassageEmbedding(Base):
+    # Vectors of the overlapping passages of long messages (split_passages in
+    # app/embeddings.py), replaced whenever the message is re-embedded.
+    # Exported as the "passages" vector collection.
+    __tablename__ = "passage_embeddings"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"), nullable=False)
+    position = Column(Integer, nullable=False) # passage number within the message
+    model = Column(String, nullable=False)
+    vector = Column(LargeBinary, nullable=False)
+
+    __table_args__ = (
+        Index('idx_passage_embeddings_message_id', 'message_id'),
     )
 
 class IgnoreList(Base):
@@ -114,6 +316,37 @@ class IgnoreList(Base):
     type = Column(Text, nullable=False) # 'email' or 'domain'
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+class DataVersion(Base):
+    # Single row (id=1) bumped whenever pipeline stages or settings change what
+    # the API serves. Keys the API's response cache and ETags. filter_version
+    # moves only with what /search filters read (dates, threads, statuses, scores).
+    __tablename__ = "data_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    filter_version = Column(Integer, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class StatCounter(Base):
+    # Named totals served by /stats (contacts, messages, threads per status...),
+    # recomputed by the pipeline stages that change them (see app/pipeline.py)
+    # so the endpoint never has to COUNT(*) the big tables.
+    __tablename__ = "stat_counters"
+
+    name = Column(Text, primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
 
-def create_tables():
+def create_tables(verbose=False):
+    """Create missing tables, then apply pending migrations (app/migrations.py)."""
+    from .migrations import run_migrations
     Base.metadata.create_all(bind=engine)
+    applied = run_migrations(engine, verbose=verbose)
+    # Put back any model index a bulk load dropped and didn't get to rebuild
+    # (pipeline.deferred_indexes interrupted)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+    return applied
@@ -0,0 +1,94 @@
+"""
+Keyset (cursor) pagination helpers for the list endpoints.
+
+A cursor is an opaque token holding the sort key name and the (value, id) of
+the last row of the previous page. The next page starts strictly after it, so
+every page is a bounded index range scan instead of OFFSET's scan-and-discard.
+
+Date values travel as the text SQLite actually stored, and are bound back
+as text: rows written by the importers' raw inserts ('YYYY-MM-DD HH:MM:SS',
+'+09:00' offsets) don't round-trip through DateTime's own formatting, and a
+bound that compares differently from the stored string repeats or skips rows.
+"""
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import tuple_, type_coerce, literal, String, DateTime
+
+# Response header carrying the cursor for the next page (absent on the last page)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def cursor_column(column):
+    """The sort column as stored: text for dates on SQLite (see the module docstring)."""
+    if isinstance(column.type, DateTime):
+        return type_coerce(column, String).label("cursor_value")
+    return column.label("cursor_value")
+
+def encode_cursor(key, value, row_id):
+    if isinstance(value, datetime):
+        value = {"dt": value.isoformat()}
+    payload = json.dumps({"k": key, "v": value, "id": row_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor, key):
+    """Returns (value, id). Raises 400 on a malformed cursor or one from another sort order."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        value = data["v"]
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value["dt"])
+        row_id = int(data["id"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if data.get("k") != key:
+        raise HTTPException(status_code=400, detail="Cursor does not match sort order")
+    return value, row_id
+
+async def fetch_keyset_page(db, stmt, column, id_column, limit, after=None, descending=True, scalars=True):
+    """
+    Fetch one page of the select `stmt` ordered by (column, id_column), starting
+    strictly after `after` = (value, id) when given. Returns (ORM objects
+    (scalars=True) or result rows, (value, id) to encode_cursor for the page
+    after it or None on a short page). Result rows end with cursor_value, cursor_id.
+    NULL sort values are fetched as a separate segment (last when descending,
+    first when ascending, as SQLite orders them) so that each segment stays a
+    plain index range seek instead of an OR that forces a scan.
+    """
+    col_order = column.desc() if descending else column.asc()
+    id_order = id_column.desc() if descending else id_column.asc()
+
+    stmt = stmt.add_columns(cursor_column(column), id_column.label("cursor_id"))
+    value_seg = stmt.where(column.isnot(None)).order_by(col_order, id_order)
+    null_seg = stmt.where(column.is_(None)).order_by(id_order)
+
+    if after is not None:
+        value, last_id = after
+        id_after = (id_column < last_id) if descending else (id_column > last_id)
+        if value is None:
+            null_seg = null_seg.where(id_after)
+            if descending:
+                value_seg = None # Already past every non-NULL row
+        else:
+            # Row-value comparison: one index range on (column, id) on SQLite and
+            # Postgres alike (an OR of the two conditions becomes a sorted union)
+            if isinstance(value, str):
+                value = literal(value, String)  # stored text, compared as such
+            key, bound = tuple_(column, id_column), tuple_(value, last_id)
+            value_seg = value_seg.where(key < bound if descending else key > bound)
+            if not descending:
+                null_seg = None # NULLs came first
+
+    rows = []
+    for segment in ([value_seg, null_seg] if descending else [null_seg, value_seg]):
+        if segment is None:
+            continue
+        rows += (await db.execute(segment.limit(limit - len(rows)))).all()
+        if len(rows) >= limit:
+            break
+    next_after = None
+    if rows and len(rows) == limit:
+        next_after = (rows[-1].cursor_value, rows[-1].cursor_id)
+    return ([row[0] for row in rows] if scalars else rows), next_after
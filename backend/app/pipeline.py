@@ -0,0 +1,276 @@
+"""
+Helpers shared by the pipeline scripts (import, rethreading, filtering, scoring).
+"""
+from collections import Counter
+from contextlib import contextmanager
+from sqlalchemy import text
+from .utils import display_text
+
+# Keep IN (...) lists well under SQLite's variable/expression limits
+CHUNK_SIZE = 500
+
+def chunked(items, size=CHUNK_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+@contextmanager
+def deferred_indexes(engine, *table_names):
+    """
+    Bulk profile only (DB_PROFILE=bulk): drop the non-unique indexes of the
+    given tables for the duration of a load and rebuild them afterwards, one
+    sorted build per index instead of a b-tree insert per row. Unique indexes
+    stay, since loads rely on them for ON CONFLICT. No-op in other profiles.
+    """
+    from .models import Base, DB_PROFILE
+    if DB_PROFILE != "bulk":
+        yield
+        return
+    indexes = [ix for name in table_names for ix in Base.metadata.tables[name].indexes if not ix.unique]
+    with engine.begin() as conn:
+        for ix in indexes:
+            ix.drop(conn, checkfirst=True)
+    print(f"   - Deferred {len(indexes)} index(es) on {', '.join(table_names)}")
+    try:
+        yield
+    finally:
+        with engine.begin() as conn:
+            for ix in indexes:
+                ix.create(conn, checkfirst=True)
+        print(f"   - Rebuilt {len(indexes)} index(es)")
+
+def bump_data_version(conn, filters=True):
+    """
+    Invalidate the API's response cache (see app/cache.py). Accepts a Connection
+    or Session; runs in the caller's transaction. Returns the new version.
+    filters=False for changes no /search filter reads (bodies, display text,
+    the ignore list): the exported filter attributes stay current.
+    """
+    params = {"f": 1 if filters else 0}
+    res = conn.execute(text("""
+        UPDATE data_version
+        SET version = version + 1, filter_version = filter_version + :f, updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1
+    """), params)
+    if res.rowcount == 0:
+        conn.execute(text("""
+            INSERT INTO data_version (id, version, filter_version, updated_at)
+            VALUES (1, 1, :f, CURRENT_TIMESTAMP)
+        """), params)
+    return conn.execute(text("SELECT version FROM data_version WHERE id = 1")).scalar()
+
+def refresh_stat_counters(conn):
+    """
+    Recompute the stat_counters rows behind /stats from scratch: contact,
+    message and thread totals, threads per status, and contacts currently
+    listed (contact_stats). Full scans: the repair path (extract_features.py
+    --full). Stages keep the counters current with adjust_stat_counters.
+    """
+    counters = {
+        "contacts": conn.execute(text("SELECT COUNT(*) FROM contacts")).scalar() or 0,
+        "messages": conn.execute(text("SELECT COUNT(*) FROM messages")).scalar() or 0,
+        "contacts_active": conn.execute(text("SELECT COUNT(*) FROM contact_stats WHERE max_score > 0")).scalar() or 0,
+    }
+    thread_total = 0
+    for status, count in conn.execute(text("SELECT status, COUNT(*) FROM threads GROUP BY status")).fetchall():
+        counters[f"threads:{status or 'unknown'}"] = count
+        thread_total += count
+    counters["threads"] = thread_total
+
+    conn.execute(text("DELETE FROM stat_counters"))
+    conn.execute(text("""
+        INSERT INTO stat_counters (name, value, updated_at)
+        VALUES (:name, :value, CURRENT_TIMESTAMP)
+    """), [{"name": k, "value": v} for k, v in counters.items()])
+    return counters
+
+def adjust_stat_counters(conn, deltas):
+    """
+    Add deltas ({counter name: change}) to the stat_counters rows, in the
+    caller's transaction. Stages count the rows they insert, delete or
+    re-status as they go, so /stats stays current without a recount.
+    """
+    rows = [{"name": name, "delta": delta} for name, delta in deltas.items() if delta]
+    if rows:
+        conn.execute(text("""
+            INSERT INTO stat_counters (name, value, updated_at)
+            VALUES (:name, :delta, CURRENT_TIMESTAMP)
+            ON CONFLICT (name) DO UPDATE
+            SET value = stat_counters.value + excluded.value, updated_at = CURRENT_TIMESTAMP
+        """), rows)
+
+def thread_deltas(statuses, sign=1):
+    """Counter deltas for threads with these statuses being added (sign=1) or removed (-1)."""
+    deltas = Counter()
+    for status in statuses:
+        deltas["threads"] += sign
+        deltas[f"threads:{status or 'unknown'}"] += sign
+    return deltas
+
+def set_thread_status(conn, status, where, params=None, also_set=""):
+    """
+    UPDATE threads SET status = :status (plus also_set, e.g. ", score = 0")
+    WHERE where, moving the per-status counters along. Returns the rowcount.
+    """
+    params = {**(params or {}), "status": status}
+    moved = conn.execute(text(f"""
+        SELECT status, COUNT(*) FROM threads
+        WHERE ({where}) AND (status IS NULL OR status != :status)
+        GROUP BY status
+    """), params).fetchall()
+    res = conn.execute(text(f"UPDATE threads SET status = :status{also_set} WHERE {where}"), params)
+    deltas = Counter()
+    for old, count in moved:
+        deltas[f"threads:{old or 'unknown'}"] -= count
+        deltas[f"threads:{status}"] += count
+    adjust_stat_counters(conn, deltas)
+    return res.rowcount
+
+def delete_threads(conn, where, params=None):
+    """DELETE FROM threads WHERE where, keeping the thread counters in step. Returns the count."""
+    statuses = conn.execute(text(f"DELETE FROM threads WHERE {where} RETURNING status"), params or {}).scalars().all()
+    adjust_stat_counters(conn, thread_deltas(statuses, -1))
+    return len(statuses)
+
+def delete_contact_stats(conn, where, params=None):
+    """DELETE FROM contact_stats WHERE where, keeping contacts_active in step. Returns the count."""
+    scores = conn.execute(text(f"DELETE FROM contact_stats WHERE {where} RETURNING max_score"), params or {}).scalars().all()
+    adjust_stat_counters(conn, {"contacts_active": -sum(1 for s in scores if s and s > 0)})
+    return len(scores)
+
+def fill_display_columns(conn, full=False):
+    """
+    Backfill threads.display_subject / contacts.display_name from the raw
+    headers for rows written before (or outside) the ingest paths that set
+    them. full=True recomputes every row. Returns (threads, contacts) updated.
+    """
+    counts = []
+    for table, raw_col, display_col in (("threads", "subject", "display_subject"), ("contacts", "name", "display_name")):
+        where = "" if full else f"WHERE {display_col} IS NULL AND {raw_col} IS NOT NULL"
+        rows = conn.execute(text(f"SELECT id, {raw_col} FROM {table} {where}")).fetchall()
+        updates = [{"id": row_id, "value": display_text(raw)} for row_id, raw in rows]
+        for chunk in chunked(updates, 5000):
+            conn.execute(text(f"UPDATE {table} SET {display_col} = :value WHERE id = :id"), chunk)
+        counts.append(len(updates))
+    return tuple(counts)
+
+def mark_threads_dirty(conn, thread_ids):
+    """
+    Flag threads so the next extract_features.py run rescores them
+    (and re-aggregates the contacts that own them).
+    """
+    tids = sorted(set(int(t) for t in thread_ids if t is not None))
+    for chunk in chunked(tids):
+        tids_str = ",".join(str(t) for t in chunk)
+        conn.execute(text(f"UPDATE threads SET features_dirty = TRUE WHERE id IN ({tids_str})"))
+    return len(tids)
+
+def mark_threads_dirty_for_messages(conn, message_ids):
+    """Same as mark_threads_dirty, keyed by Message-ID header values."""
+    mids = list(set(m for m in message_ids if m))
+    for chunk in chunked(mids):
+        params = {f"m{i}": mid for i, mid in enumerate(chunk)}
+        placeholders = ",".join(f":m{i}" for i in range(len(chunk)))
+        conn.execute(text(f"""
+            UPDATE threads SET features_dirty = TRUE
+            WHERE id IN (SELECT thread_id FROM messages WHERE message_id IN ({placeholders}))
+        """), params)
+
+def mark_orphan_thread_contacts_dirty(conn):
+    """
+    Call right before deleting threads that lost all their messages.
+    A deleted thread can't carry the flag itself, so its contact's surviving
+    threads are flagged instead and the contact gets re-aggregated.
+    (Contacts left with no threads at all are swept by the scorer.)
+    """
+    conn.execute(text("""
+        UPDATE threads SET features_dirty = TRUE
+        WHERE contact_id IN (
+            SELECT contact_id FROM threads
+            WHERE id NOT IN (SELECT DISTINCT thread_id FROM messages)
+        )
+    """))
+
+def refresh_contact_aggregates(conn, contact_ids):
+    """
+    Re-aggregate closeness_score / last_contacted_at and the contact_stats row
+    for the given contacts only, in place. Contacts left without active threads
+    drop to 0 and lose their contact_stats row.
+    """
+    updated = 0
+    for chunk in chunked(sorted(set(contact_ids))):
+        cids_str = ",".join(str(c) for c in chunk)
+        listed_before = conn.execute(text(
+            f"SELECT COUNT(*) FROM contact_stats WHERE contact_id IN ({cids_str}) AND max_score > 0"
+        )).scalar()
+        rows = conn.execute(text(f"""
+            SELECT id, contact_id, score, last_message_at, subject
+            FROM threads
+            WHERE status = 'active' AND contact_id IN ({cids_str})
+        """)).fetchall()
+        first_rows = conn.execute(text(f"""
+            SELECT t.contact_id, MIN(m.sent_at)
+            FROM threads t
+            JOIN messages m ON m.thread_id = t.id
+            WHERE t.status = 'active' AND t.contact_id IN ({cids_str})
+            GROUP BY t.contact_id
+        """)).fetchall()
+        first_contact = {r[0]: r[1] for r in first_rows}
+
+        # Python-side aggregation (MAX score, latest activity, top thread)
+        stats = {}
+        for tid, cid, score, last_at, subject in rows:
+            score = score or 0.0
+            st = stats.setdefault(cid, {"score": 0.0, "last_at": None, "count": 0, "top": None})
+            st["count"] += 1
+            if st["top"] is None or score > st["top"][0]:
+                st["top"] = (score, tid, subject)
+            if score > st["score"]:
+                st["score"] = score
+            if last_at:
+                # If string, simple compare works for ISO.
+                if st["last_at"] is None or str(last_at) > str(st["last_at"]):
+                    st["last_at"] = last_at
+
+        contact_updates = []
+        stats_rows = []
+        for cid, st in stats.items():
+            contact_updates.append({"cid": cid, "score": st["score"], "last_at": st["last_at"]})
+            _, top_tid, top_subject = st["top"]
+            stats_rows.append({
+                "cid": cid,
+                "score": st["score"],
+                "count": st["count"],
+                "first_at": first_contact.get(cid),
+                "last_at": st["last_at"],
+                "top_tid": top_tid,
+                "top_title": display_text(top_subject) or "(No Subject)",
+            })
+        inactive_cids = [cid for cid in chunk if cid not in stats]
+
+        if contact_updates:
+            conn.execute(text("UPDATE contacts SET closeness_score = :score, last_contacted_at = :last_at WHERE id = :cid"), contact_updates)
+        if inactive_cids:
+            inactive_str = ",".join(str(c) for c in inactive_cids)
+            conn.execute(text(f"UPDATE contacts SET closeness_score = 0 WHERE id IN ({inactive_str}) AND closeness_score != 0"))
+            conn.execute(text(f"DELETE FROM contact_stats WHERE contact_id IN ({inactive_str})"))
+
+        # Rows update in place: no delete + re-insert churn on the table and its indexes
+        if stats_rows:
+            conn.execute(text("""
+                INSERT INTO contact_stats
+                    (contact_id, max_score, thread_count, first_contact_date, last_contact_date,
+                     top_thread_id, top_thread_title, updated_at)
+                VALUES (:cid, :score, :count, :first_at, :last_at, :top_tid, :top_title, CURRENT_TIMESTAMP)
+                ON CONFLICT (contact_id) DO UPDATE SET
+                    max_score = excluded.max_score,
+                    thread_count = excluded.thread_count,
+                    first_contact_date = excluded.first_contact_date,
+                    last_contact_date = excluded.last_contact_date,
+                    top_thread_id = excluded.top_thread_id,
+                    top_thread_title = excluded.top_thread_title,
+                    updated_at = excluded.updated_at
+            """), stats_rows)
+        adjust_stat_counters(conn, {"contacts_active": sum(1 for r in stats_rows if r["score"] > 0) - listed_before})
+        updated += len(chunk)
+    return updated
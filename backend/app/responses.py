@@ -0,0 +1,18 @@
+"""
+orjson-backed JSON response for the API.
+
+Routes returning large payloads build this response themselves, which skips
+FastAPI's jsonable_encoder pass; it is also the app's default response class.
+orjson serializes datetimes (ISO 8601) and NumPy scalars / arrays natively.
+Kept here rather than imported from fastapi.responses, where ORJSONResponse
+is deprecated.
+"""
+import orjson
+from fastapi.responses import JSONResponse
+
+
+class ORJSONResponse(JSONResponse):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
@@ -1,72 +1,438 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import text
-from app.models import get_db, Message, Thread, Contact
-from sentence_transformers import SentenceTransformer
-from .utils import decode_mime
+import asyncio
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import text, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import async_engine, get_async_db, Message, Thread, Contact, ContactStats, PassageEmbedding
+from app.responses import ORJSONResponse
+from app.cache import LRUCache
+from app.fulltext import (
+    parse_query, bigram_query, like_pattern, mark_terms, window, to_html, search_text,
+    MARK_OPEN, MARK_CLOSE, SNIPPET_TOKENS,
+)
+from app.vector_store import get_index
+from app.search_filters import SearchFilters, attributes_current, current_filter_version, id_mask, live_ids
 
 router = APIRouter()
 
-# Load model (Global cache)
-# This loads on startup, might be slow.
-# For production, use a separate service or lighter model loading.
-# Since we reuse the same container, it's fine.
-_model = None
+MAX_LIMIT = 100
+# Hits each retriever hands to fusion / grouping: bounded work per query
+CANDIDATES = 100
+# Reciprocal rank fusion: a hit scores sum(1 / (RRF_K + rank)) over the retrievers
+RRF_K = 60
+# Passage hits fetched per requested message hit; several usually share a message
+PASSAGE_FANOUT = 3
+MODES = ("keyword", "semantic", "hybrid")
+GROUPS = ("message", "thread", "contact")
 
-def get_model():
-    global _model
-    if _model is None:
-        print("🧠 Loading Semantic Search Model...")
-        _model = SentenceTransformer('sentence-transformers/paraphrase-multilingual-mpnet-base-v2')
-    return _model
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "1024"))  # 3 KiB per vector
+# Load the model at startup instead of on the first semantic query
+SEARCH_WARM_UP = os.getenv("SEARCH_WARM_UP", "1") != "0"
+
+# Query encoding and the vector scan are CPU-bound: keep them off the event
+# loop, one at a time (the model isn't shared across threads)
+_semantic_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="semantic-search")
+
+# Normalized query text -> query vector. Typing-driven re-searches and
+# repeated queries never reach the model.
+query_vectors = LRUCache(QUERY_CACHE_MAX_ENTRIES)
+
+_warm_up = {"state": "idle", "error": None, "seconds": None}
+
+class ModelUnavailable(Exception):
+    """The embedding model couldn't be loaded (missing packages, bad download...)."""
+
+def model_unavailable():
+    return HTTPException(
+        status_code=503,
+        detail=f"Semantic search is unavailable ({_warm_up['error']}); see /search/ready",
+    )
+
+def load_query_model():
+    # On _semantic_executor. A failure is remembered like a failed warm-up:
+    # later queries get the 503 at once instead of retrying the load.
+    from app.embeddings import get_model
+    try:
+        get_model()
+    except Exception as e:
+        _warm_up["state"], _warm_up["error"] = "failed", f"{type(e).__name__}: {e}"
+        raise ModelUnavailable() from e
+
+def warm_up():
+    # Runs on _semantic_executor: queries that arrive meanwhile wait behind it
+    started = time.monotonic()
+    _warm_up["state"] = "loading"
+    try:
+        from app.embeddings import encode
+        encode(["warm-up"])  # model load + first forward pass
+        for name in ("messages", "passages", "threads", "contacts"):
+            get_index(name).meta  # maps the current export
+        _warm_up["state"] = "ready"
+    except Exception as e:
+        _warm_up["state"], _warm_up["error"] = "failed", f"{type(e).__name__}: {e}"
+    _warm_up["seconds"] = round(time.monotonic() - started, 3)
+
+def start_warm_up():
+    if SEARCH_WARM_UP and _warm_up["state"] == "idle":
+        _warm_up["state"] = "queued"
+        _semantic_executor.submit(warm_up)
+
+@router.get("/search/ready")
+async def search_ready():
+    # Readiness of semantic search: 200 once the model is loaded, else 503.
+    # Keyword search doesn't depend on it.
+    from app.embeddings import model_loaded
+    lookups = query_vectors.hits + query_vectors.misses
+    body = {
+        "ready": model_loaded(),
+        "warm_up": dict(_warm_up),
+        "vectors": {name: len(get_index(name)) for name in ("messages", "passages", "threads", "contacts")},
+        "query_cache": {
+            "entries": len(query_vectors),
+            "max_entries": query_vectors.max_entries,
+            "hits": query_vectors.hits,
+            "misses": query_vectors.misses,
+            "hit_rate": round(query_vectors.hits / lookups, 4) if lookups else None,
+        },
+    }
+    return ORJSONResponse(body, status_code=200 if body["ready"] else 503)
 
 @router.get("/search")
-def semantic_search(
-    q: str, 
-    limit: int = 10, 
-    db: Session = Depends(get_db)
+async def search(
+    q: str,
+    limit: int = 10,
+    mode: str = "keyword",
+    group: Optional[str] = None,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    contact_id: Optional[int] = None,
+    domain: Optional[str] = None,
+    status: Optional[str] = None,
+    min_score: Optional[float] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    if not q:
+    # mode: keyword (FTS5 / BM25), semantic (vector index) or hybrid (both, fused).
+    # group: one hit per message, thread or contact; hybrid defaults to thread.
+    # since / until (message date, inclusive), contact_id / domain (the thread's
+    # contact), status and min_score (the thread's) narrow the candidates before
+    # ranking (app/search_filters.py).
+    if mode not in MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(MODES)}")
+    group = group or ("thread" if mode == "hybrid" else "message")
+    if group not in GROUPS:
+        raise HTTPException(status_code=400, detail=f"group must be one of {', '.join(GROUPS)}")
+    limit = max(1, min(limit, MAX_LIMIT))
+    filters = SearchFilters(since, until, contact_id, domain, status, min_score)
+    # Grouping and fusion need headroom; plain lists fetch just the page
+    n = limit if mode != "hybrid" and group == "message" else max(limit, CANDIDATES)
+
+    if mode == "keyword":
+        hits = await keyword_hits(q, n, db, filters)
+    elif mode == "semantic":
+        hits = await vector_hits(q, n, db, filters)
+    else:
+        hits = await hybrid_hits(q, n, db, filters)
+    if not hits:
+        return ORJSONResponse([])
+
+    by_id = await load_hits(db, [hit["id"] for hit in hits])
+    response = []
+    seen = set()
+    for hit in hits:
+        if hit["id"] not in by_id:
+            continue
+        msg, thread, contact = by_id[hit["id"]]
+        if group != "message":
+            key = thread.id if group == "thread" else contact.id
+            if key in seen:
+                continue  # a better-ranked message already stands for this group
+            seen.add(key)
+        response.append(hit_response(msg, thread, contact, hit))
+        if len(response) == limit:
+            break
+    return ORJSONResponse(response)
+
+async def load_hits(db, ids):
+    rows = (await db.execute(
+        select(Message, Thread, Contact)
+        .join(Thread, Message.thread_id == Thread.id)
+        .join(Contact, Message.contact_id == Contact.id)
+        .where(Message.id.in_(ids))
+    )).all()
+    return {msg.id: (msg, thread, contact) for msg, thread, contact in rows}
+
+def hit_response(msg, thread, contact, hit):
+    subject = thread.display_subject or "(No Subject)"
+    return {
+        "message_id": msg.id,
+        "thread_id": thread.id,
+        "subject": subject,
+        "body": msg.snippet + "..." if msg.snippet else "",
+        # Keyword hits carry highlighted fragments; vector-only hits get the plain text
+        "subject_html": hit["subject_html"] if hit["subject_html"] is not None else to_html(subject),
+        "snippet_html": hit["snippet_html"] if hit["snippet_html"] is not None else to_html(msg.snippet),
+        "date": msg.sent_at,
+        "sender": contact.display_name or contact.email,
+        "score": float(thread.score) if thread.score else 0,
+        "relevance": hit["relevance"],
+    }
+
+def normalize_query(q):
+    return " ".join(search_text(q).split())
+
+def query_vector(q):
+    key = normalize_query(q)
+    vector = query_vectors.get(key)
+    if vector is None:
+        from app.embeddings import encode, model_loaded
+        if not model_loaded():
+            load_query_model()
+        vector = encode([key])[0]
+        query_vectors.put(key, vector)
+    return vector
+
+def nearest_vectors(q, limit, message_where=None, passage_where=None):
+    query = query_vector(q)
+    return (
+        get_index("messages").search(query, limit, where=message_where),
+        get_index("passages").search(query, limit * PASSAGE_FANOUT, where=passage_where),
+    )
+
+async def vector_candidates(q, n, filters=None):
+    # Cosine similarity against the local vector indexes (app/vector_store.py)
+    if not q.strip():
+        return [], []
+    index = get_index("messages")
+    if not len(index):
+        raise HTTPException(status_code=503, detail="The vector index is empty; run scripts/generate_embeddings.py")
+    wheres = ()
+    if filters:
+        wheres = (filters.mask, filters.mask)
+        if not index.meta.get("attrs") or not attributes_current(index.meta, await current_filter_version()):
+            # Exported attributes lag the data: filter on the live rows instead
+            async with async_engine.connect() as conn:
+                wheres = [id_mask(await live_ids(conn, filters, name)) for name in ("messages", "passages")]
+    return await run_semantic(nearest_vectors, q, n, *wheres)
+
+async def run_semantic(fn, *args):
+    # fn on the semantic executor; 503 (as /search/ready reports) without a model
+    if _warm_up["state"] == "failed":
+        raise model_unavailable()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_semantic_executor, fn, *args)
+    except ModelUnavailable:
+        raise model_unavailable()
+
+async def rank_messages(db, message_hits, passage_hits, n):
+    """A message scores its best similarity: whole-message vector or any of its passages."""
+    best = dict(message_hits)
+    if passage_hits:
+        owners = dict((await db.execute(
+            select(PassageEmbedding.id, PassageEmbedding.message_id)
+            .where(PassageEmbedding.id.in_([pk for pk, _ in passage_hits]))
+        )).all())
+        for pk, similarity in passage_hits:
+            message_id = owners.get(pk)
+            if message_id is not None and similarity > best.get(message_id, -1.0):
+                best[message_id] = similarity
+    ranked = sorted(best.items(), key=lambda item: -item[1])[:n]
+    return [
+        {"id": pk, "relevance": round(similarity, 6), "subject_html": None, "snippet_html": None}
+        for pk, similarity in ranked
+    ]
+
+async def vector_hits(q, n, db, filters=None):
+    message_hits, passage_hits = await vector_candidates(q, n, filters)
+    return await rank_messages(db, message_hits, passage_hits, n)
+
+async def keyword_hits(q, n, db, filters=None):
+    # Keyword search over the FTS5 index (app/fulltext.py): BM25-ranked,
+    # with highlighted subject / body fragments. No model involved.
+    match, short_terms = parse_query(q)
+    if not match and not short_terms:
+        return []
+    if db.bind.dialect.name != "sqlite":
+        raise HTTPException(status_code=501, detail="Keyword search needs the SQLite FTS5 index")
+
+    conditions = []
+    params = {"limit": n, "mo": MARK_OPEN, "mc": MARK_CLOSE}
+    source, newest_first = "messages_fts", "messages_fts.rowid DESC"
+    like_terms = short_terms
+    if match:
+        conditions.append("messages_fts MATCH :match")
+        params["match"] = match
+    else:
+        # Only terms under 3 characters: look them up in the bigram index,
+        # then read the matching rows' text from messages_fts by rowid
+        bigrams, like_terms = bigram_query(short_terms)
+        if bigrams:
+            source = "messages_fts_bigrams JOIN messages_fts ON messages_fts.rowid = messages_fts_bigrams.rowid"
+            newest_first = "messages_fts_bigrams.rowid DESC"
+            conditions.append("messages_fts_bigrams MATCH :bigrams")
+            params["bigrams"] = bigrams
+    for i, term in enumerate(like_terms):
+        # Checked on the rows the index lookups above matched
+        conditions.append(
+            f"(messages_fts.subject LIKE :p{i} ESCAPE '\\' OR messages_fts.body LIKE :p{i} ESCAPE '\\'"
+            f" OR messages_fts.sender LIKE :p{i} ESCAPE '\\')"
+        )
+        params[f"p{i}"] = like_pattern(term)
+    if filters:
+        # Checked by primary key per matching row, before bm25 orders and
+        # LIMITs; a subquery rather than a join keeps FTS5 doing the ordering
+        filter_conditions, filter_params = filters.sql()
+        conditions.append(f"""EXISTS (
+            SELECT 1 FROM messages m
+            JOIN threads t ON t.id = m.thread_id
+            JOIN contacts c ON c.id = t.contact_id
+            WHERE m.id = messages_fts.rowid AND {' AND '.join(filter_conditions)}
+        )""")
+        params.update(filter_params)
+
+    if match:
+        # rank = bm25 with the column weights set on the table; lower is better
+        columns = f"rowid, highlight(messages_fts, 0, :mo, :mc), snippet(messages_fts, 1, :mo, :mc, '…', {SNIPPET_TOKENS}), rank"
+        order = "rank"
+    else:
+        columns = "messages_fts.rowid, messages_fts.subject, messages_fts.body, NULL"
+        order = newest_first
+    rows = (await db.execute(text(f"""
+        SELECT {columns} FROM {source}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY {order}
+        LIMIT :limit
+    """), params)).all()
+
+    hits = []
+    for pk, subject_fragment, body_fragment, rank in rows:
+        if not match:
+            body_fragment = window(body_fragment or "", short_terms)
+        hits.append({
+            "id": pk,
+            "relevance": round(-rank, 6) if rank is not None else None,
+            "subject_html": to_html(mark_terms(subject_fragment, short_terms)),
+            "snippet_html": to_html(mark_terms(body_fragment, short_terms)),
+        })
+    return hits
+
+async def hybrid_hits(q, n, db, filters=None):
+    use_keyword = db.bind.dialect.name == "sqlite"
+    # Without a model (warm-up failed) hybrid degrades to keyword only
+    use_vectors = len(get_index("messages")) > 0 and _warm_up["state"] != "failed"
+    if not use_keyword and not use_vectors:
+        raise HTTPException(status_code=503, detail="Neither the keyword nor the vector index is available")
+    # Concurrently: the FTS query awaits the database while the vector scan
+    # runs on its worker thread. The session then resolves passage owners.
+    keyword, vectors = await asyncio.gather(
+        keyword_hits(q, n, db, filters) if use_keyword else asyncio.sleep(0, result=[]),
+        vector_candidates(q, n, filters) if use_vectors else asyncio.sleep(0, result=None),
+        return_exceptions=True,
+    )
+    if isinstance(vectors, HTTPException) and _warm_up["state"] == "failed" and use_keyword:
+        vectors = None  # the model failed to load during this query: keyword only, as above
+    for result in (keyword, vectors):
+        if isinstance(result, BaseException):
+            raise result
+    rankings = [keyword]
+    if vectors is not None:
+        rankings.append(await rank_messages(db, *vectors, n))
+    return fuse(rankings)
+
+def fuse(rankings):
+    """Reciprocal rank fusion of several ranked hit lists, best first."""
+    fused = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking, 1):
+            entry = fused.setdefault(hit["id"], {"id": hit["id"], "relevance": 0.0, "subject_html": None, "snippet_html": None})
+            entry["relevance"] += 1.0 / (RRF_K + rank)
+            # Earlier rankings (keyword) win for the highlighted fragments
+            for key in ("subject_html", "snippet_html"):
+                if entry[key] is None:
+                    entry[key] = hit[key]
+    hits = sorted(fused.values(), key=lambda hit: -hit["relevance"])
+    for hit in hits:
+        hit["relevance"] = round(hit["relevance"], 6)
+    return hits
+
+def nearest_centroids(name, q, limit):
+    return get_index(name).search(query_vector(q), limit)
+
+async def centroid_hits(name, q, limit):
+    # k-NN over the thread / contact centroids (app/centroids.py)
+    if not q.strip():
         return []
-        
-    model = get_model()
-    
-    # 1. Vectorize Query
-    query_vector = model.encode(q).tolist()
-    
-    # 2. Search Database (using pgvector)
-    # Cosine distance (<->) default for this model in pgvector usually uses L2 (<->) or Cosine (<=>)?
-    # pgvector operators:
-    # <-> : L2 distance
-    # <=> : Cosine distance
-    # <#> : Inner product
-    # We used 'vector_cosine_ops' in index, so <=> is best.
-    
-    # However, SQLAlchemy ORM doesn't support <=> directly easily in older versions.
-    # We use order_by(Message.content_vector.cosine_distance(query_vector))
-    
-    results = db.query(Message, Thread, Contact)\
-        .join(Thread, Message.thread_id == Thread.id)\
-        .join(Contact, Message.contact_id == Contact.id)\
-        .filter(Message.content_vector.isnot(None))\
-        .order_by(Message.content_vector.cosine_distance(query_vector))\
-        .limit(limit)\
-        .all()
-        
-    # 3. Format Response
+    if not len(get_index(name)):
+        raise HTTPException(status_code=503, detail=f"The {name} centroid index is empty; run scripts/generate_embeddings.py")
+    return await run_semantic(nearest_centroids, name, q, limit)
+
+@router.get("/search/contacts")
+async def search_contacts(
+    q: str,
+    limit: int = 10,
+    db: AsyncSession = Depends(get_async_db)
+):
+    # "Who did I talk to about X": one query over the contact vectors
+    hits = await centroid_hits("contacts", q, max(1, min(limit, MAX_LIMIT)))
+    if not hits:
+        return ORJSONResponse([])
+    rows = (await db.execute(
+        select(Contact, ContactStats)
+        .outerjoin(ContactStats, ContactStats.contact_id == Contact.id)
+        .where(Contact.id.in_([pk for pk, _ in hits]))
+    )).all()
+    by_id = {contact.id: (contact, stats) for contact, stats in rows}
+
+    response = []
+    for pk, similarity in hits:
+        if pk not in by_id:
+            continue
+        contact, stats = by_id[pk]
+        response.append({
+            "id": contact.id,
+            "name": contact.display_name or "Unknown",
+            "email": contact.email,
+            "relevance": round(similarity, 6),
+            "max_score": float(stats.max_score or 0.0) if stats else 0.0,
+            "thread_count": stats.thread_count if stats else 0,
+            "last_active": stats.last_contact_date.strftime("%Y-%m-%d") if stats and stats.last_contact_date else None,
+            "top_thread_title": stats.top_thread_title if stats else None,
+        })
+    return ORJSONResponse(response)
+
+@router.get("/search/threads")
+async def search_threads(
+    q: str,
+    limit: int = 10,
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Conversations about X, ranked by their whole-thread vector
+    hits = await centroid_hits("threads", q, max(1, min(limit, MAX_LIMIT)))
+    if not hits:
+        return ORJSONResponse([])
+    rows = (await db.execute(
+        select(Thread, Contact)
+        .join(Contact, Thread.contact_id == Contact.id)
+        .where(Thread.id.in_([pk for pk, _ in hits]))
+    )).all()
+    by_id = {thread.id: (thread, contact) for thread, contact in rows}
+
     response = []
-    for msg, thread, contact in results:
-        # Avoid duplicate threads if possible? 
-        # But users might want specific message context.
+    for pk, similarity in hits:
+        if pk not in by_id:
+            continue
+        thread, contact = by_id[pk]
         response.append({
-            "message_id": msg.id,
             "thread_id": thread.id,
-            "subject": decode_mime(thread.subject) if thread.subject else "(No Subject)",
-            "body": msg.content_body[:200] + "..." if msg.content_body else "",
-            "date": msg.sent_at,
-            "sender": decode_mime(contact.name) if contact.name else contact.email,
-            "score": float(thread.score) if thread.score else 0
+            "subject": thread.display_subject or "(No Subject)",
+            "contact_id": contact.id,
+            "sender": contact.display_name or contact.email,
+            "date": thread.last_message_at,
+            "message_count": thread.message_count,
+            "score": float(thread.score) if thread.score else 0,
+            "relevance": round(similarity, 6),
         })
-        
-    return response
+    return ORJSONResponse(response)
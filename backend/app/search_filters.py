@@ -0,0 +1,197 @@
+"""
+/search filters: message date range, contact or e-mail domain (of the
+thread's contact), thread status and minimum thread score.
+
+They narrow the candidates before anything is ranked, on both paths:
+
+- keyword: extra conditions on the FTS query, checked against messages /
+  threads / contacts by primary key, so bm25 orders and LIMITs matching
+  rows only;
+- vector: per-row attribute arrays exported next to the vectors
+  (app/vector_store.py write_attributes) become a NumPy row mask, and only
+  the rows it allows are scored.
+
+The attributes are re-exported by scripts/generate_embeddings.py (new
+vectors) and scripts/extract_features.py (new scores), and record the
+data_version.filter_version they were read at. That version moves only with
+what the filters read (threading, filtering, scoring), not with bodies or
+the ignore list. When it has moved past the attributes, the vector path
+takes the allowed ids from the same SQL as the keyword path (live_ids)
+until the next export, so both modes always filter on the same data.
+"""
+import time as clock
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from sqlalchemy import select, text
+
+from .cache import VERSION_TTL_SECONDS
+from .models import async_engine, Message, Thread, Contact, PassageEmbedding
+from .pipeline import chunked
+from .vector_store import get_index, write_attributes
+
+
+class SearchFilters:
+    def __init__(self, since=None, until=None, contact_id=None, domain=None, status=None, min_score=None):
+        self.since = since  # date, inclusive
+        self.until = until  # date, inclusive
+        self.contact_id = contact_id
+        self.domain = domain.strip().lstrip("@").lower() if domain and domain.strip() else None
+        self.status = status
+        self.min_score = min_score
+
+    def __bool__(self):
+        return any(v is not None for v in (
+            self.since, self.until, self.contact_id, self.domain, self.status, self.min_score,
+        ))
+
+    def sql(self):
+        """(conditions, params) over messages m, threads t and contacts c (the thread's contact)."""
+        conditions, params = [], {}
+        # sent_at is compared as text on SQLite: 'YYYY-MM-DD' sorts before that day's timestamps
+        if self.since is not None:
+            conditions.append("m.sent_at >= :f_since")
+            params["f_since"] = self.since.isoformat()
+        if self.until is not None:
+            conditions.append("m.sent_at < :f_until")
+            params["f_until"] = (self.until + timedelta(days=1)).isoformat()
+        if self.contact_id is not None:
+            conditions.append("t.contact_id = :f_contact_id")
+            params["f_contact_id"] = self.contact_id
+        if self.domain is not None:
+            conditions.append("lower(c.email) LIKE :f_domain ESCAPE '\\'")
+            params["f_domain"] = "%@" + self.domain.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        if self.status is not None:
+            conditions.append("t.status = :f_status")
+            params["f_status"] = self.status
+        if self.min_score is not None:
+            conditions.append("t.score >= :f_min_score")
+            params["f_min_score"] = self.min_score
+        return conditions, params
+
+    def mask(self, attrs, codes, ids=None):
+        """Boolean row mask over exported attributes (see export_filter_attributes)."""
+        mask = np.ones(len(attrs["sent_at"]), dtype=bool)
+        if self.since is not None:
+            mask &= attrs["sent_at"] >= datetime.combine(self.since, time.min).timestamp()
+        if self.until is not None:
+            mask &= attrs["sent_at"] < datetime.combine(self.until + timedelta(days=1), time.min).timestamp()
+        if self.contact_id is not None:
+            mask &= attrs["contact_id"] == self.contact_id
+        if self.domain is not None:
+            mask &= _code_mask(attrs["domain"], codes["domain"], self.domain)
+        if self.status is not None:
+            mask &= _code_mask(attrs["status"], codes["status"], self.status)
+        if self.min_score is not None:
+            mask &= attrs["score"] >= self.min_score
+        return mask
+
+
+    def id_sql(self, name):
+        """(query, params) selecting the ids of a collection's rows that pass, ascending."""
+        conditions, params = self.sql()
+        # Rows with a vector only: the ids the collection can contain
+        if name == "passages":
+            source = "SELECT p.id FROM passage_embeddings p JOIN messages m ON m.id = p.message_id"
+            order = "p.id"
+        else:
+            source = "SELECT e.message_id FROM message_embeddings e JOIN messages m ON m.id = e.message_id"
+            order = "e.message_id"
+        return f"""
+            {source}
+            JOIN threads t ON t.id = m.thread_id
+            JOIN contacts c ON c.id = t.contact_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY {order}
+        """, params
+
+
+async def live_ids(conn, filters, name):
+    """Ids of a collection's rows passing filters, read from the database."""
+    query, params = filters.id_sql(name)
+    return np.asarray((await conn.execute(text(query), params)).scalars().all(), dtype=np.int64)
+
+
+def id_mask(allowed):
+    """A search filter (see VectorIndex.search) allowing exactly the given ascending ids."""
+    return lambda attrs, codes, ids: np.isin(ids, allowed, assume_unique=True)
+
+
+_filter_version = {"value": None, "checked_at": 0.0}
+
+
+async def current_filter_version():
+    """data_version.filter_version, re-read at most every VERSION_TTL_SECONDS (None: no table yet)."""
+    now = clock.monotonic()
+    if _filter_version["value"] is not None and now - _filter_version["checked_at"] < VERSION_TTL_SECONDS:
+        return _filter_version["value"]
+    try:
+        async with async_engine.connect() as conn:
+            value = (await conn.execute(text("SELECT filter_version FROM data_version WHERE id = 1"))).scalar() or 0
+    except Exception:
+        value = None
+    _filter_version.update(value=value, checked_at=now)
+    return value
+
+
+def attributes_current(meta, filter_version):
+    """Whether a collection's exported attributes were read at filter_version (None: unknown, trusted)."""
+    if filter_version is None:
+        return True
+    exported = meta.get("attrs_filter_version")
+    return exported is not None and exported >= filter_version
+
+
+def _code_mask(values, labels, label):
+    if label not in labels:
+        return np.zeros(len(values), dtype=bool)
+    return values == labels.index(label)
+
+
+def _attribute_rows(conn, name, ids):
+    """(row id, sent_at, thread contact, contact email, thread status, thread score) for a collection's ids."""
+    columns = (Message.sent_at, Thread.contact_id, Contact.email, Thread.status, Thread.score)
+    if name == "passages":
+        query = select(PassageEmbedding.id, *columns)\
+            .join(Message, Message.id == PassageEmbedding.message_id)\
+            .where(PassageEmbedding.id.in_(ids))
+    else:
+        query = select(Message.id, *columns).where(Message.id.in_(ids))
+    query = query.join(Thread, Thread.id == Message.thread_id).join(Contact, Contact.id == Thread.contact_id)
+    return conn.execute(query).all()
+
+
+def export_filter_attributes(conn, names=("messages", "passages")):
+    """Write the filter attributes of each exported collection's current version."""
+    filter_version = conn.execute(text("SELECT filter_version FROM data_version WHERE id = 1")).scalar()
+    for name in names:
+        if get_index(name).meta is None:
+            continue
+        ids = np.asarray(get_index(name).ids())
+        count = len(ids)
+        sent_at = np.zeros(count, dtype=np.int64)
+        contact_id = np.full(count, -1, dtype=np.int64)
+        domain = np.full(count, -1, dtype=np.int32)
+        status = np.full(count, -1, dtype=np.int16)
+        score = np.full(count, np.nan, dtype=np.float32)
+        labels = {"domain": [], "status": []}
+        index_of = {"domain": {}, "status": {}}
+
+        def code(field, label):
+            if label not in index_of[field]:
+                index_of[field][label] = len(labels[field])
+                labels[field].append(label)
+            return index_of[field][label]
+
+        for chunk in chunked(ids.tolist()):
+            for row_id, sent, contact, email, thread_status, thread_score in _attribute_rows(conn, name, chunk):
+                i = np.searchsorted(ids, row_id)
+                sent_at[i] = int(sent.timestamp()) if sent else 0
+                contact_id[i] = contact
+                domain[i] = code("domain", (email or "").rsplit("@", 1)[-1].lower())
+                status[i] = code("status", thread_status)
+                score[i] = thread_score or 0.0
+        write_attributes(name, {
+            "sent_at": sent_at, "contact_id": contact_id, "domain": domain,
+            "status": status, "score": score,
+        }, codes=labels, filter_version=filter_version)
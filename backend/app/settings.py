@@ -1,7 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select, insert, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from .models import get_db, IgnoreList
+from .models import get_async_db, IgnoreList
+from .pipeline import chunked
+from .writer import write_queue
 
 router = APIRouter()
 
@@ -14,53 +17,42 @@ class ImportRequest(BaseModel):
 
 
 @router.get("/settings/ignore")
-def get_ignore_list(db: Session = Depends(get_db)):
-    items = db.query(IgnoreList).order_by(IgnoreList.created_at.desc()).all()
+async def get_ignore_list(db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(IgnoreList).order_by(IgnoreList.created_at.desc()))
+    items = result.scalars().all()
     return [{"id": item.id, "value": item.value, "type": item.type} for item in items]
 
 @router.post("/settings/ignore")
-def add_ignore_item(item: IgnoreItem, db: Session = Depends(get_db)):
-    # Check duplicate
-    existing = db.query(IgnoreList).filter(IgnoreList.value == item.value).first()
-    if existing:
-        raise HTTPException(status_code=400, detail="Item already exists")
-    
-    new_item = IgnoreList(value=item.value, type=item.type)
-    db.add(new_item)
-    db.commit()
-    db.refresh(new_item)
-    return {"id": new_item.id, "value": new_item.value, "type": new_item.type}
+async def add_ignore_item(item: IgnoreItem):
+    def add(conn):
+        if conn.execute(select(IgnoreList.id).where(IgnoreList.value == item.value)).first():
+            raise HTTPException(status_code=400, detail="Item already exists")
+        return conn.execute(insert(IgnoreList).values(value=item.value, type=item.type).returning(IgnoreList.id)).scalar()
+
+    # /contacts filters on the ignore list; the writer bumps data_version
+    new_id = await write_queue.submit(add)
+    return {"id": new_id, "value": item.value, "type": item.type}
 
 @router.delete("/settings/ignore/{item_id}")
-def delete_ignore_item(item_id: int, db: Session = Depends(get_db)):
-    item = db.query(IgnoreList).filter(IgnoreList.id == item_id).first()
-    if not item:
-        raise HTTPException(status_code=404, detail="Item not found")
-    
-    db.delete(item)
-    db.commit()
+async def delete_ignore_item(item_id: int):
+    def delete_item(conn):
+        if conn.execute(delete(IgnoreList).where(IgnoreList.id == item_id)).rowcount == 0:
+            raise HTTPException(status_code=404, detail="Item not found")
+
+    await write_queue.submit(delete_item)
     return {"status": "deleted"}
 
 @router.post("/settings/ignore/import")
-def import_ignore_items(req: ImportRequest, db: Session = Depends(get_db)):
-    added_count = 0
-    skipped_count = 0
-    
-    # Get all existing values to avoid individual DB checks if possible, or check one by one
-    # For simplicity/safety, check one by one or getting all might be fine if list is small.
-    # Let's check individually for now or use ON CONFLICT DO NOTHING if using core SQL.
-    # ORM way:
-    
-    for item in req.items:
-        existing = db.query(IgnoreList).filter(IgnoreList.value == item.value).first()
-        if existing:
-            skipped_count += 1
-            continue
-            
-        new_item = IgnoreList(value=item.value, type=item.type)
-        db.add(new_item)
-        added_count += 1
-    
-    db.commit()
+async def import_ignore_items(req: ImportRequest):
+    def import_items(conn):
+        values = list({item.value: item for item in req.items}.values())
+        existing = set()
+        for chunk in chunked([item.value for item in values]):
+            existing.update(conn.execute(select(IgnoreList.value).where(IgnoreList.value.in_(chunk))).scalars())
+        new_items = [{"value": item.value, "type": item.type} for item in values if item.value not in existing]
+        if new_items:
+            conn.execute(insert(IgnoreList), new_items)
+        return len(new_items), len(req.items) - len(new_items)
+
+    added_count, skipped_count = await write_queue.submit(import_items)
     return {"added": added_count, "skipped": skipped_count}
-
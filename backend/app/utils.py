@@ -1,3 +1,5 @@
+import re
+import unicodedata
 from email.header import decode_header, make_header
 
 def decode_mime(header_value):
@@ -10,3 +12,44 @@ def decode_mime(header_value):
         return str(make_header(decoded_list))
     except Exception:
         return header_value
+
+def display_text(header_value):
+    """
+    Decoded, NFC-normalized form of a raw header value, as stored in the
+    display_subject / display_name columns at ingest.
+    """
+    if not header_value:
+        return ""
+    return unicodedata.normalize("NFC", decode_mime(header_value)).replace("\x00", "")
+
+def clean_quote(text_body):
+    """
+    Body text without quoted replies: '>' lines are dropped and everything
+    after an 'On ... wrote:' / 'Original Message' / 'Sent from my' line is cut.
+    Used at import and before embedding, so quoted text isn't indexed twice.
+    """
+    if not text_body: return ""
+    # Remove NUL just in case
+    text_body = text_body.replace('\x00', '')
+    lines = text_body.split('\n')
+    cleaned_lines = []
+    quote_headers = [
+        re.compile(r'^On\s.*wrote:', re.IGNORECASE),
+        re.compile(r'^---+\s*Original Message\s*---+', re.IGNORECASE),
+        re.compile(r'^From:\s', re.IGNORECASE),
+        re.compile(r'^Sent from my', re.IGNORECASE)
+    ]
+    for line in lines:
+        sline = line.strip()
+        if sline.startswith('>'): continue
+        is_quote = False
+        for qh in quote_headers:
+            if qh.match(sline):
+                if sline.lower().startswith("on ") and sline.endswith("wrote:"):
+                     return "\n".join(cleaned_lines).strip()
+                if "original message" in sline.lower():
+                     return "\n".join(cleaned_lines).strip()
+                if "sent from my" in sline.lower():
+                    return "\n".join(cleaned_lines).strip()
+        cleaned_lines.append(line)
+    return "\n".join(cleaned_lines).strip()
@@ -0,0 +1,382 @@
+"""
+Local vector index: memory-mapped NumPy files, one set per collection
+(e.g. "messages"), so semantic search needs neither pgvector nor a server.
+
+    <dir>/<name>.json                 meta: current version, count, dim, dtype, model
+    <dir>/<name>.<version>.ids.npy    int64 ids, ascending
+    <dir>/<name>.<version>.vecs.npy   (count, dim) unit vectors: float16, or int8 with
+    <dir>/<name>.<version>.scale.npy  per-row float32 scales
+    <dir>/<name>.<version>.hnsw       optional HNSW graph (hnswlib)
+    <dir>/<name>.<version>.attrs-<stamp>.<field>.npy
+                                      optional per-row attributes for filtering
+                                      (see write_attributes)
+
+<dir> belongs to one database generation (index_dir). An export writes a
+new version and then replaces the meta file atomically, so readers always
+see matching files and pick up the new version on their next query. Search
+is an exact blocked matrix product over the memory map (the OS page cache
+keeps it hot). With hnswlib installed, collections of ANN_MIN_VECTORS or
+more also get an HNSW graph and are searched approximately.
+
+Searches can be restricted to rows whose attributes pass a filter (a
+function of the attribute arrays, their codes and the row ids returning a
+boolean mask). The mask is applied before ranking: only the allowed rows
+are scored, so a selective filter makes a query cheaper, not emptier.
+"""
+import json
+import os
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+from . import models
+from .generations import active_db_path, vector_index_dir
+from .embeddings import from_blob
+
+try:
+    import hnswlib
+except ImportError:  # optional: exact search only
+    hnswlib = None
+
+
+def index_dir():
+    """
+    Directory of the vector index for the live database generation (see
+    app/generations.py): vectors and rows always come from the same one.
+    """
+    if models.IS_SQLITE:
+        return vector_index_dir(active_db_path(models.db_path))
+    return os.getenv("VECTOR_INDEX_DIR") or "./vectors"
+
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "int8")  # int8: half the size of float16 and ~2x faster to scan on CPU
+BLOCK_ROWS = 2048  # rows per matrix product: small enough for the float32 scratch to stay in cache
+ANN_MIN_VECTORS = int(os.getenv("ANN_MIN_VECTORS", "200000"))
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+KEEP_VERSIONS = 2
+EXPORT_BATCH = 10000
+# Filtered searches gather the allowed rows instead of scanning every block
+# when they are at most this share of the collection
+GATHER_MAX_FRACTION = 0.25
+
+
+def _paths(directory, name, version):
+    prefix = os.path.join(directory, f"{name}.{version}")
+    return {
+        "ids": prefix + ".ids.npy",
+        "vecs": prefix + ".vecs.npy",
+        "scale": prefix + ".scale.npy",
+        "hnsw": prefix + ".hnsw",
+    }
+
+
+def quantize_int8(vectors):
+    scale = np.abs(vectors).max(axis=1) / 127.0
+    scale[scale == 0] = 1.0
+    return np.round(vectors / scale[:, None]).astype(np.int8), scale.astype(np.float32)
+
+
+class IndexWriter:
+    """Streams rows, in ascending id order, into a new version of a collection."""
+
+    def __init__(self, name, count, dim, dtype=VECTOR_DTYPE, model=None, directory=None):
+        if dtype not in ("float16", "int8"):
+            raise ValueError(f"unsupported vector dtype {dtype!r}")
+        directory = directory or index_dir()
+        os.makedirs(directory, exist_ok=True)
+        self.name, self.dim, self.dtype, self.model, self.directory = name, dim, dtype, model, directory
+        self.version = time.strftime("%Y%m%d%H%M%S") + f"{time.time_ns() % 1_000_000:06d}"
+        self.paths = _paths(directory, name, self.version)
+        capacity = max(count, 1)
+        self.ids = np.lib.format.open_memmap(self.paths["ids"], mode="w+", dtype=np.int64, shape=(capacity,))
+        self.vecs = np.lib.format.open_memmap(self.paths["vecs"], mode="w+", dtype=dtype, shape=(capacity, dim))
+        self.scale = None
+        if dtype == "int8":
+            self.scale = np.lib.format.open_memmap(self.paths["scale"], mode="w+", dtype=np.float32, shape=(capacity,))
+        self.count = 0
+
+    @property
+    def capacity(self):
+        return len(self.ids)
+
+    def add(self, ids, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        n = len(ids)
+        if self.count + n > self.capacity:
+            raise ValueError("more rows than the count the writer was opened with")
+        if n and self.count and ids[0] <= self.ids[self.count - 1]:
+            raise ValueError("ids must be added in ascending order")
+        end = self.count + n
+        self.ids[self.count:end] = ids
+        if self.dtype == "int8":
+            self.vecs[self.count:end], self.scale[self.count:end] = quantize_int8(vectors)
+        else:
+            self.vecs[self.count:end] = vectors.astype(np.float16)
+        self.count = end
+
+    def commit(self, build_ann=None):
+        """Flush, optionally build the HNSW graph, and make this version current."""
+        for array in (self.ids, self.vecs, self.scale):
+            if array is not None:
+                array.flush()
+        if build_ann is None:
+            build_ann = hnswlib is not None and self.count >= ANN_MIN_VECTORS
+        if build_ann:
+            self._build_hnsw()
+        meta = {
+            "version": self.version, "count": self.count, "dim": self.dim,
+            "dtype": self.dtype, "model": self.model, "hnsw": bool(build_ann),
+        }
+        _write_meta(os.path.join(self.directory, f"{self.name}.json"), meta)
+        prune_versions(self.name, self.directory)
+        return meta
+
+    def _build_hnsw(self):
+        if hnswlib is None:
+            raise RuntimeError("building an HNSW index needs the hnswlib package")
+        graph = hnswlib.Index(space="ip", dim=self.dim)
+        graph.init_index(max_elements=max(self.count, 1), ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+        for start in range(0, self.count, BLOCK_ROWS):
+            stop = min(start + BLOCK_ROWS, self.count)
+            graph.add_items(_as_float32(self.vecs, self.scale, start, stop), self.ids[start:stop])
+        graph.save_index(self.paths["hnsw"])
+
+
+def prune_versions(name, directory=None, keep=KEEP_VERSIONS):
+    """Delete all but the newest `keep` versions of a collection."""
+    directory = directory or index_dir()
+    prefix = f"{name}."
+    files = [f for f in os.listdir(directory) if f.startswith(prefix) and f[len(prefix):].split(".", 1)[0].isdigit()]
+    versions = sorted({f[len(prefix):].split(".", 1)[0] for f in files})
+    for version in versions[:-keep]:
+        for f in files:
+            if f.startswith(f"{prefix}{version}."):
+                os.remove(os.path.join(directory, f))
+
+
+def _read_meta(meta_path):
+    with open(meta_path) as f:
+        return json.load(f)
+
+
+def _write_meta(meta_path, meta):
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(meta_path + ".tmp", meta_path)
+
+
+def write_attributes(name, attrs, codes=None, directory=None, filter_version=None):
+    """
+    Attach per-row attribute arrays (same order as the ids) to the current
+    version of a collection, replacing its previous ones. codes maps a field
+    to the labels its integer values stand for (e.g. thread statuses);
+    filter_version is the database's data_version.filter_version the values
+    were read at.
+    """
+    directory = directory or index_dir()
+    meta_path = os.path.join(directory, f"{name}.json")
+    meta = _read_meta(meta_path)
+    stamp = time.strftime("%Y%m%d%H%M%S") + f"{time.time_ns() % 1_000_000:06d}"
+    files = {}
+    for field, values in attrs.items():
+        values = np.asarray(values)
+        if len(values) != meta["count"]:
+            raise ValueError(f"{field}: {len(values)} values for {meta['count']} rows")
+        files[field] = f"{name}.{meta['version']}.attrs-{stamp}.{field}.npy"
+        np.save(os.path.join(directory, files[field]), values)
+    previous = set(meta.get("attrs", {}).values())
+    meta["attrs"], meta["attr_codes"] = files, codes or {}
+    meta["attrs_filter_version"] = filter_version
+    _write_meta(meta_path, meta)
+    for f in previous - set(files.values()):
+        if os.path.exists(os.path.join(directory, f)):
+            os.remove(os.path.join(directory, f))
+
+
+def _as_float32(vecs, scale, start, stop):
+    block = np.asarray(vecs[start:stop], dtype=np.float32)
+    if scale is not None:
+        block *= scale[start:stop, None]
+    return block
+
+
+class VectorIndex:
+    """Read side of a collection. Thread-safe; reloads when a new version is exported."""
+
+    def __init__(self, name, directory):
+        self.name, self.directory = name, directory
+        self.meta_path = os.path.join(directory, f"{name}.json")
+        self._lock = threading.Lock()
+        self._loaded_mtime = None
+        self._state = None
+
+    def _current(self):
+        try:
+            mtime = os.stat(self.meta_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime != self._loaded_mtime:
+            with self._lock:
+                if mtime != self._loaded_mtime:
+                    meta = _read_meta(self.meta_path)
+                    paths = _paths(self.directory, self.name, meta["version"])
+                    count = meta["count"]
+                    state = {
+                        "meta": meta,
+                        "ids": np.load(paths["ids"], mmap_mode="r")[:count],
+                        "vecs": np.load(paths["vecs"], mmap_mode="r")[:count],
+                        "scale": np.load(paths["scale"], mmap_mode="r")[:count] if meta["dtype"] == "int8" else None,
+                        "hnsw": None,
+                        "attrs": {
+                            field: np.load(os.path.join(self.directory, f), mmap_mode="r")
+                            for field, f in meta.get("attrs", {}).items()
+                        },
+                    }
+                    if meta.get("hnsw") and hnswlib is not None and os.path.exists(paths["hnsw"]):
+                        graph = hnswlib.Index(space="ip", dim=meta["dim"])
+                        graph.load_index(paths["hnsw"], max_elements=max(count, 1))
+                        state["hnsw"] = graph
+                    self._state, self._loaded_mtime = state, mtime
+        return self._state
+
+    @property
+    def meta(self):
+        state = self._current()
+        return state["meta"] if state else None
+
+    def ids(self):
+        """Ids of the current version, ascending."""
+        state = self._current()
+        return state["ids"] if state else np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        state = self._current()
+        return state["meta"]["count"] if state else 0
+
+    def search(self, query, k=10, exact=False, where=None):
+        """
+        Top-k (id, cosine) pairs for a unit query vector, best first.
+        where: optional function of (attribute arrays, attribute codes, ids) --
+        see write_attributes -- returning a boolean mask; only rows it allows
+        are ranked.
+        """
+        state = self._current()
+        if state is None or state["meta"]["count"] == 0 or k <= 0:
+            return []
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        count = state["meta"]["count"]
+        rows = None
+        if where is not None:
+            rows = np.flatnonzero(where(state["attrs"], state["meta"].get("attr_codes", {}), state["ids"]))
+            if not len(rows):
+                return []
+        k = min(k, count if rows is None else len(rows))
+        if rows is not None and len(rows) <= GATHER_MAX_FRACTION * count:
+            return self._gathered(state, query, k, rows)
+        if state["hnsw"] is not None and not exact:
+            return self._approximate(state, query, k, rows)
+        return self._exact(state, query, k, rows)
+
+    @staticmethod
+    def _approximate(state, query, k, rows):
+        graph, count = state["hnsw"], state["meta"]["count"]
+        # A filter allowing a large share of rows: over-fetch, then drop the rest
+        fetch = k if rows is None else min(count, k * int(np.ceil(2 * count / len(rows))))
+        graph.set_ef(max(64, 2 * fetch))
+        labels, distances = graph.knn_query(query, k=fetch)
+        hits = [(int(i), float(1 - d)) for i, d in zip(labels[0], distances[0])]
+        if rows is not None:
+            allowed = state["ids"][rows]
+            hits = [hit for hit in hits if allowed[min(np.searchsorted(allowed, hit[0]), len(allowed) - 1)] == hit[0]]
+        return hits[:k]
+
+    @staticmethod
+    def _top(ids, scores, k):
+        top = np.argpartition(scores, -k)[-k:] if len(scores) > k else np.arange(len(scores))
+        return ids[top], scores[top]
+
+    @classmethod
+    def _exact(cls, state, query, k, rows=None):
+        ids, vecs, scale = state["ids"], state["vecs"], state["scale"]
+        mask = None
+        if rows is not None:
+            mask = np.zeros(len(ids), dtype=bool)
+            mask[rows] = True
+        best_ids, best_scores = [], []
+        for start in range(0, len(ids), BLOCK_ROWS):
+            stop = min(start + BLOCK_ROWS, len(ids))
+            if mask is not None and not mask[start:stop].any():
+                continue
+            scores = _as_float32(vecs, scale, start, stop) @ query
+            block_ids = ids[start:stop]
+            if mask is not None:
+                keep = mask[start:stop]
+                scores, block_ids = scores[keep], block_ids[keep]
+            top_ids, top_scores = cls._top(block_ids, scores, k)
+            best_ids.append(top_ids)
+            best_scores.append(top_scores)
+        return cls._merge(best_ids, best_scores, k)
+
+    @classmethod
+    def _gathered(cls, state, query, k, rows):
+        ids, vecs, scale = state["ids"], state["vecs"], state["scale"]
+        best_ids, best_scores = [], []
+        for start in range(0, len(rows), BLOCK_ROWS):
+            chunk = rows[start:start + BLOCK_ROWS]
+            block = np.asarray(vecs[chunk], dtype=np.float32)
+            if scale is not None:
+                block *= scale[chunk, None]
+            top_ids, top_scores = cls._top(ids[chunk], block @ query, k)
+            best_ids.append(top_ids)
+            best_scores.append(top_scores)
+        return cls._merge(best_ids, best_scores, k)
+
+    @staticmethod
+    def _merge(best_ids, best_scores, k):
+        if not best_ids:
+            return []
+        ids_all, scores_all = np.concatenate(best_ids), np.concatenate(best_scores)
+        order = np.argsort(-scores_all)[:k]
+        return [(int(ids_all[i]), float(scores_all[i])) for i in order]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(name):
+    directory = index_dir()
+    with _indexes_lock:
+        if name not in _indexes or _indexes[name].directory != directory:
+            _indexes[name] = VectorIndex(name, directory)  # first use, or the generation switched
+        return _indexes[name]
+
+
+def export_collection(conn, name, table, key_column, dtype=VECTOR_DTYPE, model=None, build_ann=None):
+    """
+    Write every (key, vector) row of an embeddings table into a new version
+    of the collection `name`. Returns the new meta.
+    """
+    count = conn.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+    dim = None
+    writer = None
+    last = -1
+    while True:
+        rows = conn.execute(text(f"""
+            SELECT {key_column}, vector FROM {table}
+            WHERE {key_column} > :last ORDER BY {key_column} LIMIT :n
+        """), {"last": last, "n": EXPORT_BATCH}).fetchall()
+        if not rows:
+            break
+        if writer is None:
+            dim = len(from_blob(rows[0][1]))
+            writer = IndexWriter(name, count, dim, dtype=dtype, model=model)
+        rows = rows[:writer.capacity - writer.count]  # rows added since the COUNT wait for the next export
+        if not rows:
+            break
+        writer.add([r[0] for r in rows], np.stack([from_blob(r[1]) for r in rows]))
+        last = rows[-1][0]
+    if writer is None:
+        writer = IndexWriter(name, 0, dim or 0, dtype=dtype, model=model)
+    return writer.commit(build_ann=build_ann)
@@ -0,0 +1,159 @@
+"""
+Single writer for the API process.
+
+Every mutation the API makes goes through one queue, drained by one task
+that owns the write connection (async_write_engine). Jobs that arrive
+together share a transaction: the batch closes after WRITE_BATCH_MAX jobs or
+WRITE_BATCH_DELAY_MS after its first job, whichever comes first, so a write
+waits at most that long before it starts. Each job runs in a SAVEPOINT, so a
+job that raises (e.g. an HTTPException for a duplicate) is rolled back alone
+and its caller gets the exception; the rest of the batch commits. A batch
+that changed data bumps data_version once.
+
+On SQLite the writer opens its transactions with BEGIN IMMEDIATE, taking the
+write lock up front: a deferred transaction that reads and then writes fails
+with "database is locked" at once when another process (a pipeline script)
+committed in between, without waiting on the busy timeout. If the lock is
+still held after the timeout, the batch is retried with backoff rather than
+failed. Readers use the query_only pool and, under WAL, never wait on it.
+
+    result = await write_queue.submit(fn)   # fn(conn) runs in the writer's transaction
+"""
+import asyncio
+import os
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from .models import async_write_engine, IS_SQLITE
+from .pipeline import bump_data_version
+from .cache import note_data_version
+
+WRITE_BATCH_MAX = int(os.getenv("WRITE_BATCH_MAX", "64"))
+WRITE_BATCH_DELAY_MS = float(os.getenv("WRITE_BATCH_DELAY_MS", "20"))
+LOCK_RETRY_DELAYS = [0.1, 0.25, 0.5, 1, 2, 4, 8]  # seconds, after each busy timeout
+
+if IS_SQLITE:
+    # pysqlite/aiosqlite issue their own BEGIN (deferred) and break SAVEPOINT;
+    # take over transaction control so the writer can BEGIN IMMEDIATE
+    @event.listens_for(async_write_engine.sync_engine, "connect")
+    def disable_driver_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(async_write_engine.sync_engine, "begin")
+    def begin_immediate(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def is_lock_error(exc):
+    return isinstance(exc, OperationalError) and "locked" in str(exc.orig).lower()
+
+
+class WriteQueue:
+    def __init__(self, engine, max_batch=WRITE_BATCH_MAX, max_delay=WRITE_BATCH_DELAY_MS / 1000):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = None
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Finish the queued jobs, then stop the writer task."""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, fn, bump=True):
+        """
+        Run fn(conn) in the writer's transaction and return its result (or raise
+        its exception). bump=False for writes that don't change what the read
+        endpoints return.
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((fn, bump, future))
+        return await future
+
+    async def _next_batch(self):
+        first = await self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = asyncio.get_running_loop().time() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                job = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if job is None:
+                self._queue.put_nowait(None)  # stop after this batch
+                break
+            batch.append(job)
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            if batch is None:
+                return
+            try:
+                results, version = await self._commit_with_retry(batch)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            if version is not None:
+                note_data_version(version)
+            for (_, _, future), (ok, value) in zip(batch, results):
+                if future.done():  # caller went away
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    async def _commit_with_retry(self, batch):
+        for delay in LOCK_RETRY_DELAYS + [None]:
+            try:
+                async with self.engine.begin() as conn:
+                    return await conn.run_sync(self._apply, batch)
+            except Exception as e:
+                if delay is None or not is_lock_error(e):
+                    raise
+                print(f"⚠️  Writer: database locked, retrying batch of {len(batch)} in {delay}s")
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def _apply(conn, batch):
+        results = []
+        changed = False
+        for fn, bump, _ in batch:
+            savepoint = conn.begin_nested()
+            try:
+                value = fn(conn)
+            except Exception as e:
+                savepoint.rollback()
+                if is_lock_error(e):
+                    raise
+                results.append((False, e))
+            else:
+                savepoint.commit()
+                results.append((True, value))
+                changed = changed or bump
+        # API writes only touch the ignore list, which no /search filter reads
+        version = bump_data_version(conn, filters=False) if changed else None
+        return results, version
+
+
+write_queue = WriteQueue(async_write_engine)
@@ -0,0 +1,19 @@
+import argparse
+from app.models import engine, create_tables
+from app.pipeline import fill_display_columns, bump_data_version
+
+def backfill(full=False):
+    print("🔤 Decoding subjects / contact names into display columns...")
+    create_tables()
+    with engine.connect() as conn:
+        threads, contacts = fill_display_columns(conn, full=full)
+        if threads or contacts:
+            bump_data_version(conn, filters=False)
+        conn.commit()
+        print(f"   -> {threads} threads, {contacts} contacts updated.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fill threads.display_subject / contacts.display_name from raw headers")
+    parser.add_argument("--full", action="store_true", help="Recompute every row, not just missing ones")
+    args = parser.parse_args()
+    backfill(full=args.full)
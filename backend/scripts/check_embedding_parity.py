@@ -0,0 +1,137 @@
+"""
+Parity check for EMBEDDING_BACKEND=onnx (app/embeddings.py).
+
+Encodes the same texts with the fp32 torch model and the int8 ONNX Runtime
+one and compares them: per-text cosine similarity between the two vectors,
+top-10 neighbour overlap when each text is used as a query against the rest,
+and encode throughput / single-query latency of both. Exits non-zero if
+any text falls below --min-cosine, i.e. the quantized vectors are no longer
+close enough to share an index with torch-made ones. A pass is recorded
+next to the ONNX export (app/embeddings.py onnx_parity_path); until then
+EMBEDDING_BACKEND=onnx refuses to load.
+
+    python scripts/check_embedding_parity.py                # sample of bodies from DATABASE_URL
+    python scripts/check_embedding_parity.py --samples 2000 --min-cosine 0.97
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+from app.embeddings import (
+    load_model, encode, embedding_text, split_passages, onnx_parity_path,
+    EMBED_MAX_CHARS, MODEL_NAME, ONNX_QUANTIZATION,
+)
+
+# Used when the database has no bodies yet
+FALLBACK_TEXTS = [
+    "お世話になっております。先日ご依頼いただいた件、お見積りをお送りします。",
+    "来週の打ち合わせですが、火曜日の午後はいかがでしょうか。",
+    "Please find attached the revised proposal for the Q3 maintenance contract.",
+    "ご提案いただいたシステム導入の件、社内で検討いたします。",
+    "Thanks for your quick reply. Could we move the call to Friday?",
+    "請求書の送付先が変更になりましたので、ご確認をお願いいたします。",
+    "We are happy to confirm the order. Delivery is scheduled for next month.",
+    "契約更新の時期が近づいておりますので、ご案内申し上げます。",
+]
+TOP_K = 10
+
+
+def sample_texts(n):
+    from sqlalchemy import text
+    from app.models import engine
+    from app.body_store import fetch_bodies, HAS_BODY_SQL
+    with engine.connect() as conn:
+        ids = [r[0] for r in conn.execute(text(f"SELECT m.id FROM messages m WHERE {HAS_BODY_SQL}")).fetchall()]
+        bodies = fetch_bodies(conn, random.sample(ids, min(n, len(ids))))
+    texts = []
+    for body in bodies.values():
+        body_text = embedding_text(body)
+        # Same inputs as the pipeline: the message head and its passages
+        texts.append(body_text[:EMBED_MAX_CHARS])
+        texts.extend(split_passages(body_text))
+    return [t for t in texts if t][:n]
+
+
+def timed_encode(model, texts):
+    started = time.perf_counter()
+    vectors = encode(texts, model=model)
+    return vectors, time.perf_counter() - started
+
+
+def query_latency(model, queries):
+    started = time.perf_counter()
+    for q in queries:
+        encode([q], model=model)
+    return (time.perf_counter() - started) / len(queries)
+
+
+def neighbour_overlap(a, b):
+    """Mean share of each text's top-k neighbours (excluding itself) both backends agree on."""
+    k = min(TOP_K, len(a) - 1)
+    if k < 1:
+        return None
+    sims_a, sims_b = a @ a.T, b @ b.T
+    np.fill_diagonal(sims_a, -np.inf)
+    np.fill_diagonal(sims_b, -np.inf)
+    top_a = np.argpartition(-sims_a, k, axis=1)[:, :k]
+    top_b = np.argpartition(-sims_b, k, axis=1)[:, :k]
+    return float(np.mean([len(set(x) & set(y)) / k for x, y in zip(top_a, top_b)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare torch and int8 ONNX embeddings")
+    parser.add_argument("--samples", type=int, default=500, help="Texts to encode (default 500)")
+    parser.add_argument("--min-cosine", type=float, default=0.98, help="Fail below this torch/ONNX cosine (default 0.98)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    try:
+        texts = sample_texts(args.samples)
+    except Exception as e:
+        print(f"   - No sample from the database ({type(e).__name__}); using built-in texts.")
+        texts = []
+    texts = texts or FALLBACK_TEXTS
+    queries = [t[:40] for t in texts[:50]]
+    print(f"🔬 Comparing backends on {len(texts)} texts...")
+
+    results = {}
+    for backend in ("torch", "onnx"):
+        model = load_model(backend, device="cpu")
+        encode(texts[:8], model=model)  # first-call overhead out of the timings
+        vectors, seconds = timed_encode(model, texts)
+        results[backend] = {"vectors": vectors, "seconds": seconds, "latency": query_latency(model, queries)}
+        print(f"   - {backend:5}: {len(texts) / seconds:8.1f} texts/s, query {results[backend]['latency'] * 1000:6.1f} ms")
+
+    torch_vectors, onnx_vectors = results["torch"]["vectors"], results["onnx"]["vectors"]
+    cosines = np.sum(torch_vectors * onnx_vectors, axis=1)
+    overlap = neighbour_overlap(torch_vectors, onnx_vectors)
+    print(f"   - cosine(torch, onnx): min {cosines.min():.4f}, p1 {np.percentile(cosines, 1):.4f}, mean {cosines.mean():.4f}")
+    if overlap is not None:
+        print(f"   - top-{TOP_K} neighbour overlap: {overlap:.1%}")
+    print(f"   - speed-up: encode {results['torch']['seconds'] / results['onnx']['seconds']:.1f}x, "
+          f"query {results['torch']['latency'] / results['onnx']['latency']:.1f}x")
+
+    worst = int(np.argmin(cosines))
+    if cosines[worst] < args.min_cosine:
+        if os.path.exists(onnx_parity_path()):
+            os.remove(onnx_parity_path())
+        print(f"❌ {int(np.sum(cosines < args.min_cosine))} texts below {args.min_cosine}; worst: {texts[worst][:80]!r}")
+        sys.exit(1)
+    with open(onnx_parity_path(), "w") as f:
+        json.dump({
+            "model": MODEL_NAME, "quantization": ONNX_QUANTIZATION, "texts": len(texts),
+            "min_cosine": round(float(cosines.min()), 4), "mean_cosine": round(float(cosines.mean()), 4),
+            "top_k_overlap": round(overlap, 4) if overlap is not None else None,
+            "threshold": args.min_cosine, "checked_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }, f, indent=2)
+    print(f"✅ ONNX embeddings match torch. Recorded in {onnx_parity_path()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Plan check for the API's queries.
+
+Seeds a scratch database, calls every read endpoint through the app, and
+runs EXPLAIN QUERY PLAN (SQLite) / EXPLAIN (Postgres) on each SQL statement
+they issued. Exits non-zero if any statement falls back to a full scan of a
+large table or of a full-text index, or has to sort a LIMITed page instead
+of reading it in index order -- i.e. an index the query relies on is missing
+or unusable -- or if following the cursors of a paginated list repeats a row.
+
+    python scripts/check_query_plans.py                       # temporary SQLite file
+    python scripts/check_query_plans.py --database-url URL    # a SCRATCH database (it gets seeded)
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# Tables small enough that a scan is the right plan
+SMALL_TABLES = {"ignore_list", "stat_counters", "data_version", "body_dicts", "schema_migrations"}
+
+SEED_CONTACTS = 300
+SEED_THREADS_PER_CONTACT = 4
+SEED_MESSAGES_PER_THREAD = 5
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fail if an API query plan does a full table scan")
+    parser.add_argument("--database-url", help="Scratch database to seed and check (default: temporary SQLite file)")
+    parser.add_argument("--verbose", action="store_true", help="Print every plan")
+    return parser.parse_args()
+
+
+def seed(engine):
+    from sqlalchemy import text
+    from app.models import create_tables
+    from app.pipeline import refresh_contact_aggregates, refresh_stat_counters, fill_display_columns, bump_data_version
+    from app.body_store import store_bodies
+    from app.fulltext import index_pending_messages, has_search_index
+
+    create_tables()
+    rnd = random.Random(42)
+    base = datetime(2020, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO contacts (id, email, name, closeness_score) VALUES (:id, :email, :name, 0)"), [
+            {"id": c, "email": f"user{c}@example{c % 7}.com", "name": f"User {c}"} for c in range(1, SEED_CONTACTS + 1)
+        ])
+        threads, messages, bodies = [], [], {}
+        tid = mid = 0
+        for c in range(1, SEED_CONTACTS + 1):
+            for _ in range(SEED_THREADS_PER_CONTACT):
+                tid += 1
+                start = base + timedelta(days=rnd.randint(0, 1500))
+                for k in range(SEED_MESSAGES_PER_THREAD):
+                    mid += 1
+                    messages.append({"id": mid, "tid": tid, "cid": c, "mid": f"<{mid}@seed>", "sent_at": start + timedelta(hours=k)})
+                    bodies[mid] = f"お見積り {rnd.randint(100, 900)}万円 です。\n" * 5
+                threads.append({
+                    "id": tid, "cid": c, "subject": f"Project {tid}",
+                    "status": "active" if rnd.random() > 0.2 else "ignored",
+                    "score": round(rnd.random() * 30, 2), "last": start + timedelta(hours=SEED_MESSAGES_PER_THREAD - 1),
+                    "count": SEED_MESSAGES_PER_THREAD,
+                })
+        conn.execute(text("""
+            INSERT INTO threads (id, contact_id, subject, status, score, last_message_at, message_count, features_dirty)
+            VALUES (:id, :cid, :subject, :status, :score, :last, :count, FALSE)
+        """), threads)
+        conn.execute(text("""
+            INSERT INTO messages (id, thread_id, contact_id, message_id, sender_type, sent_at)
+            VALUES (:id, :tid, :cid, :mid, 'other', :sent_at)
+        """), messages)
+        store_bodies(conn, bodies)
+        refresh_contact_aggregates(conn, range(1, SEED_CONTACTS + 1))
+        fill_display_columns(conn)
+        refresh_stat_counters(conn)
+        bump_data_version(conn)
+        conn.execute(text("INSERT INTO ignore_list (value, type) VALUES ('example3.com', 'domain'), ('user5@example5.com', 'email')"))
+        if has_search_index(conn):
+            while index_pending_messages(conn):
+                pass
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+
+
+def endpoint_urls(client):
+    """The read endpoints, including cursor continuations."""
+    urls = ["/stats", "/settings/ignore", "/search?q=お見積り", "/search?q=見積", "/search?q=見", "/search?q=お見積り 万円",
+            "/search?q=見積&since=2024-01-01&status=active&min_score=0.1&domain=example.com"]
+    for base in ["/threads?limit=20", "/threads?limit=20&sort=date", "/messages?limit=20",
+                 "/contacts?limit=20", "/contacts?limit=20&sort=date", "/contacts?limit=20&sort=dormant"]:
+        urls.append(base)
+        cursor = client.get(base).headers.get("x-next-cursor")
+        if cursor:
+            urls.append(f"{base}&cursor={cursor}")
+    thread_id = client.get("/threads?limit=1").json()[0]["id"]
+    first = client.get(f"/threads/{thread_id}/messages?body_limit=2")
+    urls += [f"/threads/{thread_id}/messages", f"/threads/{thread_id}/messages?body_limit=2",
+             f"/threads/{thread_id}/bodies?limit=2&cursor={first.headers.get('x-next-cursor')}",
+             f"/threads/{thread_id}/bodies?ids={first.json()[-1]['id']}"]
+    return urls
+
+
+def repeated_rows(client):
+    """Walk every cursor-paginated list to its end; (url, pages, rows, unique ids) where ids repeat."""
+    thread_id = client.get("/threads?limit=1").json()[0]["id"]
+    # Odd page sizes, so pages end inside runs of equal sort values
+    bases = ["/threads?limit=7", "/threads?limit=7&sort=date", "/messages?limit=13",
+             "/contacts?limit=9", "/contacts?limit=9&sort=date", "/contacts?limit=9&sort=dormant",
+             f"/threads/{thread_id}/bodies?limit=2"]
+    problems = []
+    for base in bases:
+        ids, pages, cursor = [], 0, None
+        while True:
+            response = client.get(f"{base}&cursor={cursor}" if cursor else base)
+            pages += 1
+            ids += [row["id"] for row in response.json()]
+            cursor = response.headers.get("x-next-cursor")
+            if not cursor:
+                break
+        if len(ids) != len(set(ids)):
+            problems.append((base, pages, len(ids), len(set(ids))))
+    return problems
+
+
+def full_scans(dialect, statement, plan_rows):
+    found = []
+    # A LIMITed page that has to be sorted first reads its whole input range
+    paged = re.search(r"\bLIMIT\b", statement, re.IGNORECASE) is not None
+    if dialect == "sqlite":
+        # Scanning a subquery's own result (CO-ROUTINE / MATERIALIZE) is fine
+        derived = {m.group(1) for row in plan_rows if (m := re.match(r"^(?:CO-ROUTINE|MATERIALIZE) (\w+)", row[-1]))}
+        for row in plan_rows:
+            detail = row[-1]
+            m = re.match(r"^SCAN (\w+)$", detail)  # no "USING ... INDEX"
+            if m and m.group(1) not in SMALL_TABLES | derived:
+                found.append(detail)
+            # An FTS5 table read without MATCH or a rowid lookup (e.g. LIKE on a
+            # short term) walks every row
+            elif re.match(r"^SCAN \w+ VIRTUAL TABLE INDEX \d+:[^M=]*$", detail):
+                found.append(detail)
+            elif paged and detail == "USE TEMP B-TREE FOR ORDER BY":
+                found.append(detail)
+    else:
+        for (line,) in plan_rows:
+            m = re.search(r"Seq Scan on (\w+)", line)
+            if m and m.group(1) not in SMALL_TABLES:
+                found.append(line.strip())
+            elif paged and re.search(r"^\s*(->\s*)?Sort\b", line):
+                found.append(line.strip())
+    return found
+
+
+async def explain_all(async_engine, statements, verbose):
+    dialect = async_engine.dialect.name
+    prefix = "EXPLAIN QUERY PLAN " if dialect == "sqlite" else "EXPLAIN "
+    failures = []
+    async with async_engine.connect() as conn:
+        if dialect == "postgresql":
+            # Tiny seed tables make seq scans "cheapest"; only report them when no index applies
+            await conn.exec_driver_sql("SET enable_seqscan = off")
+        for url, statement, params in statements:
+            plan = (await conn.exec_driver_sql(prefix + statement, params)).fetchall()
+            scans = full_scans(dialect, statement, plan)
+            if verbose or scans:
+                print(f"\n{url}\n  {' '.join(statement.split())[:200]}")
+                for row in plan:
+                    print(f"    {row[-1]}")
+            if scans:
+                failures.append((url, statement, scans))
+    return failures
+
+
+def main():
+    args = parse_args()
+    tmpdir = None
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        tmpdir = tempfile.mkdtemp(prefix="plancheck-")
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'plancheck.db')}"
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    from sqlalchemy import event
+    from fastapi.testclient import TestClient
+    from app.models import engine, async_engine
+    from app.main import app
+    from app.cache import response_cache
+
+    print(f"🔎 Seeding {engine.url.render_as_string(hide_password=True)} ...")
+    seed(engine)
+
+    statements = []
+    current_url = [None]
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if current_url[0] and statement.lstrip().upper().startswith("SELECT"):
+            statements.append((current_url[0], statement, parameters))
+
+    with TestClient(app) as client:
+        repeated = repeated_rows(client)
+        urls = endpoint_urls(client)
+        event.listen(async_engine.sync_engine, "before_cursor_execute", record)
+        for url in urls:
+            current_url[0] = url
+            response_cache.clear() # Make every request reach the database
+            response = client.get(url)
+            if response.status_code != 200:
+                print(f"❌ {url} -> {response.status_code}")
+                sys.exit(1)
+        current_url[0] = None
+        event.remove(async_engine.sync_engine, "before_cursor_execute", record)
+
+    # One plan per distinct statement + parameters
+    unique = list({(s, tuple(p) if isinstance(p, (list, tuple)) else repr(p)): (u, s, p) for u, s, p in statements}.values())
+    failures = asyncio.run(explain_all(async_engine, unique, args.verbose))
+
+    print(f"\nChecked {len(unique)} statements from {len(urls)} requests.")
+    if repeated:
+        print(f"❌ {len(repeated)} paginated list(s) repeat rows across pages:")
+        for url, pages, rows, distinct in repeated:
+            print(f"   {url}: {rows} rows over {pages} pages, {distinct} distinct")
+        sys.exit(1)
+    if failures:
+        print(f"❌ {len(failures)} statement(s) do a full table scan:")
+        for url, _, scans in failures:
+            print(f"   {url}: {'; '.join(scans)}")
+        sys.exit(1)
+    print("✅ No full table scans.")
+
+
+if __name__ == "__main__":
+    main()
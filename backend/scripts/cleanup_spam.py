@@ -1,4 +1,5 @@
 from app.models import engine
+from app.pipeline import bump_data_version, set_thread_status, delete_contact_stats
 from sqlalchemy import text
 
 def cleanup_spam():
@@ -17,15 +18,9 @@ def cleanup_spam():
         total_nuked = 0
         for pat in blacklist_patterns:
             # Case insensitive LIKE via conversion (SQLite default LIKE is case-insensitive for ASCII, but let's be sure)
-            stmt = text(f"""
-                UPDATE threads 
-                SET status = 'ignored', score = 0
-                WHERE contact_id IN (
-                    SELECT id FROM contacts WHERE email LIKE '{pat}'
-                )
-            """)
-            res = conn.execute(stmt)
-            total_nuked += res.rowcount
+            spam_contacts = f"contact_id IN (SELECT id FROM contacts WHERE email LIKE '{pat}')"
+            total_nuked += set_thread_status(conn, "ignored", spam_contacts, also_set=", score = 0, features_dirty = TRUE")
+            delete_contact_stats(conn, spam_contacts)
             
         print(f"     -> Affected matches (overlap included): {total_nuked}")
         
@@ -47,6 +42,7 @@ def cleanup_spam():
             )
         """)
         conn.execute(update_stmt)
+        bump_data_version(conn)
         conn.commit()
         
     print("✅ Cleanup Complete. Please refresh your browser.")
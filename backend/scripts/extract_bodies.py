@@ -5,6 +5,8 @@ from email.header import decode_header, make_header
 from bs4 import BeautifulSoup
 from sqlalchemy import text
 from app.models import engine, Message
+from app.pipeline import mark_threads_dirty_for_messages, bump_data_version
+from app.body_store import store_bodies_by_message_id
 import time
 
 import argparse
@@ -175,10 +177,9 @@ def run_extraction(mbox_path):
                             
                             if len(updates) >= BATCH_SIZE:
                                 # Batch Update
-                                conn.execute(
-                                    text("UPDATE messages SET content_body = :body WHERE message_id = :mid"),
-                                    updates
-                                )
+                                store_bodies_by_message_id(conn, {u['mid']: u['body'] for u in updates})
+                                mark_threads_dirty_for_messages(conn, [u['mid'] for u in updates])
+                                bump_data_version(conn, filters=False)
                                 conn.commit()
                                 print(f"     ... updated {extracted_count} bodies", end='\r')
                                 updates = []
@@ -198,10 +199,9 @@ def run_extraction(mbox_path):
                         
             # Final batch
             if updates:
-                conn.execute(
-                    text("UPDATE messages SET content_body = :body WHERE message_id = :mid"),
-                    updates
-                )
+                store_bodies_by_message_id(conn, {u['mid']: u['body'] for u in updates})
+                mark_threads_dirty_for_messages(conn, [u['mid'] for u in updates])
+                bump_data_version(conn, filters=False)
                 conn.commit()
                 print(f"     ... updated {extracted_count} bodies")
                 
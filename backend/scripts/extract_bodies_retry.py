@@ -5,6 +5,8 @@ from email.header import decode_header, make_header
 from bs4 import BeautifulSoup
 from sqlalchemy import text
 from app.models import engine, Message
+from app.pipeline import mark_threads_dirty_for_messages, bump_data_version
+from app.body_store import store_bodies_by_message_id
 
 MBOX_FILE = "すべてのメール（迷惑メール、ゴミ箱のメールを含む）-002.mbox"
 
@@ -103,7 +105,9 @@ def run_retry():
                                 # Remove from target to avoid double work? No, map lookup is fast.
                             
                             if len(updates) >= 100:
-                                conn.execute(text("UPDATE messages SET content_body = :body WHERE message_id = :mid"), updates)
+                                store_bodies_by_message_id(conn, {u['mid']: u['body'] for u in updates})
+                                mark_threads_dirty_for_messages(conn, [u['mid'] for u in updates])
+                                bump_data_version(conn, filters=False)
                                 conn.commit()
                                 print(f"     ... recovered {recovered} bodies", end='\r')
                                 updates = []
@@ -122,7 +126,9 @@ def run_retry():
                          recovered += 1
 
             if updates:
-                conn.execute(text("UPDATE messages SET content_body = :body WHERE message_id = :mid"), updates)
+                store_bodies_by_message_id(conn, {u['mid']: u['body'] for u in updates})
+                mark_threads_dirty_for_messages(conn, [u['mid'] for u in updates])
+                bump_data_version(conn, filters=False)
                 conn.commit()
                 
         print(f"✅ Retry Complete. Recovered {recovered}/{len(target_map)} messages.")
@@ -2,8 +2,12 @@ import sys
 import os
 import re
 import json
+import argparse
 from sqlalchemy import text
-from app.models import engine
+from app.models import engine, create_tables
+from app.pipeline import refresh_contact_aggregates, bump_data_version, refresh_stat_counters, delete_contact_stats
+from app.body_store import fetch_bodies
+from app.search_filters import export_filter_attributes
 
 BATCH_SIZE = 100
 
@@ -50,15 +54,34 @@ def extract_financials(text_content):
         
     return amount, list(set(amounts))
 
-def run_feature_extraction():
+def run_feature_extraction(full=False):
     print("📊 Starting Feature Extraction (Phase 4)...")
+    create_tables()
     
     with engine.connect() as conn:
-        print("   - Fetching active active threads...")
+        # contact_stats starts empty on databases created before it existed
+        if not full and conn.execute(text("SELECT 1 FROM contact_stats LIMIT 1")).first() is None:
+            full = conn.execute(text("SELECT 1 FROM threads LIMIT 1")).first() is not None
+            if full:
+                print("   - contact_stats is empty: backfilling with a full rescore...")
+
+        if full:
+            print("   - Full rescore requested: marking all threads dirty...")
+            conn.execute(text("UPDATE threads SET features_dirty = TRUE"))
+            conn.commit()
+
+        print("   - Fetching dirty threads...")
         
-        # Get all active thread IDs
-        tids = conn.execute(text("SELECT id FROM threads WHERE status = 'active'")).fetchall()
-        tids = [r[0] for r in tids]
+        # Only threads touched by import / rethreading / filtering since the last run.
+        # Ordered by contact so a contact's threads mostly land in the same batch.
+        dirty = conn.execute(text("""
+            SELECT id, contact_id, status
+            FROM threads
+            WHERE features_dirty = TRUE
+            ORDER BY contact_id, id
+        """)).fetchall()
+        tids = [r[0] for r in dirty]
+        thread_info = {r[0]: (r[1], r[2]) for r in dirty}
         total_threads = len(tids)
         
         # Pre-fetch Blacklisted Contact IDs (Safety net for spam)
@@ -74,30 +97,36 @@ def run_feature_extraction():
                 blacklist_ids.add(r[0])
         
         print(f"     -> Loaded {len(blacklist_ids)} blacklisted contacts for scoring safety.")
-        print(f"     -> Analyzing {total_threads} threads...")
+        print(f"     -> Analyzing {total_threads} dirty threads...")
         
         processed = 0
+        contacts_updated = 0
         
         for i in range(0, total_threads, BATCH_SIZE):
-            batch_tids = tids[i : i + BATCH_SIZE]
-            if not batch_tids: break
+            batch_all = tids[i : i + BATCH_SIZE]
+            if not batch_all: break
+
+            # Non-active threads aren't scored, but their contacts still need re-aggregation
+            batch_tids = [tid for tid in batch_all if thread_info[tid][1] == 'active']
+            batch_cids = sorted(set(thread_info[tid][0] for tid in batch_all))
             
             # Fetch messages for this batch of threads
             # Manually format IN clause for SQLite stability
             tids_str = ",".join(str(tid) for tid in batch_tids)
             stmt_msgs = text(f"""
-                SELECT thread_id, content_body, sent_at, contact_id
+                SELECT thread_id, id, sent_at, contact_id
                 FROM messages
                 WHERE thread_id IN ({tids_str})
                 ORDER BY sent_at ASC
             """)
-            msgs = conn.execute(stmt_msgs).fetchall()
+            msgs = conn.execute(stmt_msgs).fetchall() if batch_tids else []
+            bodies = fetch_bodies(conn, [m[1] for m in msgs])
             
-            # Group by thread
+            # Group by thread: (thread_id, content_body, sent_at, contact_id)
             thread_data = {tid: [] for tid in batch_tids}
             for m in msgs:
                 if m[0] in thread_data:
-                    thread_data[m[0]].append(m)
+                    thread_data[m[0]].append((m[0], bodies.get(m[1]), m[2], m[3]))
             
             updates = []
             
@@ -147,6 +176,8 @@ def run_feature_extraction():
                          timestamps = [m[2] for m in messages if m[2]]
                          # Filter None timestamps
                          timestamps = [t for t in timestamps if t]
+                         # Raw SQLite rows come back as ISO strings
+                         timestamps = [datetime.datetime.fromisoformat(t) if isinstance(t, str) else t for t in timestamps]
                          
                          if len(timestamps) > 1:
                              total_gap = (timestamps[-1] - timestamps[0]).total_seconds()
@@ -202,80 +233,62 @@ def run_feature_extraction():
             # Batch update
             stmt_update = text("""
                 UPDATE threads 
-                SET score = :score, metadata_ = :meta
+                SET score = :score, metadata_ = :meta, features_dirty = FALSE
                 WHERE id = :tid
             """)
-            conn.execute(stmt_update, updates)
+            if updates:
+                conn.execute(stmt_update, updates)
+
+            inactive_tids = [tid for tid in batch_all if thread_info[tid][1] != 'active']
+            if inactive_tids:
+                inactive_str = ",".join(str(t) for t in inactive_tids)
+                conn.execute(text(f"UPDATE threads SET features_dirty = FALSE WHERE id IN ({inactive_str})"))
+
+            # Same transaction as the thread scores, so an interrupted run leaves
+            # the remaining threads dirty and their contacts untouched.
+            contacts_updated += refresh_contact_aggregates(conn, batch_cids)
+            bump_data_version(conn)
             conn.commit()
             
-            processed += len(batch_tids)
+            processed += len(batch_all)
             print(f"     ... analyzed {processed}/{total_threads} threads", end='\r')
             
-    print(f"\n✅ Feature Extraction Complete. Processed {processed} threads.")
+    print(f"\n✅ Feature Extraction Complete. Processed {processed} threads, {contacts_updated} contacts.")
 
-    # Skip Expanding Score Columns (SQLite does not support ALTER COLUMN TYPE)
-    print("   - Skipping column expansion (SQLite).")
-
-    print("   - Aggregating Contact Scores (PYTHON SIDE)...")
-    
-    # Python-side aggregation to be 100% sure
-    contact_scores = {}
-    contact_last_active = {}
-    
+    # Contacts whose threads were all deleted by rethreading have nothing left
+    # to flag, so sweep stale scores directly (in place, no global reset).
     with engine.connect() as conn:
-        # Fetch all active threads with scores
-        print("     -> Reading all thread scores...")
-        rows = conn.execute(text("SELECT contact_id, score, last_message_at FROM threads WHERE status = 'active'")).fetchall()
-        
-        for r in rows:
-            cid = r[0]
-            score = r[1] or 0.0
-            last_at = r[2]
-            
-            if cid not in contact_scores:
-                contact_scores[cid] = 0.0
-                contact_last_active[cid] = None
-                
-            # MAX Score Strategy
-            if score > contact_scores[cid]:
-                contact_scores[cid] = score
-                
-            # Last Active Update
-            if last_at:
-                # Assuming last_at is datetime or string. Compare safely.
-                # If string, simple compare works for ISO.
-                current_last = contact_last_active[cid]
-                if current_last is None or str(last_at) > str(current_last):
-                    contact_last_active[cid] = last_at
-                    
-        print(f"     -> Calculated scores for {len(contact_scores)} contacts.")
-        
-        # Batch Update Contacts
-        print("     -> Updating DB...")
-        updates = []
-        for cid, score in contact_scores.items():
-            last_at = contact_last_active[cid]
-            updates.append({
-                "cid": cid,
-                "score": score,
-                "last_at": last_at
-            })
-            
-        # 1. Reset ALL to 0 first (to clean up contacts with no active threads)
-        conn.execute(text("UPDATE contacts SET closeness_score = 0"))
-        
-        # 2. Update active ones
-        batch_size = 1000
-        stmt = text("UPDATE contacts SET closeness_score = :score, last_contacted_at = :last_at WHERE id = :cid")
-        
-        for i in range(0, len(updates), batch_size):
-            chunk = updates[i : i + batch_size]
-            conn.execute(stmt, chunk)
-            print(f"       .. {i}", end='\r')
-            
+        res = conn.execute(text("""
+            UPDATE contacts SET closeness_score = 0
+            WHERE closeness_score > 0
+            AND NOT EXISTS (
+                SELECT 1 FROM threads
+                WHERE threads.contact_id = contacts.id AND threads.status = 'active'
+            )
+        """))
+        delete_contact_stats(conn, """
+            NOT EXISTS (
+                SELECT 1 FROM threads
+                WHERE threads.contact_id = contact_stats.contact_id AND threads.status = 'active'
+            )
+        """)
+        if full:
+            # The repair path: recount the /stats totals the stages keep by deltas
+            refresh_stat_counters(conn)
+        bump_data_version(conn)
         conn.commit()
+        print(f"   - Cleared {res.rowcount} contacts with no active threads.")
             
-    print("✅ Contact Scores Updated (Python Aggregation).")
+    print("✅ Contact Scores Updated (Incremental).")
+
+    # /search filters on scores and statuses: the vector path reads them from
+    # the attributes exported next to the vectors, so refresh those now
+    with engine.connect() as conn:
+        export_filter_attributes(conn)
+    print("✅ Search filter attributes exported.")
 
 if __name__ == "__main__":
-    run_feature_extraction()
+    parser = argparse.ArgumentParser(description="Score dirty threads and re-aggregate their contacts")
+    parser.add_argument("--full", action="store_true", help="Rescore every thread, not just dirty ones, and recount /stats")
+    args = parser.parse_args()
+    run_feature_extraction(full=args.full)
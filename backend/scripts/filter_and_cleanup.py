@@ -1,4 +1,5 @@
 from app.models import engine
+from app.pipeline import bump_data_version, set_thread_status, delete_contact_stats
 from sqlalchemy import text
 import re
 
@@ -48,13 +49,9 @@ def rigorous_cleanup():
                 chunk_str = ",".join(str(c) for c in chunk)
                 
                 # A. Set threads to ignored
-                stmt_threads = text(f"""
-                    UPDATE threads 
-                    SET status = 'ignored', score = 0 
-                    WHERE contact_id IN ({chunk_str})
-                """)
-                res = conn.execute(stmt_threads)
-                total_threads_nuked += res.rowcount
+                total_threads_nuked += set_thread_status(
+                    conn, "ignored", f"contact_id IN ({chunk_str})", also_set=", score = 0, features_dirty = TRUE"
+                )
                 
                 # B. Set contact score to 0
                 stmt_contacts = text(f"""
@@ -63,8 +60,12 @@ def rigorous_cleanup():
                     WHERE id IN ({chunk_str})
                 """)
                 conn.execute(stmt_contacts)
+
+                # C. Drop them from the contact view
+                delete_contact_stats(conn, f"contact_id IN ({chunk_str})")
                 
             print(f"   -> Nuked {total_threads_nuked} threads from spam contacts.")
+            bump_data_version(conn)
             conn.commit()
             
         print("✅ Rigorous Cleanup Complete.")
@@ -1,12 +1,13 @@
 from app.models import engine
-from sqlalchemy import text
+from app.pipeline import bump_data_version, set_thread_status
 
 def force_activate():
     print("🔓 Force Activating All Threads...")
     with engine.connect() as conn:
-        result = conn.execute(text("UPDATE threads SET status = 'active'"))
+        updated = set_thread_status(conn, "active", "TRUE")
+        bump_data_version(conn)
         conn.commit()
-        print(f"   -> Updated {result.rowcount} threads to 'active'.")
+        print(f"   -> Updated {updated} threads to 'active'.")
 
 if __name__ == "__main__":
     force_activate()
@@ -2,6 +2,8 @@ import re
 import networkx as nx
 from sqlalchemy import text
 from app.models import engine
+from app.pipeline import bump_data_version, adjust_stat_counters, thread_deltas, delete_threads
+from app.utils import display_text
 import time
 
 def normalize_msg_id(mid):
@@ -165,19 +167,20 @@ def force_reset_threads():
         print(f"     -> Installing {len(new_threads_data)} threads into DB...")
         
         created_thread_ids = []
-        stmt_insert = text("INSERT INTO threads (subject, contact_id, status, created_at) VALUES (:subject, :contact_id, :status, NOW()) RETURNING id")
+        stmt_insert = text("INSERT INTO threads (subject, display_subject, contact_id, status, created_at) VALUES (:subject, :display_subject, :contact_id, :status, NOW()) RETURNING id")
         
         # Single inserts for safety (returning id)
         # 15k-40k rows. 1 min.
         for i, tdata in enumerate(new_threads_data):
             # handle safe subject (remove null chars etc if any?)
             # Postgres usually handles text fine.
-            tid = conn.execute(stmt_insert, tdata).scalar()
+            tid = conn.execute(stmt_insert, {**tdata, "display_subject": display_text(tdata["subject"])}).scalar()
             created_thread_ids.append(tid)
             
             if i % 1000 == 0:
                 print(f"       .. {i}/{len(new_threads_data)}", end='\r')
         print(f"       .. Done.")
+        adjust_stat_counters(conn, thread_deltas(t["status"] for t in new_threads_data))
         
         # Assign Messages to New Threads
         print("   - Linking Messages to New Threads...")
@@ -204,7 +207,7 @@ def force_reset_threads():
         
         # Cleanup Old Threads
         print("   - 🧹 Cleaning up unused threads...")
-        conn.execute(text("DELETE FROM threads WHERE id NOT IN (SELECT DISTINCT thread_id FROM messages)"))
+        delete_threads(conn, "id NOT IN (SELECT DISTINCT thread_id FROM messages)")
         conn.commit()
         
         # Recalc Stats
@@ -220,6 +223,7 @@ def force_reset_threads():
             ) sub
             WHERE threads.id = sub.thread_id
         """))
+        bump_data_version(conn)
         conn.commit()
         
     print("✅ FORCE RESET COMPLETE.")
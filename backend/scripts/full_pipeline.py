@@ -33,46 +33,101 @@ def run_step(script_name, args=[]):
     print(f"✅ {script_name} completed in {elapsed:.1f}s")
     return True
 
-def main():
-    parser = argparse.ArgumentParser(description="PastLead Full Import Pipeline")
-    parser.add_argument("mbox_path", help="Path to the .mbox file")
-    parser.add_argument("--skip-import", action="store_true", help="Skip mbox import, just reconstruct and embed")
-    args = parser.parse_args()
-
-    if not os.path.exists(args.mbox_path) and not args.skip_import:
-        print(f"❌ Error: File not found: {args.mbox_path}")
-        sys.exit(1)
-
-    print("==========================================")
-    print("   PastLead: Full Data Pipeline Setup    ")
-    print("==========================================")
-    
+def run_steps(args):
     # 1. Import Mbox (Robust Version)
     # This now handles Subjects, Bodies, and Headers correctly in one pass using mailbox module.
     if not args.skip_import:
         if not run_step("import_mbox.py", [args.mbox_path]):
-            sys.exit(1)
+            return False
     
     # 2. Extract Bodies -> REMOVED
     # The new import_mbox.py does this automatically.
 
     # 3. Reconstruct Threads (Strict Version is usually best)
     if not run_step("reconstruct_threads_strict.py"):
-        sys.exit(1)
+        return False
+
+    # 3.05 Bodies written inline by older imports -> compressed body store
+    if not run_step("migrate_bodies.py"):
+        return False
+
+    # 3.1 Decoded display columns for rows imported before they existed
+    if not run_step("backfill_display_columns.py"):
+        return False
 
     # 3.2 Filtering (Remove garbage/machine emails)
     # Must run BEFORE scoring to avoid processing junk
     if not run_step("run_filtering.py"):
-        sys.exit(1)
+        return False
 
     # 3.5 Extract Features & Scores
-    if not run_step("extract_features.py"):
-        sys.exit(1)
+    # Incremental: only threads flagged dirty by the steps above are rescored.
+    if not run_step("extract_features.py", ["--full"] if args.full_rescore else []):
+        return False
+
+    # 3.6 Keyword search index for everything the steps above touched
+    if not run_step("sync_search_index.py"):
+        return False
 
     # 4. Generate Embeddings (Vector search prep)
-    # Skipped for SQLite migration (no pgvector support)
-    # if not run_step("generate_embeddings.py"):
-    #     sys.exit(1)
+    # New messages only; then re-export the local vector index (app/vector_store.py)
+    if not run_step("generate_embeddings.py"):
+        return False
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="PastLead Full Import Pipeline")
+    parser.add_argument("mbox_path", help="Path to the .mbox file")
+    parser.add_argument("--skip-import", action="store_true", help="Skip mbox import, just reconstruct and embed")
+    parser.add_argument("--full-rescore", action="store_true", help="Rescore every thread instead of only dirty ones")
+    parser.add_argument("--rebuild", action="store_true", help="Build into a new database generation and switch the API to it when done (SQLite)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.mbox_path) and not args.skip_import:
+        print(f"❌ Error: File not found: {args.mbox_path}")
+        sys.exit(1)
+
+    print("==========================================")
+    print("   PastLead: Full Data Pipeline Setup    ")
+    print("==========================================")
+
+    # Every step (and the subprocesses below) uses the bulk-load connection
+    # profile. On Postgres that's synchronous_commit=off: a crash can drop the
+    # last moments of commits; run with DB_PROFILE=default to keep them durable.
+    os.environ.setdefault("DB_PROFILE", "bulk")
+
+    # 0. Bring an existing DB up to the current schema (added columns / indexes)
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from app.models import create_tables, IS_SQLITE
+    create_tables()
+
+    # Blue/green: run every step on a snapshot while the API keeps serving the
+    # live generation, then switch atomically (see app/generations.py)
+    if args.rebuild:
+        if not IS_SQLITE:
+            print("❌ --rebuild needs a SQLite DATABASE_URL")
+            sys.exit(1)
+        from app import generations
+        from app.models import db_path
+        live = generations.active_db_path(db_path)
+        target = generations.new_generation_path(db_path)
+        print(f"\n🔷 Snapshotting {live} -> {target}")
+        generations.snapshot(live, target)
+        os.environ["DATABASE_URL"] = f"sqlite:///{target}"  # inherited by every step
+
+    if not run_steps(args):
+        if args.rebuild:
+            print(f"   The live database was not touched; the partial build is left at {target}")
+        sys.exit(1)
+
+    if args.rebuild:
+        print("\n🔷 ANALYZE + checkpoint, carrying over the live ignore list...")
+        generations.finalize(target)
+        generations.carry_over_user_state(live, target)
+        generations.activate(db_path, target)
+        print(f"✅ API now reads {target}")
+        for path in generations.prune_generations(db_path):
+            print(f"   - Removed old generation {path}")
 
     print("\n🎉 All steps completed successfully!")
     print("You can now start the server: uvicorn app.main:app --reload")
@@ -1,105 +1,351 @@
-import sys
+import argparse
+import multiprocessing
 import os
+import queue
+import traceback
 from sqlalchemy import text
-from app.models import engine
-from sentence_transformers import SentenceTransformer
-import torch
-import time
-
-BATCH_SIZE = 32
-MODEL_NAME = 'paraphrase-multilingual-mpnet-base-v2'
-
-def get_device():
-    if torch.backends.mps.is_available():
-        return "mps"
-    elif torch.cuda.is_available():
-        return "cuda"
-    return "cpu"
-
-def generate_embeddings():
-    print("🧠 Starting Vectorization (Phase 3)...")
-    
-    device = get_device()
-    print(f"   - Using device: {device}")
-    
-    print(f"   - Loading model: {MODEL_NAME}...")
-    model = SentenceTransformer(MODEL_NAME, device=device)
-    
-    with engine.connect() as conn:
-        print("   - Fetching active messages needing embeddings...")
-        
-        # Count total
-        count_stmt = text("""
-            SELECT count(*)
-            FROM messages m
-            JOIN threads t ON m.thread_id = t.id
-            WHERE t.status = 'active'
-            AND m.content_body IS NOT NULL
-            AND m.content_body != 'Pending extraction'
-            AND m.content_body != ''
-            AND m.content_vector IS NULL
-        """)
-        total_count = conn.execute(count_stmt).scalar()
-        print(f"     -> Found {total_count} messages to vectorize.")
-        
-        if total_count == 0:
-            print("   - No messages need vectorization.")
-            return
-
-        # Fetch IDs and Bodies
-        # We fetch in larger chunks to minimize DB roundtrips, but process in mini-batches for GPU/Memory
-        FETCH_SIZE = 1000
-        offset = 0
-        processed = 0
-        
-        while True:
-            stmt = text("""
-                SELECT m.id, m.content_body
-                FROM messages m
-                JOIN threads t ON m.thread_id = t.id
-                WHERE t.status = 'active'
-                AND m.content_body IS NOT NULL
-                AND m.content_body != 'Pending extraction'
-                AND m.content_body != ''
-                AND m.content_vector IS NULL
-                LIMIT :limit
-            """)
-            
-            # Note: OFFSET is bad for performance on large info, but here we are filtering by IS NULL.
-            # So as we update, they drop out of the set. So we always just fetch LIMIT.
-            # No need for OFFSET!
-            
-            rows = conn.execute(stmt, {"limit": FETCH_SIZE}).fetchall()
-            if not rows:
-                break
-                
-            batch_updates = []
-            texts = [row[1] for row in rows]
-            ids = [row[0] for row in rows]
-            
-            # Encode in sub-batches
-            for i in range(0, len(rows), BATCH_SIZE):
-                sub_texts = texts[i : i + BATCH_SIZE]
-                sub_ids = ids[i : i + BATCH_SIZE]
-                
-                # Encode (returns numpy array)
-                embeddings = model.encode(sub_texts, show_progress_bar=False, convert_to_numpy=True)
-                
-                for msg_id, vector in zip(sub_ids, embeddings):
-                    batch_updates.append({
-                        "id": msg_id,
-                        "vector": vector.tolist()
-                    })
-            
-            # Update DB
-            update_stmt = text("UPDATE messages SET content_vector = :vector WHERE id = :id")
-            conn.execute(update_stmt, batch_updates)
+from app.models import engine, create_tables
+from app.body_store import fetch_bodies, body_hash, HAS_BODY_SQL
+from app.embeddings import (
+    encode, to_blob, get_model, embedding_text, split_passages, content_hash,
+    MODEL_NAME, EMBED_MAX_CHARS,
+)
+from app.vector_store import export_collection, get_index
+from app.centroids import export_centroids
+from app.search_filters import export_filter_attributes
+
+FETCH_SIZE = 2000
+# --workers: vectors are written by the parent in transactions of this many messages
+WRITE_BATCH = 4000
+WORKER_POLL_SECONDS = 5
+# Sizes the workers' thread pools. Set in the parent before they start: a
+# spawned child inherits the environment, and its BLAS / OpenMP pools read
+# it at import, before any of the worker's own code runs. EMBEDDING_THREADS
+# goes to the ONNX Runtime session (app/embeddings.py).
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "EMBEDDING_THREADS")
+
+# Messages that should have a vector
+CANDIDATES_SQL = f"""
+    FROM messages m
+    JOIN threads t ON m.thread_id = t.id
+    WHERE t.status = 'active'
+    AND {HAS_BODY_SQL}
+"""
+
+def candidate_rows(conn, condition, params):
+    """
+    Candidate messages matching condition, by id: (id, stored model, stored
+    text hash, body hash, whether a body-store row exists, unchanged). A
+    vector is unchanged when it was made by this model from the body whose
+    hash the store still holds -- decided here, without reading any body.
+    """
+    return conn.execute(text(f"""
+        SELECT m.id, e.model, e.content_hash, b.body_hash, b.message_id IS NOT NULL,
+               COALESCE(e.model = :model AND e.body_hash = b.body_hash, 0)
+        FROM messages m
+        JOIN threads t ON m.thread_id = t.id
+        LEFT JOIN message_embeddings e ON e.message_id = m.id
+        LEFT JOIN message_bodies b ON b.message_id = m.id
+        WHERE t.status = 'active'
+        AND {HAS_BODY_SQL}
+        AND {condition}
+        ORDER BY m.id LIMIT :limit
+    """), {"limit": FETCH_SIZE, "model": MODEL_NAME, **params}).fetchall()
+
+def changed_messages(conn, rows, full=False):
+    """
+    (todo, markers): (id, text, hash) of the rows whose normalized text or
+    model changed, and the body hashes to record for every row checked. Only
+    rows whose body hash moved (or that have none yet) are read and hashed.
+    """
+    check = [r for r in rows if full or not r[5]]
+    bodies = fetch_bodies(conn, [r[0] for r in check])
+    todo, markers = [], []
+    for pk, model, stored_hash, stored_body_hash, in_store, _ in check:
+        body = bodies.get(pk)
+        body_text = embedding_text(body)
+        digest = content_hash(body_text)
+        if full or model != MODEL_NAME or stored_hash != digest:
+            todo.append((pk, body_text, digest))
+        if in_store:
+            markers.append({"id": pk, "hash": stored_body_hash or body_hash(body)})
+    return todo, markers
+
+def encode_messages(todo):
+    """Storage rows for the vectors of changed messages and of their passages."""
+    passages = [
+        (pk, position, passage)
+        for pk, body_text, _ in todo
+        for position, passage in enumerate(split_passages(body_text))
+    ]
+    # One encode call: messages and passages share the length-bucketed batches
+    vectors = encode(
+        [body_text[:EMBED_MAX_CHARS] for _, body_text, _ in todo] + [passage for _, _, passage in passages]
+    )
+    message_rows = [
+        {"id": pk, "model": MODEL_NAME, "hash": digest, "vector": to_blob(vector)}
+        for (pk, _, digest), vector in zip(todo, vectors)
+    ]
+    passage_rows = [
+        {"id": pk, "position": position, "model": MODEL_NAME, "vector": to_blob(vector)}
+        for (pk, position, _), vector in zip(passages, vectors[len(todo):])
+    ]
+    return message_rows, passage_rows
+
+def write_vectors(conn, message_rows, passage_rows):
+    """Replace the vectors of these messages. Runs in the caller's transaction."""
+    if not message_rows:
+        return
+    ids_str = ",".join(str(r["id"]) for r in message_rows)
+    conn.execute(text(f"DELETE FROM message_embeddings WHERE message_id IN ({ids_str})"))
+    conn.execute(text(f"DELETE FROM passage_embeddings WHERE message_id IN ({ids_str})"))
+    conn.execute(text("""
+        INSERT INTO message_embeddings (message_id, model, content_hash, vector, updated_at)
+        VALUES (:id, :model, :hash, :vector, CURRENT_TIMESTAMP)
+    """), message_rows)
+    if passage_rows:
+        conn.execute(text("""
+            INSERT INTO passage_embeddings (message_id, position, model, vector)
+            VALUES (:id, :position, :model, :vector)
+        """), passage_rows)
+
+def write_markers(conn, markers):
+    """
+    Record the body hash each vector was checked against, filling it in for
+    bodies stored before hashes existed. Runs in the caller's transaction,
+    after write_vectors.
+    """
+    if not markers:
+        return
+    conn.execute(text("UPDATE message_bodies SET body_hash = :hash WHERE message_id = :id AND body_hash IS NULL"), markers)
+    conn.execute(text("UPDATE message_embeddings SET body_hash = :hash WHERE message_id = :id"), markers)
+
+def embed_messages(conn, full=False):
+    """
+    Embed candidate messages whose normalized text (or the model) changed
+    since their stored vector, or that have none: one vector for the message
+    and one per passage of long ones. Unchanged bodies are recognized by
+    their stored hash; only the others are read. Commits per chunk, so an
+    interrupted run keeps what it encoded.
+    Returns how many messages were encoded.
+    """
+    total_count = conn.execute(text(f"SELECT count(*) {CANDIDATES_SQL}")).scalar()
+    print(f"     -> Checking {total_count} messages.")
+    checked = 0
+    encoded = 0
+    passage_count = 0
+    last_id = 0
+    while True:
+        rows = candidate_rows(conn, "m.id > :last_id", {"last_id": last_id})
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        todo, markers = changed_messages(conn, rows, full)
+        if todo:
+            if not encoded:
+                get_model()
+            message_rows, passage_rows = encode_messages(todo)
+            write_vectors(conn, message_rows, passage_rows)
+            passage_count += len(passage_rows)
+        if todo or markers:
+            write_markers(conn, markers)
             conn.commit()
-            
-            processed += len(rows)
-            print(f"     ... vectorized {processed}/{total_count} messages ({(processed/total_count)*100:.1f}%)", end='\r')
 
-    print(f"\n✅ Vectorization Complete. Processed {processed} messages.")
+        checked += len(rows)
+        encoded += len(todo)
+        print(f"     ... checked {checked}/{total_count}, encoded {encoded}", end='\r')
+    print(f"\n   - Encoded {encoded} new or changed messages ({passage_count} passages); {checked - encoded} unchanged.")
+    return encoded
+
+def pin_threads(threads, cores):
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+def embedding_worker(threads, cores, full, tasks, results):
+    """
+    --workers process: takes (first id, last id) ranges off tasks, reads and
+    hashes them, encodes what changed and hands the rows to the parent.
+    """
+    try:
+        pin_threads(threads, cores)
+        with engine.connect() as conn:
+            while True:
+                task = tasks.get()
+                if task is None:
+                    break
+                rows = candidate_rows(conn, "m.id BETWEEN :first AND :last", {"first": task[0], "last": task[1]})
+                todo, markers = changed_messages(conn, rows, full)
+                conn.rollback()  # don't hold a read snapshot while encoding
+                message_rows, passage_rows = encode_messages(todo) if todo else ([], [])
+                results.put(("ok", len(rows), (message_rows, passage_rows, markers)))
+        results.put(("done", 0, None))
+    except Exception:
+        results.put(("error", 0, traceback.format_exc()))
+
+def embed_messages_parallel(conn, workers, threads, full=False):
+    """
+    embed_messages() over `workers` processes: the parent queues id ranges
+    and writes the vectors the workers send back, so reading, encoding and
+    writing overlap. Returns how many messages were encoded.
+    """
+    total_count = conn.execute(text(f"SELECT count(*) {CANDIDATES_SQL}")).scalar()
+    conn.rollback()
+    print(f"     -> Checking {total_count} messages with {workers} workers x {threads} threads.")
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    # Pin each worker to its own cores when there are enough to go round
+    pin = len(cpus) >= workers * threads
+
+    ctx = multiprocessing.get_context("spawn")  # the model runtimes don't survive fork
+    tasks = ctx.Queue()
+    results = ctx.Queue(maxsize=2 * workers)  # backpressure when the writer falls behind
+    processes = [
+        ctx.Process(
+            target=embedding_worker,
+            args=(threads, cpus[i * threads:(i + 1) * threads] if pin else None, full, tasks, results),
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+    saved = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+    os.environ.update({var: str(threads) for var in THREAD_ENV_VARS})
+    try:
+        for process in processes:
+            process.start()
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+    # Ranges of FETCH_SIZE candidates, queued while the workers load the model
+    last_id = 0
+    while True:
+        ids = [r[0] for r in conn.execute(text(f"""
+            SELECT m.id {CANDIDATES_SQL} AND m.id > :last_id
+            ORDER BY m.id LIMIT :limit
+        """), {"last_id": last_id, "limit": FETCH_SIZE}).fetchall()]
+        if not ids:
+            break
+        tasks.put((ids[0], ids[-1]))
+        last_id = ids[-1]
+    conn.rollback()
+    for _ in processes:
+        tasks.put(None)
+
+    checked = 0
+    encoded = 0
+    passage_count = 0
+    finished = 0
+    pending_messages, pending_passages, pending_markers = [], [], []
+    try:
+        while finished < workers:
+            try:
+                kind, n, payload = results.get(timeout=WORKER_POLL_SECONDS)
+            except queue.Empty:
+                if any(p.exitcode not in (None, 0) for p in processes):
+                    raise RuntimeError("an embedding worker died")
+                continue
+            if kind == "error":
+                raise RuntimeError(f"embedding worker failed:\n{payload}")
+            if kind == "done":
+                finished += 1
+                continue
+            message_rows, passage_rows, markers = payload
+            pending_messages.extend(message_rows)
+            pending_passages.extend(passage_rows)
+            pending_markers.extend(markers)
+            checked += n
+            encoded += len(message_rows)
+            passage_count += len(passage_rows)
+            if len(pending_messages) >= WRITE_BATCH or len(pending_markers) >= WRITE_BATCH:
+                write_vectors(conn, pending_messages, pending_passages)
+                write_markers(conn, pending_markers)
+                conn.commit()
+                pending_messages, pending_passages, pending_markers = [], [], []
+            print(f"     ... checked {checked}/{total_count}, encoded {encoded}", end='\r')
+        write_vectors(conn, pending_messages, pending_passages)
+        write_markers(conn, pending_markers)
+        conn.commit()
+    finally:
+        for process in processes:
+            if finished < workers:
+                process.terminate()
+            process.join()
+    print(f"\n   - Encoded {encoded} new or changed messages ({passage_count} passages); {checked - encoded} unchanged.")
+    return encoded
+
+def prune_embeddings(conn):
+    """Drop vectors of messages that are no longer candidates (filtered threads, lost bodies)."""
+    res = conn.execute(text(f"""
+        DELETE FROM message_embeddings
+        WHERE message_id NOT IN (SELECT m.id {CANDIDATES_SQL})
+    """))
+    conn.execute(text("""
+        DELETE FROM passage_embeddings
+        WHERE message_id NOT IN (SELECT message_id FROM message_embeddings)
+    """))
+    conn.commit()
+    if res.rowcount:
+        print(f"   - Dropped {res.rowcount} vectors of messages no longer searchable.")
+    return res.rowcount
+
+def generate_embeddings(full=False, export_only=False, build_ann=None, workers=1, threads=None, attributes_only=False):
+    print("🧠 Starting Vectorization (Phase 3)...")
+    create_tables()
+    if attributes_only:
+        with engine.connect() as conn:
+            export_filter_attributes(conn)
+        print("✅ Exported search filter attributes.")
+        return
+    with engine.connect() as conn:
+        changed = 0
+        if not export_only:
+            if workers > 1:
+                threads = threads or max(1, (os.cpu_count() or 1) // workers)
+                changed = embed_messages_parallel(conn, workers, threads, full=full)
+            else:
+                changed = embed_messages(conn, full=full)
+            changed += prune_embeddings(conn)
+        collections = [
+            ("messages", "message_embeddings", "message_id"),
+            ("passages", "passage_embeddings", "id"),
+        ]
+        exported = []
+        for name, table, key_column in collections:
+            count = conn.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+            meta = get_index(name).meta
+            if not export_only and not changed and meta and meta["count"] == count and meta["model"] == MODEL_NAME:
+                continue
+            print(f"   - Exporting the {name} vector index...")
+            meta = export_collection(conn, name, table, key_column, model=MODEL_NAME, build_ann=build_ann)
+            index_kind = "HNSW" if meta["hnsw"] else "exact"
+            exported.append(f"{meta['count']} {name} ({meta['dtype']}, {index_kind})")
+        # Always: thread scores move without any text changing
+        print("   - Exporting thread and contact centroids...")
+        for name, meta in export_centroids(conn, model=MODEL_NAME, build_ann=build_ann).items():
+            exported.append(f"{meta['count']} {name}")
+        # Always too: dates, statuses and scores of /search filters
+        print("   - Exporting search filter attributes...")
+        export_filter_attributes(conn)
+    print(f"✅ Vectorization Complete. Exported {', '.join(exported)}.")
 
 if __name__ == "__main__":
-    generate_embeddings()
+    parser = argparse.ArgumentParser(description="Embed message bodies and export the local vector index")
+    parser.add_argument("--full", action="store_true", help="Re-encode every message, changed or not")
+    parser.add_argument("--export-only", action="store_true", help="Skip embedding; just re-export the vector index")
+    parser.add_argument("--attributes-only", action="store_true", help="Just re-export the search filter attributes (dates, statuses, scores)")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("EMBEDDING_WORKERS", "1")), help="Encoding processes (default 1: in-process)")
+    parser.add_argument("--threads-per-worker", type=int, default=None, help="Inference threads per worker (default: cores / workers)")
+    parser.add_argument("--ann", dest="build_ann", action="store_true", default=None, help="Force building the HNSW index (needs hnswlib)")
+    parser.add_argument("--no-ann", dest="build_ann", action="store_false", help="Never build the HNSW index")
+    args = parser.parse_args()
+    generate_embeddings(
+        full=args.full, export_only=args.export_only, build_ann=args.build_ann,
+        workers=args.workers, threads=args.threads_per_worker, attributes_only=args.attributes_only,
+    )
@@ -7,11 +7,15 @@ from email.header import decode_header, make_header
 from email.utils import parseaddr, parsedate_to_datetime
 from bs4 import BeautifulSoup
 import unicodedata
+from collections import Counter
 
 # Add parent directory to path to allow importing app.models
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.models import engine, Base, Contact, Thread, Message, create_tables
+from app.pipeline import bump_data_version, adjust_stat_counters, thread_deltas, deferred_indexes
+from app.utils import display_text, clean_quote
+from app.body_store import store_bodies, make_snippet
 from sqlalchemy.orm import Session
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy import text, func
@@ -46,33 +50,6 @@ def decode_mime_header(header_val):
         val = str(header_val)
     return val.replace('\x00', '')
 
-def clean_quote(text_body):
-    if not text_body: return ""
-    # Remove NUL just in case
-    text_body = text_body.replace('\x00', '')
-    lines = text_body.split('\n')
-    cleaned_lines = []
-    quote_headers = [
-        re.compile(r'^On\s.*wrote:', re.IGNORECASE),
-        re.compile(r'^---+\s*Original Message\s*---+', re.IGNORECASE),
-        re.compile(r'^From:\s', re.IGNORECASE),
-        re.compile(r'^Sent from my', re.IGNORECASE)
-    ]
-    for line in lines:
-        sline = line.strip()
-        if sline.startswith('>'): continue
-        is_quote = False
-        for qh in quote_headers:
-            if qh.match(sline):
-                if sline.lower().startswith("on ") and sline.endswith("wrote:"):
-                     return "\n".join(cleaned_lines).strip()
-                if "original message" in sline.lower():
-                     return "\n".join(cleaned_lines).strip()
-                if "sent from my" in sline.lower():
-                    return "\n".join(cleaned_lines).strip()
-        cleaned_lines.append(line)
-    return "\n".join(cleaned_lines).strip()
-
 def extract_body(message):
     body_text = ""
     if message.is_multipart():
@@ -170,9 +147,11 @@ def process_single_message(msg_bytes, session, buffer_contacts, buffer_messages,
 def flush_buffer(session, contacts_dict, messages_list):
     if not contacts_dict: return
     
-    # Upsert Contacts
-    stmt = insert(Contact).values([{'email': e, 'name': n} for e, n in contacts_dict.items()])
-    stmt = stmt.on_conflict_do_update(index_elements=['email'], set_={'name': stmt.excluded.name, 'updated_at': func.now()})
+    # Upsert Contacts (counting the new ones for /stats)
+    known = session.query(func.count(Contact.id)).filter(Contact.email.in_(list(contacts_dict))).scalar()
+    adjust_stat_counters(session, {"contacts": len(contacts_dict) - known})
+    stmt = insert(Contact).values([{'email': e, 'name': n, 'display_name': display_text(n)} for e, n in contacts_dict.items()])
+    stmt = stmt.on_conflict_do_update(index_elements=['email'], set_={'name': stmt.excluded.name, 'display_name': stmt.excluded.display_name, 'updated_at': func.now()})
     session.execute(stmt)
     session.commit()
     
@@ -191,6 +170,7 @@ def flush_buffer(session, contacts_dict, messages_list):
         threads_data.append({
             'contact_id': cid,
             'subject': m['subject'],
+            'display_subject': display_text(m['subject']),
             'last_message_at': m['sent_at'],
             'message_count': 1,
             'status': 'active'
@@ -211,15 +191,20 @@ def flush_buffer(session, contacts_dict, messages_list):
             'contact_id': email_to_id.get(m['email']),
             'message_id': m['message_id'],
             'sender_type': m['sender_type'],
-            'content_body': m['content_body'],
+            'content_body': None, # Goes to the body store below
+            'snippet': make_snippet(m['content_body']),
             'subject': m['subject'],
             'sent_at': m['sent_at'],
             'metadata_': json.dumps(m['metadata_'])
         })
         
     stmt_m = insert(Message).values(msgs_data)
-    stmt_m = stmt_m.on_conflict_do_nothing(index_elements=['message_id'])
-    session.execute(stmt_m)
+    stmt_m = stmt_m.on_conflict_do_nothing(index_elements=['message_id']).returning(Message.id, Message.message_id)
+    inserted = session.execute(stmt_m).fetchall()
+    body_by_mid = {m['message_id']: m['content_body'] for m in valid_msgs}
+    store_bodies(session, {pk: body_by_mid[mid] for pk, mid in inserted if body_by_mid.get(mid)})
+    adjust_stat_counters(session, thread_deltas(t['status'] for t in threads_data) + Counter(messages=len(inserted)))
+    bump_data_version(session)
     session.commit()
 
 def process_mbox_streaming(file_path, session):
@@ -295,8 +280,11 @@ def main():
     try:
         import glob
         files = glob.glob(target_path)
-        for f in files:
-            process_mbox_streaming(f, session)
+        with deferred_indexes(engine, "threads", "messages"):
+            for f in files:
+                process_mbox_streaming(f, session)
+        bump_data_version(session)
+        session.commit()
     finally:
         session.close()
 
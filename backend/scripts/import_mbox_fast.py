@@ -3,8 +3,12 @@ import email
 from email.utils import parseaddr, parsedate_to_datetime
 import os
 import argparse
+from collections import Counter
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from app.models import engine, SessionLocal, Contact, Thread, Message, create_tables
+from app.pipeline import bump_data_version, adjust_stat_counters, thread_deltas, deferred_indexes
+from app.utils import display_text
 from sqlalchemy.dialects.postgresql import insert
 from datetime import datetime
 import json
@@ -52,12 +56,24 @@ def is_human_email(msg):
     if not is_valid_email(addr): return False
     return True
 
+# Rows inserted since the last commit; added to the /stats counters with it
+inserted_rows = Counter()
+
+def commit_batch(session):
+    adjust_stat_counters(session, inserted_rows)
+    inserted_rows.clear()
+    bump_data_version(session)
+    session.commit()
+
 def get_or_create_contact(session, email_addr, name):
+    if session.execute(select(Contact.id).where(Contact.email == email_addr)).first() is None:
+        inserted_rows["contacts"] += 1
+    display_name = display_text(name)
     stmt = insert(Contact).values(
-        email=email_addr, name=name, closeness_score=0
+        email=email_addr, name=name, display_name=display_name, closeness_score=0
     ).on_conflict_do_update(
         index_elements=['email'],
-        set_=dict(name=name, updated_at=datetime.now())
+        set_=dict(name=name, display_name=display_name, updated_at=datetime.now())
     ).returning(Contact.id)
     return session.execute(stmt).scalar()
 
@@ -83,9 +99,10 @@ def process_message_data(session, msg_bytes):
         
         subject = message.get('Subject', '')
         # Thread creation (Naive)
-        thread = Thread(contact_id=contact_id, subject=subject, last_message_at=sent_at)
+        thread = Thread(contact_id=contact_id, subject=subject, display_subject=display_text(subject), last_message_at=sent_at)
         session.add(thread)
         session.flush()
+        inserted_rows.update(thread_deltas([thread.status]))
         
         metadata = {
             "To": message.get('To'),
@@ -105,7 +122,7 @@ def process_message_data(session, msg_bytes):
             content_body="Pending extraction",
             metadata_=metadata
         ).on_conflict_do_nothing()
-        session.execute(stmt)
+        inserted_rows["messages"] += session.execute(stmt).rowcount
         
         return True, msg_id
     except Exception as e:
@@ -129,7 +146,7 @@ def process_mbox_fast(file_path):
     start_time = time.time()
     
     try:
-        with open(file_path, 'rb') as f:
+        with deferred_indexes(engine, "threads", "messages"), open(file_path, 'rb') as f:
             buffer = []
             for line in f:
                 if shutdown_requested: break
@@ -144,7 +161,7 @@ def process_mbox_fast(file_path):
                                  last_msg_id = mid
                              
                              if processed_in_batch >= BATCH_SIZE:
-                                 session.commit()
+                                 commit_batch(session)
                                  save_progress(current_index + 1, last_msg_id)
                                  
                                  elapsed = time.time() - start_time
@@ -167,8 +184,9 @@ def process_mbox_fast(file_path):
                 if success:
                     processed_in_batch += 1
                     last_msg_id = mid
+            commit_batch(session) # Release the tables before the indexes are rebuilt
                             
-        session.commit()
+        commit_batch(session)
         save_progress(current_index + 1, last_msg_id)
         print(f"🎉 Finished! Total processed: {current_index + 1}")
         
@@ -0,0 +1,95 @@
+import argparse
+import random
+from sqlalchemy import text
+from app.models import engine, create_tables
+from app.pipeline import bump_data_version
+from app.body_store import (
+    store_bodies, fetch_bodies, train_dictionary, latest_dict_id, PENDING_BODY,
+)
+
+BATCH_SIZE = 2000
+DICT_SAMPLES = 5000
+
+def train_dict(conn):
+    # Sample from the store and from bodies still inline
+    ids = [r[0] for r in conn.execute(text(f"""
+        SELECT id FROM messages
+        WHERE snippet != '' OR content_body NOT IN ('{PENDING_BODY}', '')
+    """)).fetchall()]
+    if not ids:
+        print("   - No bodies to train on.")
+        return None
+    sample_ids = random.sample(ids, min(DICT_SAMPLES, len(ids)))
+    samples = [b for b in fetch_bodies(conn, sample_ids).values() if b]
+    data = train_dictionary(samples)
+    dict_id = conn.execute(text("INSERT INTO body_dicts (data, created_at) VALUES (:data, CURRENT_TIMESTAMP) RETURNING id"), {"data": data}).scalar()
+    conn.commit()
+    print(f"   - Trained dictionary #{dict_id} ({len(data) // 1024} KiB) from {len(samples)} bodies.")
+    return dict_id
+
+def move_inline_bodies(conn):
+    """Move bodies still stored in messages.content_body into the body store."""
+    moved = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(text(f"""
+            SELECT id, content_body FROM messages
+            WHERE id > :last_id AND content_body IS NOT NULL AND content_body != '{PENDING_BODY}'
+            ORDER BY id LIMIT :limit
+        """), {"last_id": last_id, "limit": BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+        store_bodies(conn, {r[0]: r[1] for r in rows})
+        conn.commit()
+        moved += len(rows)
+        last_id = rows[-1][0]
+        print(f"     ... moved {moved} bodies", end='\r')
+    print(f"   - Moved {moved} inline bodies into the body store.")
+    return moved
+
+def recompress(conn, dict_id):
+    """Re-encode stored bodies that don't use the given dictionary yet."""
+    done = 0
+    last_id = 0
+    while True:
+        ids = [r[0] for r in conn.execute(text("""
+            SELECT message_id FROM message_bodies
+            WHERE message_id > :last_id AND (dict_id IS NULL OR dict_id != :dict_id)
+            ORDER BY message_id LIMIT :limit
+        """), {"last_id": last_id, "dict_id": dict_id, "limit": BATCH_SIZE}).fetchall()]
+        if not ids:
+            break
+        store_bodies(conn, fetch_bodies(conn, ids))
+        conn.commit()
+        done += len(ids)
+        last_id = ids[-1]
+        print(f"     ... recompressed {done} bodies", end='\r')
+    print(f"   - Recompressed {done} bodies with dictionary #{dict_id}.")
+
+def run_migration(train=False, vacuum=False):
+    print("📦 Moving message bodies into the compressed body store...")
+    create_tables()
+    with engine.connect() as conn:
+        if train:
+            train_dict(conn)
+        moved = move_inline_bodies(conn)
+        dict_id = latest_dict_id(conn)
+        if train and dict_id:
+            recompress(conn, dict_id)
+        if moved or train:
+            bump_data_version(conn, filters=False) # Snippets changed
+            conn.commit()
+
+    if vacuum and engine.dialect.name == "sqlite":
+        # Hand the freed pages back to the filesystem
+        print("   - VACUUM...")
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
+    print("✅ Body store migration complete.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move inline message bodies into the compressed body store")
+    parser.add_argument("--train-dict", action="store_true", help="Train a zstd dictionary on current bodies and recompress with it")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM the SQLite file afterwards to reclaim space")
+    args = parser.parse_args()
+    run_migration(train=args.train_dict, vacuum=args.vacuum)
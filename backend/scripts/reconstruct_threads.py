@@ -2,6 +2,8 @@ import re
 import networkx as nx
 from sqlalchemy import text
 from app.models import engine
+from app.pipeline import bump_data_version, adjust_stat_counters, thread_deltas, delete_threads
+from app.utils import display_text
 
 def normalize_msg_id(mid):
     if not mid: return None
@@ -170,14 +172,15 @@ def reconstruct_threads_strict_v2():
         
         # Bulk Insert
         created_ids = []
-        stmt_ins = text("INSERT INTO threads (subject, contact_id, status, created_at) VALUES (:subject, :contact_id, :status, NOW()) RETURNING id")
+        stmt_ins = text("INSERT INTO threads (subject, display_subject, contact_id, status, created_at) VALUES (:subject, :display_subject, :contact_id, :status, NOW()) RETURNING id")
         
         for i, item in enumerate(inserts):
-            res = conn.execute(stmt_ins, item).scalar()
+            res = conn.execute(stmt_ins, {**item, "display_subject": display_text(item["subject"])}).scalar()
             created_ids.append(res)
             if i % 1000 == 0:
                  print(f"       .. {i}", end='\r')
         print(f"       .. Done")
+        adjust_stat_counters(conn, thread_deltas(item["status"] for item in inserts))
         
         # Assign
         print("   - Linking...")
@@ -196,7 +199,7 @@ def reconstruct_threads_strict_v2():
         conn.commit()
         
         # Cleanup
-        conn.execute(text("DELETE FROM threads WHERE id NOT IN (SELECT DISTINCT thread_id FROM messages)"))
+        delete_threads(conn, "id NOT IN (SELECT DISTINCT thread_id FROM messages)")
         
         # Stats
         conn.execute(text("""
@@ -210,6 +213,7 @@ def reconstruct_threads_strict_v2():
             ) sub
             WHERE threads.id = sub.thread_id
         """))
+        bump_data_version(conn)
         conn.commit()
 
     print("✅ Strict V2 Complete.")
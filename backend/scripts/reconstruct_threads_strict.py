@@ -2,6 +2,11 @@ import re
 import networkx as nx
 from sqlalchemy import text
 from app.models import engine
+from app.pipeline import (
+    mark_threads_dirty, mark_orphan_thread_contacts_dirty, bump_data_version,
+    adjust_stat_counters, thread_deltas, delete_threads,
+)
+from app.utils import display_text
 from collections import defaultdict
 
 def normalize_msg_id(mid):
@@ -255,14 +260,15 @@ def reconstruct_threads_hybrid():
         if inserts:
             print("   - Inserting new threads...")
             created_ids = []
-            stmt = text("INSERT INTO threads (subject, created_at, status, contact_id) VALUES (:subject, NOW(), :status, :cid) RETURNING id")
+            stmt = text("INSERT INTO threads (subject, display_subject, created_at, status, contact_id) VALUES (:subject, :display_subject, NOW(), :status, :cid) RETURNING id")
             
             for i, item in enumerate(inserts):
-                res = conn.execute(stmt, item).scalar()
+                res = conn.execute(stmt, {**item, "display_subject": display_text(item["subject"])}).scalar()
                 created_ids.append(res)
                 if i % 1000 == 0:
                     print(f"     ... created {i}/{len(inserts)}", end='\r')
             print(f"     ... created {len(created_ids)}/{len(inserts)}")
+            adjust_stat_counters(conn, thread_deltas(item["status"] for item in inserts))
             
             # Now map pending_idx to real IDs
             # msg_updates contains 'pending_idx'
@@ -275,6 +281,15 @@ def reconstruct_threads_hybrid():
                 
             msg_updates = final_updates
 
+        # Reused threads that gain or lose messages need rescoring
+        # (newly inserted threads are dirty by default).
+        touched_tids = set()
+        for item in msg_updates:
+            touched_tids.add(item['tid'])
+            touched_tids.add(pk_to_tid.get(item['pk']))
+        dirty_count = mark_threads_dirty(conn, touched_tids)
+        print(f"   - Marked {dirty_count} threads for rescoring.")
+
         # Batch Update Messages
         print(f"   - Updating {len(msg_updates)} messages...")
         if msg_updates:
@@ -291,7 +306,8 @@ def reconstruct_threads_hybrid():
             
         # Cleanup
         print("   - Cleanup...")
-        conn.execute(text("DELETE FROM threads WHERE id NOT IN (SELECT DISTINCT thread_id FROM messages)"))
+        mark_orphan_thread_contacts_dirty(conn)
+        delete_threads(conn, "id NOT IN (SELECT DISTINCT thread_id FROM messages)")
         
         # Stats
         conn.execute(text("""
@@ -305,6 +321,7 @@ def reconstruct_threads_hybrid():
             ) sub
             WHERE threads.id = sub.thread_id
         """))
+        bump_data_version(conn)
         conn.commit()
     
     print("✅ Hybrid Reconstruction Complete.")
@@ -2,26 +2,26 @@ import sys
 import os
 from sqlalchemy import text
 from app.models import engine
+from app.pipeline import chunked, bump_data_version, set_thread_status
 
 def run_filtering():
     print("🧹 Starting filtering process (Phase 1)...")
     
     with engine.connect() as conn:
-        # Reset all to active first (to allow re-run)
-        conn.execute(text("UPDATE threads SET status = 'active'"))
-        conn.commit()
-        
+        # Decide every thread's status from scratch (to allow re-run), but only
+        # write the ones that actually change so the scorer's dirty set stays small.
+        stmt_fetch = text("""
+            SELECT t.id, t.status, t.message_count, c.email 
+            FROM threads t
+            JOIN contacts c ON t.contact_id = c.id
+        """)
+        rows = conn.execute(stmt_fetch).fetchall()
+
         # 1. Filter "Too Many Messages" (Likely Newsletters/System Logs)
         # Relaxed threshold to 300 based on user feedback (projects can be large).
         print("   - Marking very high-frequency threads (>300 msgs) as 'ignored'...")
-        stmt_high_freq = text("""
-            UPDATE threads 
-            SET status = 'ignored' 
-            WHERE message_count > 300 
-            AND status = 'active';
-        """)
-        result = conn.execute(stmt_high_freq)
-        print(f"     -> {result.rowcount} threads ignored (too many messages > 300).")
+        high_freq_tids = set(row[0] for row in rows if (row[2] or 0) > 300)
+        print(f"     -> {len(high_freq_tids)} threads ignored (too many messages > 300).")
 
         # 2. Filter by Sender Email Keywords (Blacklist) - Python Logic for safety
         print("   - Filtering blacklist keywords (Python-side check)...")
@@ -33,40 +33,32 @@ def run_filtering():
             'auto-confirm', 'confirm@', 'account@', 'admin@', 'service@'
         ]
         
-        # Fetch all active threads with their contact emails
         # Doing this in Python is slower but 100% reliable compared to SQLite LIKE nuances
-        stmt_fetch = text("""
-            SELECT t.id, c.email 
-            FROM threads t
-            JOIN contacts c ON t.contact_id = c.id
-            WHERE t.status = 'active'
-        """)
-        rows = conn.execute(stmt_fetch).fetchall()
-        
-        ignored_tids = []
+        blacklisted_tids = set()
         for row in rows:
-            tid, email = row
-            if not email: continue
+            tid, email = row[0], row[3]
+            if not email or tid in high_freq_tids: continue
             
             email_lower = email.lower()
             for kw in blacklist:
                 if kw in email_lower:
-                    ignored_tids.append(tid)
+                    blacklisted_tids.add(tid)
                     break
-        
-        # Batch update ignored threads
-        if ignored_tids:
-            # Chunking for SQLite limits
-            chunk_size = 500
-            for i in range(0, len(ignored_tids), chunk_size):
-                chunk = ignored_tids[i:i+chunk_size]
+        print(f"     -> {len(blacklisted_tids)} threads ignored (blacklisted keywords).")
+
+        # 3. Apply only the status changes
+        ignored = high_freq_tids | blacklisted_tids
+        to_ignore = [row[0] for row in rows if row[0] in ignored and row[1] != 'ignored']
+        to_activate = [row[0] for row in rows if row[0] not in ignored and row[1] != 'active']
+
+        # Chunking for SQLite limits
+        for status, tids in (('ignored', to_ignore), ('active', to_activate)):
+            for chunk in chunked(tids):
                 tids_str = ",".join(str(t) for t in chunk)
-                conn.execute(text(f"UPDATE threads SET status = 'ignored' WHERE id IN ({tids_str})"))
-            
-            conn.commit()
-            print(f"     -> {len(ignored_tids)} threads ignored (blacklisted keywords).")
-        else:
-            print("     -> 0 threads ignored.")
+                set_thread_status(conn, status, f"id IN ({tids_str})", also_set=", features_dirty = TRUE")
+        bump_data_version(conn)
+        conn.commit()
+        print(f"   - Status changes: {len(to_ignore)} -> ignored, {len(to_activate)} -> active.")
 
     print("------------------------------")
     print("🎯 Filtering Complete.")
@@ -0,0 +1,37 @@
+import argparse
+from sqlalchemy import text
+from app.models import engine, create_tables
+from app.fulltext import index_pending_messages, has_search_index, clear_search_index
+
+def sync_index(rebuild=False):
+    print("🔎 Syncing the keyword search index...")
+    create_tables()
+    with engine.connect() as conn:
+        if not has_search_index(conn):
+            print("   - No FTS5 index on this database (SQLite only); skipping.")
+            return
+        if rebuild:
+            clear_search_index(conn)
+            conn.execute(text("INSERT OR IGNORE INTO messages_fts_pending (message_id) SELECT id FROM messages"))
+            conn.commit()
+        done = 0
+        while True:
+            n = index_pending_messages(conn)
+            conn.commit()
+            if not n:
+                break
+            done += n
+            print(f"     ... indexed {done} messages", end='\r')
+        print(f"   - Indexed {done} messages.")
+        if rebuild or done:
+            # Merge the segments written batch by batch
+            conn.execute(text("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')"))
+            conn.execute(text("INSERT INTO messages_fts_bigrams (messages_fts_bigrams) VALUES ('optimize')"))
+            conn.commit()
+    print("✅ Search index up to date.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index queued messages into the FTS5 keyword search index")
+    parser.add_argument("--rebuild", action="store_true", help="Drop and re-index every message")
+    args = parser.parse_args()
+    sync_index(rebuild=args.rebuild)
@@ -11,6 +11,8 @@ interface Thread {
   sender_name: string;
   date: string;
   body: string;
+  subject_html?: string; // search hits: HTML-escaped, matches wrapped in <mark>
+  snippet_html?: string;
   score: number;
   message_count: number;
   is_high_value: boolean;
@@ -44,7 +46,7 @@ export default function Home() {
   // Data States
   const [contacts, setContacts] = useState<Contact[]>([]);
   const [totalContacts, setTotalContacts] = useState(0);
-  const [offset, setOffset] = useState(0);
+  const [cursor, setCursor] = useState<string | null>(null);
   const [hasMore, setHasMore] = useState(true);
   const [threads, setThreads] = useState<Thread[]>([]); // For search results
 
@@ -59,7 +61,7 @@ export default function Home() {
   // Initial Load (Contacts)
   useEffect(() => {
     fetchStats();
-    fetchContacts(0, true);
+    fetchContacts(null, true);
 
     // Restore scroll
     const savedScroll = sessionStorage.getItem('scrollPos');
@@ -75,19 +77,23 @@ export default function Home() {
     fetch('http://localhost:8000/stats')
       .then(res => res.json())
       .then(data => {
-        // This is raw total, but our list is 'active' contacts.
-        // Ideally we should know active count. For now, show total known.
-        setTotalContacts(data.contacts);
+        // The list only shows contacts with active threads
+        setTotalContacts(data.active_contacts ?? data.contacts);
       })
       .catch(console.error);
   };
 
-  const fetchContacts = (currentOffset = 0, reset = false) => {
+  const fetchContacts = (currentCursor: string | null = null, reset = false) => {
     if (reset) setLoading(true);
     const limit = 50;
-    fetch(`http://localhost:8000/contacts?limit=${limit}&offset=${currentOffset}`)
-      .then(res => res.json())
-      .then(data => {
+    const cursorParam = currentCursor ? `&cursor=${encodeURIComponent(currentCursor)}` : '';
+    fetch(`http://localhost:8000/contacts?limit=${limit}${cursorParam}`)
+      .then(res => {
+        // Keyset pagination: the next page's cursor comes back in a header (absent on the last page)
+        const nextCursor = res.headers.get('X-Next-Cursor');
+        return res.json().then(data => ({ data, nextCursor }));
+      })
+      .then(({ data, nextCursor }) => {
         if (reset) {
           setContacts(data);
           setLoading(false);
@@ -95,13 +101,8 @@ export default function Home() {
           setContacts(prev => [...prev, ...data]);
         }
 
-        if (data.length < limit) {
-          setHasMore(false);
-        } else {
-          setHasMore(true);
-        }
-
-        setOffset(currentOffset + limit);
+        setHasMore(!!nextCursor);
+        setCursor(nextCursor);
       })
       .catch(err => {
         console.error(err);
@@ -110,21 +111,21 @@ export default function Home() {
   };
 
   const handleLoadMore = () => {
-    fetchContacts(offset, false);
+    fetchContacts(cursor, false);
   };
 
 
   const performSearch = (query: string) => {
     if (!query.trim()) {
       setIsSearching(false);
-      fetchContacts(0, true); // Revert to contacts view
+      fetchContacts(null, true); // Revert to contacts view
       return;
     }
 
     setIsSearching(true);
     setLoading(true);
-    // Use existing search endpoint (returns threads)
-    fetch(`http://localhost:8000/search?q=${encodeURIComponent(query)}&limit=20`)
+    // Hybrid search: keyword + semantic hits fused server-side, one per thread
+    fetch(`http://localhost:8000/search?q=${encodeURIComponent(query)}&limit=20&mode=hybrid&group=thread`)
       .then(res => res.json())
       .then(data => {
         // Map to Thread interface
@@ -134,6 +135,8 @@ export default function Home() {
           sender_name: item.sender || "Unknown",
           date: item.date,
           body: item.body || "",
+          subject_html: item.subject_html,
+          snippet_html: item.snippet_html,
           score: item.score,
           message_count: 0, // Not provided by current search API
           is_high_value: false, // Not provided
@@ -141,9 +144,7 @@ export default function Home() {
           originalIndex: index
         }));
 
-        // Dedup
-        const uniqueResults = Array.from(new Map(results.map((item: any) => [item.id, item])).values());
-        setThreads(uniqueResults as Thread[]);
+        setThreads(results as Thread[]);
         setLoading(false);
       })
       .catch(err => {
@@ -160,7 +161,7 @@ export default function Home() {
       } else if (isSearching) {
         // Query cleared but state says searching -> revert
         setIsSearching(false);
-        fetchContacts(0, true);
+        fetchContacts(null, true);
       }
     }, 500);
     return () => clearTimeout(timer);
@@ -218,7 +219,7 @@ export default function Home() {
   return (
     <main className={styles.main}>
       <header className={styles.header}>
-        <div className={styles.brand} onClick={() => { setSearchQuery(''); setIsSearching(false); fetchContacts(0, true); }} style={{ cursor: 'pointer' }}>
+        <div className={styles.brand} onClick={() => { setSearchQuery(''); setIsSearching(false); fetchContacts(null, true); }} style={{ cursor: 'pointer' }}>
           <img src="/logo.png" alt="PastLead" className={styles.logoImage} />
           <span className={styles.badge}>Beta</span>
         </div>
@@ -235,7 +236,7 @@ export default function Home() {
         </div>
       </header>
 
-      <SettingsModal isOpen={showSettings} onClose={() => { setShowSettings(false); fetchContacts(0, true); }} />
+      <SettingsModal isOpen={showSettings} onClose={() => { setShowSettings(false); fetchContacts(null, true); }} />
 
 
       <div className={styles.container}>
@@ -286,7 +287,14 @@ export default function Home() {
                     <span className={styles.date}>{new Date(thread.date).toLocaleDateString()}</span>
                   </div>
                 </div>
-                <div className={styles.subject}>{thread.subject}</div>
+                {thread.subject_html ? (
+                  <div className={styles.subject} dangerouslySetInnerHTML={{ __html: thread.subject_html }} />
+                ) : (
+                  <div className={styles.subject}>{thread.subject}</div>
+                )}
+                {thread.snippet_html && (
+                  <div className={styles.searchSnippet} dangerouslySetInnerHTML={{ __html: thread.snippet_html }} />
+                )}
               </div>
             ))}
           </div>
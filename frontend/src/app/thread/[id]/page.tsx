@@ -1,5 +1,5 @@
 'use client';
-import { useEffect, useState, useRef } from 'react';
+import { useEffect, useState, useRef, useCallback } from 'react';
 import { useParams, useRouter } from 'next/navigation';
 import styles from './page.module.css';
 
@@ -8,9 +8,14 @@ interface Message {
     sender_type: string;
     sender_name: string;
     date: string;
-    body: string;
+    snippet: string;
+    body: string | null; // null until loaded (see BODY_PAGE)
 }
 
+// Full bodies are fetched in windows of this size as the reader scrolls;
+// messages further down show their snippet until then.
+const BODY_PAGE = 20;
+
 
 interface AiAnalysis {
     summary: string;
@@ -26,6 +31,8 @@ export default function ThreadDetail() {
     const router = useRouter();
     const [messages, setMessages] = useState<Message[]>([]);
     const [loading, setLoading] = useState(true);
+    const [bodyCursor, setBodyCursor] = useState<string | null>(null);
+    const loadingBodiesRef = useRef(false);
 
     // AI State
     const [aiAnalysis, setAiAnalysis] = useState<AiAnalysis | null>(null);
@@ -42,14 +49,18 @@ export default function ThreadDetail() {
         // Reset state if ID changes
         if (fetchedIdRef.current !== currentId) {
             setMessages([]);
+            setBodyCursor(null);
             setAiAnalysis(null);
             setLoading(true);
             setAiLoading(true);
             fetchedIdRef.current = currentId; // Mark as fetching for this ID
 
             // Fetch Messages
-            fetch(`http://localhost:8000/threads/${currentId}/messages`)
-                .then(res => res.json())
+            fetch(`http://localhost:8000/threads/${currentId}/messages?body_limit=${BODY_PAGE}`)
+                .then(res => {
+                    setBodyCursor(res.headers.get('X-Next-Cursor'));
+                    return res.json();
+                })
                 .then(data => {
                     setMessages(data);
                     setLoading(false);
@@ -73,6 +84,46 @@ export default function ThreadDetail() {
         }
     }, [params.id]);
 
+    const mergeBodies = (items: { id: number; body: string | null }[]) => {
+        const byId = new Map(items.map(item => [item.id, item.body]));
+        setMessages(prev => prev.map(m => byId.has(m.id) ? { ...m, body: byId.get(m.id) ?? '' } : m));
+    };
+
+    // Next window of bodies, continuing from the cursor
+    const loadMoreBodies = useCallback(() => {
+        if (!bodyCursor || loadingBodiesRef.current) return;
+        loadingBodiesRef.current = true;
+        fetch(`http://localhost:8000/threads/${fetchedIdRef.current}/bodies?limit=${BODY_PAGE}&cursor=${encodeURIComponent(bodyCursor)}`)
+            .then(res => {
+                setBodyCursor(res.headers.get('X-Next-Cursor'));
+                return res.json();
+            })
+            .then(mergeBodies)
+            .catch(console.error)
+            .finally(() => { loadingBodiesRef.current = false; });
+    }, [bodyCursor]);
+
+    // A single message the reader expanded ahead of the window
+    const loadBody = (id: number) => {
+        fetch(`http://localhost:8000/threads/${fetchedIdRef.current}/bodies?ids=${id}`)
+            .then(res => res.json())
+            .then(mergeBodies)
+            .catch(console.error);
+    };
+
+    // Load the next window once the first message without a body scrolls into view
+    const observerRef = useRef<IntersectionObserver | null>(null);
+    const pendingRef = useCallback((node: HTMLDivElement | null) => {
+        observerRef.current?.disconnect();
+        if (!node) return;
+        observerRef.current = new IntersectionObserver(entries => {
+            if (entries.some(e => e.isIntersecting)) loadMoreBodies();
+        }, { rootMargin: '400px' });
+        observerRef.current.observe(node);
+    }, [loadMoreBodies]);
+
+    const firstPendingId = messages.find(m => m.body === null)?.id;
+
     if (loading) {
         return <div className={styles.loading}>Loading conversation...</div>;
     }
@@ -134,7 +185,7 @@ export default function ThreadDetail() {
 
                 <div className={styles.timeline}>
                     {messages.map((msg) => (
-                        <div key={msg.id} className={styles.messageRow}>
+                        <div key={msg.id} className={styles.messageRow} ref={msg.id === firstPendingId ? pendingRef : undefined}>
                             <div className={styles.avatar}>
                                 {msg.sender_name.charAt(0).toUpperCase()}
                             </div>
@@ -144,9 +195,14 @@ export default function ThreadDetail() {
                                     <span className={styles.date}>{new Date(msg.date).toLocaleString()}</span>
                                 </div>
                                 <div className={styles.body}>
-                                    {msg.body.split('\n').map((line, i) => (
+                                    {(msg.body ?? msg.snippet).split('\n').map((line, i) => (
                                         <p key={i}>{line}</p>
                                     ))}
+                                    {msg.body === null && (
+                                        <button className={styles.expandBtn} onClick={() => loadBody(msg.id)}>
+                                            全文を表示
+                                        </button>
+                                    )}
                                 </div>
                             </div>
                         </div>
@@ -23,6 +23,12 @@ else
     source venv/bin/activate
 fi
 export PYTHONPATH=$PYTHONPATH:$(pwd)/backend
+# Pipeline steps use the bulk-load connection profile (see backend/app/models.py).
+# On Postgres it sets synchronous_commit=off: an OS crash or power loss can drop
+# the last moments of commits (the database stays consistent). After one, delete
+# import_progress.json and re-run, so the import doesn't resume past lost rows.
+# DB_PROFILE=default ./run_pipeline.sh keeps every commit durable.
+export DB_PROFILE=${DB_PROFILE:-bulk}
 
 # 2. DB Check & Migration
 log "🔹 Step 2: Database Check"
@@ -37,14 +43,8 @@ fi
 log "Ensuring pgvector extension..."
 docker exec -i knowhow_db psql -U user -d knowhow_db -c "CREATE EXTENSION IF NOT EXISTS vector;" >> "$LOG_FILE" 2>&1
 
-# Ensure schema migration (for status column)
-# We run a small script to ensure tables match models
-python -c "from app.models import create_tables; create_tables()" >> "$LOG_FILE" 2>&1
-# Also ensure status column exists if table already existed (idempotent check)
-python -c "from app.models import engine; from sqlalchemy import text; 
-with engine.connect() as conn: 
-    conn.execute(text('ALTER TABLE threads ADD COLUMN IF NOT EXISTS status TEXT DEFAULT ''active''')); 
-    conn.commit();" >> "$LOG_FILE" 2>&1
+# Create tables and apply pending schema migrations (app/migrations.py)
+python -m app.migrations >> "$LOG_FILE" 2>&1
 
 # 3. Import (Fast Mode + Resume Support)
 log "🔹 Step 3: Mbox Import"
@@ -70,6 +70,10 @@ log "🔹 Step 4: Thread Reconstruction"
 log "Start Strict V2 Reconstruction (Header + Subject Guard)..."
 python -u backend/scripts/reconstruct_threads.py 2>&1 | tee -a "$LOG_FILE"
 
+# Decoded display columns for rows imported before they existed (the API
+# doesn't backfill them itself)
+python -u backend/scripts/backfill_display_columns.py 2>&1 | tee -a "$LOG_FILE"
+
 # 5. Filtering (Noise Reduction)
 log "🔹 Step 5: Filtering & Noise Reduction"
 log "Identifying important threads (Multiple messages, non-bulk)..."
@@ -90,5 +94,9 @@ log "🔹 Step 8: Feature Extraction & Scoring"
 log "Extracting economic values and calculating initial scores..."
 python -u backend/scripts/extract_features.py 2>&1 | tee -a "$LOG_FILE"
 
+# 9. Keyword Search Index
+log "🔹 Step 9: Keyword Search Index"
+python -u backend/scripts/sync_search_index.py 2>&1 | tee -a "$LOG_FILE"
+
 log "✅ Pipeline Completed Successfully!"
 log "Next: Run 'npm run dev' in frontend/ directory to view results."